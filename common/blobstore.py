@@ -0,0 +1,159 @@
+"""
+Developer Server / Lobby Server 共用的 content-addressed blob store
+
+原本每個版本是一份完整 zip（uploaded_games/），lobby 再解壓一份到 game_runtime/，
+下載時又替每位玩家 shutil.copy 一份。這裡改成依內容 sha256 存檔：
+
+- blobs/{sha[:2]}/{sha}：每份內容只存一次（跨版本、跨遊戲、跨玩家）
+- 上架時 zip 本身和 zip 裡的每個檔案都放進 blob store，
+  uploaded_games/ 裡的 zip 只是指向 blob 的 hardlink
+- 解壓到 game_runtime/、server 端的玩家下載資料夾都改成 hardlink，不再複製內容
+- blob 設成唯讀，hardlink 出去的檔案被原地修改會直接失敗，不會改壞共用的內容
+- 不同 filesystem（EXDEV）或不支援 hardlink 時退回複製
+
+GAME_BLOB_DIR 可以指定 blob store 位置（預設 developer_client/blobs）。
+"""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+from common.hashing import HASH_CHUNK, sha256_file, store_file_index
+
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR   = os.path.dirname(COMMON_DIR)
+BLOB_DIR   = os.environ.get("GAME_BLOB_DIR", os.path.join(ROOT_DIR, "developer_client", "blobs"))
+
+BLOB_MODE = 0o444
+
+
+def link_or_copy(src, dst):
+    """
+    dst 不存在時建立指向 src 的 hardlink；跨 filesystem 等情況退回複製
+    """
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copyfile(src, dst)
+
+
+def replace_with_link(src, dst):
+    """
+    把 dst（已存在或不存在）換成指向 src 的 hardlink，過程中 dst 不會消失
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # 已經是同一個 inode；rename 兩個指向同 inode 的路徑是 no-op，暫存檔會留下來
+        return
+    tmp = f"{dst}.link.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    link_or_copy(src, tmp)
+    os.replace(tmp, dst)
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def _commit(self, tmp_path, digest):
+        """
+        把寫好的暫存檔放到 blob 位置；已經有同內容的 blob 就丟掉暫存檔
+        """
+        final = self.path(digest)
+        if os.path.exists(final):
+            os.remove(tmp_path)
+            return final
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.chmod(tmp_path, BLOB_MODE)
+        os.replace(tmp_path, final)
+        return final
+
+    def _write_stream(self, reader):
+        """
+        一邊寫暫存檔一邊算 sha256，回傳 (digest, size)
+        """
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    buf = reader.read(HASH_CHUNK)
+                    if not buf:
+                        break
+                    h.update(buf)
+                    f.write(buf)
+                    size += len(buf)
+            digest = h.hexdigest()
+            self._commit(tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
+
+    def put_file(self, path, digest=None):
+        """
+        把既有檔案放進 blob store，path 本身換成指向 blob 的 hardlink；回傳 digest
+        """
+        digest = digest or sha256_file(path)
+        if not self.has(digest):
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            os.close(fd)
+            os.remove(tmp_path)
+            link_or_copy(path, tmp_path)
+            self._commit(tmp_path, digest)
+        if not os.path.samefile(path, self.path(digest)):
+            replace_with_link(self.path(digest), path)
+        return digest
+
+    def ingest_zip(self, zip_path, index=True):
+        """
+        zip 裡每個檔案各存成一個 blob，回傳 file index {path: {"sha256", "size"}}
+        （index=True 時同時寫進 {zip}.files.json，lobby 算 delta / 解壓都用它；
+        上架前檢查的是暫存檔，改名後才由呼叫端寫）
+        """
+        files = {}
+        with zipfile.ZipFile(zip_path, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info) as member:
+                    digest, size = self._write_stream(member)
+                files[info.filename] = {"sha256": digest, "size": size}
+        if index:
+            store_file_index(zip_path, files)
+        return files
+
+    def missing(self, files):
+        return [p for p, e in files.items() if not self.has(e["sha256"])]
+
+    def materialize(self, files, target_dir):
+        """
+        依 file index 在 target_dir 用 hardlink 組出整個版本（先組在 .tmp 再改名）
+        """
+        tmp_dir = target_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        root = os.path.normpath(tmp_dir)
+        for rel_path, entry in files.items():
+            dst = os.path.normpath(os.path.join(tmp_dir, rel_path))
+            if os.path.isabs(rel_path) or not dst.startswith(root + os.sep):
+                raise ValueError(f"unsafe path in game package: {rel_path}")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            link_or_copy(self.path(entry["sha256"]), dst)
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        os.replace(tmp_dir, target_dir)
+        return target_dir
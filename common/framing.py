@@ -0,0 +1,62 @@
+"""
+4-byte length-prefixed framing（和 developer_server.client_thread 讀 meta 的格式一樣）
+
+每個 frame：4 bytes big-endian 長度 + 內容（JSON）。同一條連線可以連續送多個
+request / response，不用再靠 shutdown(SHUT_WR) / 關連線來判斷訊息結束。
+"""
+import json
+
+HEADER_SIZE = 4
+MAX_FRAME   = 16 * 1024 * 1024   # 防止亂送的長度讓 server 配置超大 buffer
+
+
+class FrameError(ConnectionError):
+    """
+    連線在 frame 中間斷掉，或長度不合理；呼叫端當作一般的連線錯誤處理
+    """
+
+
+def recv_exact(sock, n):
+    """
+    讀滿 n bytes；連線在一開始就關閉回傳 b""，讀到一半被關閉丟 FrameError
+    """
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            if buf:
+                raise FrameError("connection closed in the middle of a frame")
+            return b""
+        buf += chunk
+    return bytes(buf)
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    return len(payload).to_bytes(HEADER_SIZE, "big") + payload
+
+
+def read_frame(sock):
+    """
+    回傳一個 frame 的內容；對方正常關閉連線時回傳 None
+    """
+    header = recv_exact(sock, HEADER_SIZE)
+    if not header:
+        return None
+    length = int.from_bytes(header, "big")
+    if length > MAX_FRAME:
+        raise FrameError(f"frame too large: {length} bytes")
+    payload = recv_exact(sock, length)
+    if len(payload) != length:
+        raise FrameError("connection closed in the middle of a frame")
+    return payload
+
+
+def send_json_frame(sock, obj):
+    sock.sendall(encode_frame(json.dumps(obj).encode()))
+
+
+def read_json_frame(sock):
+    payload = read_frame(sock)
+    return None if payload is None else json.loads(payload.decode())
@@ -0,0 +1,260 @@
+"""
+上架時的遊戲包檢查與啟動資料（developer server 產生，lobby 直接使用）
+
+原本 zip 收完就直接上架，內容有沒有問題要等到 lobby 開始遊戲、解壓、Popen 之後才知道：
+少了 game_server.py、語法錯誤、zip bomb、../ 路徑都到玩家開局時才爆，
+lobby 每次啟動還要讀 zip 的 file index、檢查 game_server.py 在不在。
+這裡改成上架時做一次：
+
+- inspect_package：只看 central directory（不解壓）檢查路徑（絕對路徑 / .. / 反斜線 / symlink）、
+  檔案數、解壓後總大小、大檔案的壓縮比，讀選填的 game.json（人數、entry point），確認 entry point 都在
+- check_package：再把每個檔案放進 blob store（順便驗 CRC），每個 .py 用 py_compile
+  編成 checked-hash .pyc（語法錯誤直接拒絕上架），.pyc 也放進 blob store
+- build_manifest：檔案清單與 sha256、人數、entry point、.pyc，存在 versions 的 info["manifest"]；
+  lobby 建房 / 開始遊戲直接照 manifest 檢查人數、組 runtime 目錄（含 __pycache__）、啟動 entry point，不用再看 zip
+
+.pyc 只有經過 import 才會被用到：`python game_server.py` 把 entry 當 __main__ 跑，每次都重新編譯，
+所以 lobby 用 `sys.executable -m game_server`（見 entry_module）啟動，entry 本身和它 import 的模組都讀 .pyc；
+cache_tag 和上架時編譯的 interpreter 不同時（例如 lobby 換了 Python 版本）.pyc 不會放進 runtime 目錄，照常從原始碼跑。
+
+game.json（選填，放在 zip 根目錄）：
+    {"min_players": 3, "max_players": 3, "server": "game_server.py", "client": "game_client.py"}
+"""
+import importlib.util
+import json
+import os
+import py_compile
+import stat
+import sys
+import tempfile
+import zipfile
+import zlib
+
+MB = 1024 * 1024
+MAX_FILES = int(os.environ.get("DEV_PACKAGE_MAX_FILES", "2000"))
+MAX_UNPACKED = int(os.environ.get("DEV_PACKAGE_MAX_UNPACKED_MB", "1024")) * MB
+# 解壓後 / 壓縮後超過這個比例視為 zip bomb；小檔案（文字、空白）本來就壓得很小，不檢查
+MAX_RATIO = int(os.environ.get("DEV_PACKAGE_MAX_RATIO", "100"))
+RATIO_MIN_SIZE = 1 * MB
+
+CONFIG_FILE = "game.json"
+CONFIG_MAX_SIZE = 64 * 1024
+DEFAULT_ENTRY = {"server": "game_server.py", "client": "game_client.py"}
+DEFAULT_MIN_PLAYERS = 2
+
+
+class PackageError(Exception):
+    """
+    遊戲包不能上架；訊息直接回給 developer
+    """
+
+
+def unsafe_path(name):
+    """
+    解壓後可能跑到目錄外面的路徑（絕對路徑、..、Windows 路徑）
+    """
+    if name.startswith("/") or "\\" in name:
+        return True
+    parts = name.rstrip("/").split("/")
+    return ":" in parts[0] or any(p in ("", ".", "..") for p in parts)
+
+
+def is_symlink(info):
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+# ==========================
+# game.json
+# ==========================
+def parse_config(raw):
+    """
+    回傳 (entry, players)；沒有 game.json 時 raw 是 None，全部用預設值
+    """
+    entry = dict(DEFAULT_ENTRY)
+    players = {"min": DEFAULT_MIN_PLAYERS, "max": None}
+    if raw is None:
+        return entry, players
+    try:
+        config = json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        raise PackageError(f"{CONFIG_FILE} is not valid JSON")
+    if not isinstance(config, dict):
+        raise PackageError(f"{CONFIG_FILE} must be an object")
+
+    for role in ("server", "client"):
+        name = config.get(role, entry[role])
+        if not isinstance(name, str) or not name.endswith(".py") or unsafe_path(name):
+            raise PackageError(f"invalid {role} entry point in {CONFIG_FILE}")
+        entry[role] = name
+    for key, field in (("min", "min_players"), ("max", "max_players")):
+        value = config.get(field, players[key])
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 2):
+            raise PackageError(f"{field} in {CONFIG_FILE} must be an integer >= 2")
+        players[key] = value
+    if players["max"] is not None and players["max"] < players["min"]:
+        raise PackageError(f"max_players is smaller than min_players in {CONFIG_FILE}")
+    return entry, players
+
+
+# ==========================
+# 檢查
+# ==========================
+def inspect_package(zip_path):
+    """
+    只讀 central directory（和 game.json）檢查 zip，回傳
+    {"entry": {"server", "client"}, "players": {"min", "max"}, "sources": [.py 路徑]}；
+    不能上架時 raise PackageError
+    """
+    try:
+        zf = zipfile.ZipFile(zip_path, "r")
+    except (zipfile.BadZipFile, OSError):
+        raise PackageError("not a valid zip file")
+    with zf:
+        infos = zf.infolist()
+        if len(infos) > MAX_FILES:
+            raise PackageError(f"too many files ({len(infos)} > {MAX_FILES})")
+        names = set()
+        total = 0
+        for info in infos:
+            name = info.filename
+            if unsafe_path(name):
+                raise PackageError(f"unsafe path: {name}")
+            if is_symlink(info):
+                raise PackageError(f"symlinks are not allowed: {name}")
+            if info.flag_bits & 0x1:
+                raise PackageError(f"encrypted entries are not supported: {name}")
+            if name in names:
+                raise PackageError(f"duplicate entry: {name}")
+            names.add(name)
+            total += info.file_size
+            if total > MAX_UNPACKED:
+                raise PackageError(f"unpacked size exceeds {MAX_UNPACKED // MB} MB")
+            if info.file_size > RATIO_MIN_SIZE and info.file_size > info.compress_size * MAX_RATIO:
+                raise PackageError(f"suspicious compression ratio: {name}")
+
+        files = {i.filename for i in infos if not i.is_dir()}
+        raw = None
+        if CONFIG_FILE in files:
+            if zf.getinfo(CONFIG_FILE).file_size > CONFIG_MAX_SIZE:
+                raise PackageError(f"{CONFIG_FILE} is too large")
+            try:
+                raw = zf.read(CONFIG_FILE)
+            except (zipfile.BadZipFile, zlib.error, EOFError):
+                raise PackageError(f"{CONFIG_FILE} is corrupt")
+        entry, players = parse_config(raw)
+
+    missing = [name for name in entry.values() if name not in files]
+    if missing:
+        raise PackageError(f"missing entry point: {', '.join(missing)}")
+    return {
+        "entry": entry,
+        "players": players,
+        "sources": sorted(n for n in files if n.endswith(".py"))
+    }
+
+
+def bytecode_path(source):
+    """
+    source 對應的 __pycache__/*.pyc 相對路徑（和 import 找的位置一樣）
+    """
+    return importlib.util.cache_from_source(source).replace(os.sep, "/")
+
+
+def compile_sources(sources, files, blobs):
+    """
+    每個 .py 從 blob 直接編成 checked-hash .pyc（不看 mtime，hardlink 出去也有效）再放進 blob store；
+    回傳 {pyc 路徑: {"sha256", "size"}}
+    """
+    if sys.implementation.cache_tag is None:
+        return {}
+    compiled = {}
+    with tempfile.TemporaryDirectory(dir=blobs.tmp_dir) as work:
+        for i, name in enumerate(sources):
+            cfile = os.path.join(work, f"{i}.pyc")
+            try:
+                py_compile.compile(blobs.path(files[name]["sha256"]), cfile=cfile, dfile=name, doraise=True,
+                                   invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+            except py_compile.PyCompileError as e:
+                raise PackageError(f"{name} does not compile: {e.exc_type_name}: {e.exc_value}")
+            size = os.path.getsize(cfile)
+            compiled[bytecode_path(name)] = {"sha256": blobs.put_file(cfile), "size": size}
+    return compiled
+
+
+def check_package(zip_path, blobs):
+    """
+    上架前的完整檢查：inspect_package + 所有檔案放進 blob store + 編譯 .py；
+    回傳 build_manifest 用的資料（含 file index），不能上架時 raise PackageError
+    """
+    package = inspect_package(zip_path)
+    try:
+        files = blobs.ingest_zip(zip_path, index=False)
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        raise PackageError(f"corrupt zip: {e}")
+    package["files"] = files
+    package["bytecode"] = compile_sources(package.pop("sources"), files, blobs)
+    return package
+
+
+def build_manifest(package):
+    return {
+        "entry": package["entry"],
+        "players": package["players"],
+        "files": package["files"],
+        "bytecode": {"cache_tag": sys.implementation.cache_tag, "files": package["bytecode"]},
+    }
+
+
+# ==========================
+# lobby 端
+# ==========================
+def version_manifest(version_info):
+    """
+    版本的 manifest；這個功能之前上架的版本沒有，回傳 None（呼叫端退回看 zip）
+    """
+    manifest = version_info.get("manifest")
+    return manifest if isinstance(manifest, dict) else None
+
+
+def player_limits(version_info):
+    """
+    (最少, 最多) 人數；沒有宣告時是 (2, None)
+    """
+    manifest = version_manifest(version_info)
+    players = manifest.get("players", {}) if manifest else {}
+    return players.get("min") or DEFAULT_MIN_PLAYERS, players.get("max")
+
+
+def entry_module(entry):
+    """
+    entry point 對應的模組名稱（"sub/game_server.py" -> "sub.game_server"），給 `python -m` 用；
+    路徑不是合法的模組名稱時回傳 None，呼叫端改成直接跑檔案
+    """
+    parts = entry[:-len(".py")].split("/")
+    return ".".join(parts) if all(p.isidentifier() for p in parts) else None
+
+
+def runtime_files(manifest):
+    """
+    組 runtime 目錄用的 file index：原始檔 + 目前 interpreter 讀得到的 .pyc
+    """
+    files = dict(manifest["files"])
+    bytecode = manifest.get("bytecode") or {}
+    if bytecode.get("cache_tag") == sys.implementation.cache_tag:
+        files.update(bytecode.get("files", {}))
+    return files
+
+
+# ==========================
+# 玩家端（已解壓的目錄）
+# ==========================
+def local_entry(runtime_dir, role):
+    """
+    解壓後目錄裡 role（server / client）的 entry point；game.json 上架時檢查過，讀不到就用預設
+    """
+    try:
+        with open(os.path.join(runtime_dir, CONFIG_FILE), "rb") as f:
+            entry, _ = parse_config(f.read(CONFIG_MAX_SIZE + 1))
+    except (OSError, PackageError):
+        return DEFAULT_ENTRY[role]
+    return entry[role]
@@ -0,0 +1,98 @@
+"""
+檔案 digest 工具（developer server 上架時記錄、lobby 下載時發佈給 client 驗證）
+
+file index：一個版本 zip 裡每個檔案的 {path: {"sha256", "size"}}，
+lobby 用它算兩個版本之間的 delta；結果存在 zip 旁邊的 {zip}.files.json，
+zip 的 mtime / size 沒變就直接沿用。
+"""
+import hashlib
+import json
+import os
+import threading
+import zipfile
+
+HASH_CHUNK = 1024 * 1024
+INDEX_SUFFIX = ".files.json"
+
+_index_lock = threading.Lock()
+_index_cache = {}   # zip_path -> (stamp, files)
+
+
+def sha256_file(path, chunk_size=HASH_CHUNK):
+    """
+    分段讀檔計算 SHA-256，不會把整個檔案讀進記憶體
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def zip_file_index(zip_path):
+    """
+    逐一解壓 zip 內的檔案計算 sha256（資料夾 entry 略過）
+    """
+    files = {}
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            h = hashlib.sha256()
+            with zf.open(info) as member:
+                while True:
+                    buf = member.read(HASH_CHUNK)
+                    if not buf:
+                        break
+                    h.update(buf)
+            files[info.filename] = {"sha256": h.hexdigest(), "size": info.file_size}
+    return files
+
+
+def load_file_index(zip_path):
+    """
+    回傳 zip 的 file index；依序查記憶體快取、{zip}.files.json，都過期才重新計算
+    """
+    st = os.stat(zip_path)
+    stamp = [st.st_mtime_ns, st.st_size]
+    with _index_lock:
+        cached = _index_cache.get(zip_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    index_path = zip_path + INDEX_SUFFIX
+    files = None
+    try:
+        with open(index_path, "r") as f:
+            data = json.load(f)
+        if data.get("stamp") == stamp:
+            files = data["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if files is None:
+        files = zip_file_index(zip_path)
+        return store_file_index(zip_path, files)
+
+    with _index_lock:
+        _index_cache[zip_path] = (stamp, files)
+    return files
+
+
+def store_file_index(zip_path, files):
+    """
+    已經算好的 file index（例如 blob store 匯入時順便算的）寫進 {zip}.files.json
+    """
+    st = os.stat(zip_path)
+    stamp = [st.st_mtime_ns, st.st_size]
+    index_path = zip_path + INDEX_SUFFIX
+    tmp = f"{index_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"stamp": stamp, "files": files}, f)
+    os.replace(tmp, index_path)
+    with _index_lock:
+        _index_cache[zip_path] = (stamp, files)
+    return files
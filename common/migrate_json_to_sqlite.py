@@ -0,0 +1,108 @@
+"""
+一次性把舊的 JSON 資料匯入 SQLite（common/storage.py 的 SQLiteStorage）
+
+會讀：
+- developer_client/database.json（developers / games / versions / ratings）
+- server/players.json、rooms.json、room_chats.json、play_history.json，
+  加上 server/wal/ 裡尚未壓縮的 WAL（和 lobby 啟動時同一套 replay，但只讀：
+  不切新 segment、不刪舊 segment，匯入後原本的 JSON 資料仍可以直接拿來 rollback）
+
+lobby / developer server 用 SQLite 啟動時若 DB 是空的會自動跑一次（open_storage -> import_legacy），
+手動執行（先停掉 lobby / developer server）：
+    python3 common/migrate_json_to_sqlite.py
+    python3 common/migrate_json_to_sqlite.py --db /path/to/game_store.sqlite3 --force
+"""
+import argparse
+import json
+import os
+import sys
+
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR   = os.path.dirname(COMMON_DIR)
+SERVER_DIR = os.path.join(ROOT_DIR, "server")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+from common.storage import JSON_FILE, SQLITE_FILE, SQLiteStorage  # noqa: E402
+from lobby_state import LobbyState  # noqa: E402
+
+
+def load_legacy_catalog(path=JSON_FILE):
+    if not os.path.exists(path):
+        return {"developers": {}, "games": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_legacy_lobby(server_dir=SERVER_DIR):
+    state = LobbyState(
+        paths={
+            "players": os.path.join(server_dir, "players.json"),
+            "rooms": os.path.join(server_dir, "rooms.json"),
+            "chats": os.path.join(server_dir, "room_chats.json"),
+            "play_history": os.path.join(server_dir, "play_history.json"),
+        },
+        wal_dir=os.path.join(server_dir, "wal"),
+    )
+    state.load(read_only=True)
+    return {
+        "players": state.players,
+        "rooms": state.list_rooms(),
+        "chats": state.chats,
+        "play_history": [{"player": p, "game_key": g} for p, g in sorted(state.played)],
+    }
+
+
+def legacy_data_exists(catalog_path, server_dir):
+    if os.path.exists(catalog_path):
+        return True
+    names = ("players.json", "rooms.json", "room_chats.json", "play_history.json")
+    if any(os.path.exists(os.path.join(server_dir, n)) for n in names):
+        return True
+    wal_dir = os.path.join(server_dir, "wal")
+    return os.path.isdir(wal_dir) and bool(os.listdir(wal_dir))
+
+
+def import_legacy(storage, catalog_path=None, server_dir=None):
+    """
+    open_storage 用：SQLite DB 是空的時把舊 JSON 資料匯入；沒有舊資料或 DB 已經有資料（另一個 server
+    先匯入了）回傳 False。讀不到 / 格式錯的舊資料直接 raise，不要用空的 DB 啟動
+    """
+    catalog_path = catalog_path or JSON_FILE
+    server_dir = server_dir or SERVER_DIR
+    if not legacy_data_exists(catalog_path, server_dir):
+        return False
+    catalog = load_legacy_catalog(catalog_path)
+    lobby = load_legacy_lobby(server_dir)
+    if not storage.import_all(catalog, lobby, if_empty=True):
+        return False
+    print(f"[Storage] imported legacy JSON data into {storage.path}: "
+          f"{len(catalog.get('developers', {}))} developers, {len(catalog.get('games', {}))} games, "
+          f"{len(lobby['players'])} players, {len(lobby['play_history'])} play records")
+    return True
+
+
+def migrate(db_path=SQLITE_FILE, force=False):
+    storage = SQLiteStorage(db_path)
+    if not storage.is_empty() and not force:
+        print(f"❌ {db_path} 已經有資料，若確定要清空後重新匯入請加 --force")
+        return False
+
+    catalog = load_legacy_catalog()
+    lobby = load_legacy_lobby()
+    storage.import_all(catalog, lobby, replace=force)
+    storage.close()
+
+    print(f"✅ 匯入完成 -> {db_path}")
+    print(f"   developers: {len(catalog.get('developers', {}))}, games: {len(catalog.get('games', {}))}")
+    print(f"   players: {len(lobby['players'])}, rooms: {len(lobby['rooms'])}, "
+          f"chat rooms: {len(lobby['chats'])}, play records: {len(lobby['play_history'])}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=SQLITE_FILE)
+    parser.add_argument("--force", action="store_true", help="目標 DB 已有資料時先清空再匯入")
+    args = parser.parse_args()
+    sys.exit(0 if migrate(args.db, args.force) else 1)
@@ -0,0 +1,195 @@
+"""
+Lobby Server / Developer Server 共用的 session table（只在記憶體）
+
+原本每個需要登入的 request 都用 client 自己送來的名字去查 players.json / database.json
+的 online 欄位，順便把 last_seen 寫回檔案；名字可以亂填，心跳也是一次一個磁碟寫入。
+這裡改成：
+- 登入 / 註冊成功時發一個隨機的 token（secrets.token_urlsafe），之後的 request 都帶 token
+- server 只相信 token 對應到的使用者，不看 request 裡的名字
+- 每次驗證只更新記憶體裡的 last_seen（多個 request / 心跳合併成一次狀態），不寫磁碟
+- 超過 ttl 沒有任何 request 的 session 由 expire() 清掉，呼叫端再決定要不要寫回離線狀態
+  過期檢查用 min-heap 排 deadline：每次只看已經到期的項目，不用掃全部帳號 / session；
+  到期時 session 其實還有活動（心跳只改 last_seen，不動 heap）就依新的 deadline 放回去，
+  所以每個 session 每 ttl 最多進出 heap 一次
+- 同一個使用者重新登入會取代舊的 session（和原本「登入會覆蓋舊 session」一致）
+- 在線狀態（online / last_seen）的寫回交給 PresenceBatcher：登入 / 登出 / 過期先記在記憶體，
+  每 PRESENCE_FLUSH_INTERVAL 秒合併成一次批次寫入
+
+session 不會寫到磁碟：server 重啟後舊 token 都失效，client 重新登入即可。
+"""
+import heapq
+import secrets
+from bisect import bisect_left, bisect_right, insort
+import threading
+import time
+
+SESSION_TTL = 60.0      # seconds，和原本「60 秒沒心跳標記離線」一樣
+TOKEN_BYTES = 32
+EXPIRE_TICK = 1.0       # 背景檢查 heap 頂端的間隔；沒有到期的項目時只是 O(1)
+PRESENCE_FLUSH_INTERVAL = 5.0
+
+
+class SessionTable:
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.by_token = {}      # token -> {"user", "created", "last_seen"}
+        self.by_user = {}       # user -> token
+        self._deadlines = []    # min-heap of (deadline, token)；token 已失效的項目 pop 到時直接丟掉
+        self._sorted_users = [] # 在線使用者依名稱排序，給分頁 / 前綴查詢用
+
+    def create(self, user):
+        """
+        發新 token；同一個使用者舊的 token 立即失效
+        """
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        now = time.time()
+        with self.lock:
+            old = self.by_user.get(user)
+            if old is not None:
+                self.by_token.pop(old, None)
+            else:
+                insort(self._sorted_users, user)
+            self.by_token[token] = {"user": user, "created": now, "last_seen": now}
+            self.by_user[user] = token
+            heapq.heappush(self._deadlines, (now + self.ttl, token))
+        return token
+
+    def validate(self, token):
+        """
+        token 有效就更新 last_seen 並回傳使用者名稱，否則回傳 None
+        """
+        if not isinstance(token, str):
+            return None
+        now = time.time()
+        with self.lock:
+            session = self.by_token.get(token)
+            if session is None:
+                return None
+            if now - session["last_seen"] > self.ttl:
+                # 過期但還沒被 expire() 掃到；留給 expire() 清，呼叫端才會收到離線通知
+                return None
+            session["last_seen"] = now
+            return session["user"]
+
+    def revoke(self, token):
+        """
+        登出；回傳被登出的使用者，token 無效時回傳 None
+        """
+        with self.lock:
+            session = self.by_token.get(token) if isinstance(token, str) else None
+            if session is None:
+                return None
+            self._drop(token)
+            return session["user"]
+
+    def _drop(self, token):
+        session = self.by_token.pop(token)
+        if self.by_user.get(session["user"]) == token:
+            del self.by_user[session["user"]]
+            del self._sorted_users[bisect_left(self._sorted_users, session["user"])]
+
+    def expire(self, now=None):
+        """
+        清掉超過 ttl 沒有活動的 session，回傳這些使用者（讓呼叫端標記離線）
+        成本和「到期的 heap 項目」數量成正比，和 session 總數無關
+        """
+        now = time.time() if now is None else now
+        expired = []
+        with self.lock:
+            heap = self._deadlines
+            while heap and heap[0][0] <= now:
+                _, token = heapq.heappop(heap)
+                session = self.by_token.get(token)
+                if session is None:
+                    continue    # 已登出 / 被新登入取代
+                deadline = session["last_seen"] + self.ttl
+                if deadline > now:
+                    # deadline 之後還有活動，延後再檢查
+                    heapq.heappush(heap, (deadline, token))
+                    continue
+                self._drop(token)
+                expired.append(session["user"])
+        return expired
+
+    def is_active(self, user):
+        with self.lock:
+            return user in self.by_user
+
+    def users(self):
+        with self.lock:
+            return list(self.by_user)
+
+    def users_page(self, limit, after=None, prefix=None):
+        """
+        依名稱排序的一頁在線使用者：after 是上一頁最後一個名稱（不含），prefix 只看這個前綴
+        回傳 (users, 下一頁的 after 或 None)；用 bisect 直接跳到起點，成本和 limit 成正比
+        """
+        with self.lock:
+            names = self._sorted_users
+            start = 0 if after is None else bisect_right(names, after)
+            if prefix:
+                start = max(start, bisect_left(names, prefix))
+            page = []
+            for name in names[start:start + limit + 1]:
+                if prefix and not name.startswith(prefix):
+                    break
+                page.append(name)
+            if len(page) > limit:
+                return page[:limit], page[limit - 1]
+            return page, None
+
+
+# ========= 在線狀態批次寫回 =========
+class PresenceBatcher:
+    """
+    write(changes) 由呼叫端提供，changes = {user: (online, last_seen)}
+    同一個使用者在一個批次內多次登入 / 登出只寫最後一次
+    """
+
+    def __init__(self, write, interval=PRESENCE_FLUSH_INTERVAL):
+        self.write = write
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def mark(self, user, online):
+        with self.lock:
+            self.pending[user] = (online, time.time() if online else 0)
+
+    def flush(self):
+        with self.lock:
+            changes, self.pending = self.pending, {}
+        if not changes:
+            return 0
+        try:
+            self.write(changes)
+        except Exception:
+            # 寫失敗就放回去下一輪再試（這段時間內較新的修改優先）
+            with self.lock:
+                self.pending = {**changes, **self.pending}
+            raise
+        return len(changes)
+
+
+def start_presence_loop(sessions, presence, tick=EXPIRE_TICK, log_prefix="[Sessions]"):
+    """
+    背景 thread：每 tick 秒處理到期的 session（標記離線），每 presence.interval 秒批次寫回在線狀態
+    """
+    def loop():
+        last_flush = time.time()
+        while True:
+            time.sleep(tick)
+            for user in sessions.expire():
+                if not sessions.is_active(user):   # 過期後馬上又登入的不要標成離線
+                    presence.mark(user, False)
+            if time.time() - last_flush >= presence.interval:
+                last_flush = time.time()
+                try:
+                    presence.flush()
+                except Exception as e:
+                    print(f"{log_prefix} presence flush failed: {e!r}")
+
+    t = threading.Thread(target=loop, daemon=True)
+    t.start()
+    return t
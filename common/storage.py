@@ -0,0 +1,791 @@
+"""
+Developer Server / Lobby Server 共用的儲存層
+
+兩個 server 原本都直接 load/save 整份 developer_client/database.json，
+同時上架遊戲和送出評分會互相覆蓋（lost update）。這裡把存取包成同一組 API：
+
+- SQLiteStorage（預設）：WAL mode，developers / games / versions / ratings /
+  players / rooms / chats / play_history 各一張表並建 index，多個 process 可同時讀寫
+- JsonStorage：舊的 database.json（只有單一 writer 時才安全），GAME_STORE_BACKEND=json 切換
+
+Lobby 自己的 players / rooms / chats / play_history：
+SQLiteStorage 直接存在同一個 DB（stores_lobby_state = True）；
+JsonStorage 不處理，交給 lobby 的 WAL + snapshot。
+
+SQLite DB 是空的而舊的 JSON 資料還在時，open_storage 啟動時會自動匯入一次
+（common/migrate_json_to_sqlite.py，也可以手動跑）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR   = os.path.dirname(COMMON_DIR)
+DEV_DIR    = os.path.join(ROOT_DIR, "developer_client")
+
+BACKEND     = os.environ.get("GAME_STORE_BACKEND", "sqlite")
+SQLITE_FILE = os.environ.get("GAME_STORE_DB", os.path.join(DEV_DIR, "game_store.sqlite3"))
+JSON_FILE   = os.path.join(DEV_DIR, "database.json")
+
+
+class StorageBackend:
+    """
+    兩個 server 共用的 API。回傳的 game dict 和 database.json 裡的形狀一樣：
+    {"developer", "name", "description", "active", "versions": {ver: info}}
+    （ratings 不一定會附上，評分請用 game summary / recent_ratings）
+
+    game summary：每款遊戲的 running aggregate，add_rating / put_version 時 O(1) 更新
+    {"game_key", "name", "developer", "description", "active", "latest_version",
+     "rating_count", "rating_sum", "histogram": [1★, 2★, 3★, 4★, 5★]}
+
+    catalog revision：games / versions / ratings 每次修改都 +1，
+    lobby 用它判斷快取的商城列表還能不能用
+    """
+    stores_lobby_state = False
+
+    # ---------- developers ----------
+    def get_developer(self, name):
+        raise NotImplementedError
+
+    def add_developer(self, name, info):
+        """
+        帳號不存在才新增，回傳是否新增成功（註冊用，避免兩個人同時註冊同名）
+        """
+        raise NotImplementedError
+
+    def put_developer(self, name, info):
+        raise NotImplementedError
+
+    def list_developers(self):
+        raise NotImplementedError
+
+    def set_developer_presence(self, changes):
+        """
+        changes: {name: (online, last_seen)}，一次寫回多個 developer 的在線狀態（批次）
+        """
+        raise NotImplementedError
+
+    # ---------- games / versions / ratings ----------
+    def get_game(self, game_key):
+        raise NotImplementedError
+
+    def list_games(self, developer=None):
+        raise NotImplementedError
+
+    def put_game(self, game_key, info):
+        """
+        新增或覆寫遊戲基本資料（developer / name / description / active），不動 versions / ratings
+        """
+        raise NotImplementedError
+
+    def update_game(self, game_key, **fields):
+        raise NotImplementedError
+
+    def put_version(self, game_key, version, info):
+        raise NotImplementedError
+
+    def add_rating(self, game_key, rating):
+        raise NotImplementedError
+
+    def get_game_summary(self, game_key):
+        raise NotImplementedError
+
+    def list_game_summaries(self, developer=None):
+        raise NotImplementedError
+
+    def recent_ratings(self, game_key, limit=5):
+        raise NotImplementedError
+
+    def catalog_revision(self):
+        raise NotImplementedError
+
+    # ---------- lobby collections（只有 stores_lobby_state 的 backend 需要） ----------
+    def load_lobby(self):
+        raise NotImplementedError
+
+    def apply(self, collection, op, key=None, value=None):
+        raise NotImplementedError
+
+    def apply_many(self, records):
+        """
+        多筆 [collection, op, key, value] 一次寫入（backend 支援的話在同一個 transaction）
+        """
+        for record in records:
+            self.apply(*record)
+
+    def write_batch(self, ops):
+        """
+        ops: [(method, args, kwargs), ...]，依序呼叫上面的寫入 API（put_game / put_version /
+        set_developer_presence ...）；backend 支援的話整批只寫一次檔案 / 一個 transaction
+        """
+        for method, args, kwargs in ops:
+            getattr(self, method)(*args, **kwargs)
+
+    def close(self):
+        pass
+
+
+# ========================== JSON（舊格式） ==========================
+def _atomic_write(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class JsonStorage(StorageBackend):
+    """
+    舊的 database.json。只在檔案 mtime/size 變動時重新讀；寫入是整份 atomic rewrite。
+    同一個 process 內有 lock，跨 process（lobby + developer server）仍可能互相覆蓋。
+    """
+
+    def __init__(self, path=JSON_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = None
+        self._stamp = None
+        self._batching = False
+        self._dirty = False
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        stamp = self._file_stamp()
+        if self._db is None or stamp != self._stamp:
+            if stamp is None:
+                self._db = {"developers": {}, "games": {}}
+            else:
+                with open(self.path, "r") as f:
+                    self._db = json.load(f)
+            self._stamp = stamp
+        return self._db
+
+    def _save(self):
+        if self._batching:
+            # write_batch 結束時才整份寫一次
+            self._dirty = True
+            return
+        _atomic_write(self.path, json.dumps(self._db, indent=4))
+        self._stamp = self._file_stamp()
+
+    def write_batch(self, ops):
+        with self._lock:
+            self._batching = True
+            try:
+                super().write_batch(ops)
+            finally:
+                self._batching = False
+            if self._dirty:
+                self._dirty = False
+                self._save()
+
+    def _save_catalog(self):
+        self._db["catalog_revision"] = self._db.get("catalog_revision", 0) + 1
+        self._save()
+
+    def get_developer(self, name):
+        with self._lock:
+            return self._load()["developers"].get(name)
+
+    def add_developer(self, name, info):
+        with self._lock:
+            db = self._load()
+            if name in db["developers"]:
+                return False
+            db["developers"][name] = dict(info)
+            self._save()
+            return True
+
+    def put_developer(self, name, info):
+        with self._lock:
+            self._load()["developers"][name] = dict(info)
+            self._save()
+
+    def list_developers(self):
+        with self._lock:
+            return dict(self._load()["developers"])
+
+    def set_developer_presence(self, changes):
+        with self._lock:
+            developers = self._load()["developers"]
+            for name, (online, last_seen) in changes.items():
+                if name in developers:
+                    developers[name]["online"] = online
+                    developers[name]["last_seen"] = last_seen
+            self._save()
+
+    def get_game(self, game_key):
+        with self._lock:
+            return self._load()["games"].get(game_key)
+
+    def list_games(self, developer=None):
+        with self._lock:
+            games = self._load()["games"]
+            if developer is None:
+                return dict(games)
+            return {k: g for k, g in games.items() if g["developer"] == developer}
+
+    def put_game(self, game_key, info):
+        with self._lock:
+            games = self._load()["games"]
+            game = games.setdefault(game_key, {"versions": {}, "ratings": []})
+            for field in ("developer", "name", "description"):
+                game[field] = info[field]
+            game["active"] = info.get("active", True)
+            self._save_catalog()
+
+    def update_game(self, game_key, **fields):
+        with self._lock:
+            game = self._load()["games"].get(game_key)
+            if game is None:
+                return False
+            game.update(fields)
+            self._save_catalog()
+            return True
+
+    def put_version(self, game_key, version, info):
+        with self._lock:
+            game = self._load()["games"][game_key]
+            game["versions"][version] = dict(info)
+            stats = _json_stats(game)
+            if stats["latest_version"] is None or version > stats["latest_version"]:
+                stats["latest_version"] = version
+            self._save_catalog()
+
+    def add_rating(self, game_key, rating):
+        with self._lock:
+            game = self._load()["games"][game_key]
+            stats = _json_stats(game)
+            game.setdefault("ratings", []).append(dict(rating))
+            _count_rating(stats, rating["score"])
+            self._save_catalog()
+
+    def get_game_summary(self, game_key):
+        with self._lock:
+            game = self._load()["games"].get(game_key)
+            return _json_summary(game_key, game) if game is not None else None
+
+    def list_game_summaries(self, developer=None):
+        with self._lock:
+            return [_json_summary(k, g) for k, g in self._load()["games"].items()
+                    if developer is None or g["developer"] == developer]
+
+    def recent_ratings(self, game_key, limit=5):
+        with self._lock:
+            game = self._load()["games"].get(game_key) or {}
+            return list(game.get("ratings", [])[-limit:])
+
+    def catalog_revision(self):
+        with self._lock:
+            return self._load().get("catalog_revision", 0)
+
+
+def _count_rating(stats, score):
+    stats["rating_count"] += 1
+    stats["rating_sum"] += score
+    if 1 <= score <= 5:
+        stats["histogram"][score - 1] += 1
+
+
+def _json_stats(game):
+    """
+    database.json 裡每款遊戲的 "stats"；舊資料沒有就從 ratings / versions 算一次（之後都是增量更新）
+    """
+    stats = game.get("stats")
+    if stats is None:
+        stats = {"rating_count": 0, "rating_sum": 0, "histogram": [0] * 5,
+                 "latest_version": max(game.get("versions", {}), default=None)}
+        for r in game.get("ratings", []):
+            _count_rating(stats, r["score"])
+        game["stats"] = stats
+    return stats
+
+
+def _json_summary(game_key, game):
+    stats = _json_stats(game)
+    return {
+        "game_key": game_key,
+        "name": game["name"],
+        "developer": game["developer"],
+        "description": game["description"],
+        "active": game.get("active", True),
+        "latest_version": stats["latest_version"],
+        "rating_count": stats["rating_count"],
+        "rating_sum": stats["rating_sum"],
+        "histogram": list(stats["histogram"]),
+    }
+
+
+# ========================== SQLite ==========================
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS developers (
+    name        TEXT PRIMARY KEY,
+    password    TEXT NOT NULL,
+    online      INTEGER NOT NULL DEFAULT 0,
+    last_seen   REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS games (
+    game_key    TEXT PRIMARY KEY,
+    developer   TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    active      INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_games_developer ON games(developer);
+CREATE TABLE IF NOT EXISTS versions (
+    game_key    TEXT NOT NULL,
+    version     TEXT NOT NULL,
+    info        TEXT NOT NULL,
+    created_at  REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (game_key, version)
+);
+CREATE TABLE IF NOT EXISTS ratings (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_key    TEXT NOT NULL,
+    player      TEXT NOT NULL,
+    score       INTEGER NOT NULL,
+    comment     TEXT NOT NULL DEFAULT '',
+    created_at  REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_ratings_game ON ratings(game_key, id);
+CREATE TABLE IF NOT EXISTS game_stats (
+    game_key       TEXT PRIMARY KEY,
+    rating_count   INTEGER NOT NULL DEFAULT 0,
+    rating_sum     INTEGER NOT NULL DEFAULT 0,
+    score_1        INTEGER NOT NULL DEFAULT 0,
+    score_2        INTEGER NOT NULL DEFAULT 0,
+    score_3        INTEGER NOT NULL DEFAULT 0,
+    score_4        INTEGER NOT NULL DEFAULT 0,
+    score_5        INTEGER NOT NULL DEFAULT 0,
+    latest_version TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_revision', 0);
+CREATE TABLE IF NOT EXISTS players (
+    name        TEXT PRIMARY KEY,
+    password    TEXT NOT NULL,
+    online      INTEGER NOT NULL DEFAULT 0,
+    last_seen   REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id     INTEGER PRIMARY KEY,
+    game_key    TEXT NOT NULL,
+    info        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_game ON rooms(game_key);
+CREATE TABLE IF NOT EXISTS chats (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_key    TEXT NOT NULL,
+    info        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chats_room ON chats(room_key, id);
+CREATE TABLE IF NOT EXISTS play_history (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    player      TEXT NOT NULL,
+    game_key    TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    每個 thread 一條 connection（sqlite3 connection 不能跨 thread 共用），
+    每個 API 呼叫就是一個 transaction；WAL mode 讓讀寫不互相擋。
+    """
+    stores_lobby_state = True
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._migrate_play_history(conn)
+        self._backfill_game_stats(conn)
+
+    @staticmethod
+    def _migrate_play_history(conn):
+        """
+        舊版每次 create/join room 都新增一筆 play_history；
+        先把重複的 (player, game_key) 收斂成一筆，再建 UNIQUE index，之後用 INSERT OR IGNORE
+        """
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_play_history'").fetchone():
+            return
+        with conn:
+            cur = conn.execute(
+                "DELETE FROM play_history WHERE id NOT IN "
+                "(SELECT MIN(id) FROM play_history GROUP BY player, game_key)")
+            if cur.rowcount:
+                print(f"[Storage] play_history: collapsed {cur.rowcount} duplicate records")
+            conn.execute("DROP INDEX IF EXISTS idx_play_history_player_game")
+            conn.execute("CREATE UNIQUE INDEX uq_play_history ON play_history(player, game_key)")
+
+    @staticmethod
+    def _backfill_game_stats(conn):
+        """
+        還沒有 game_stats 的遊戲（舊 DB / 剛匯入）從 ratings / versions 算一次，之後都是增量更新
+        """
+        with conn:
+            conn.execute(
+                "INSERT INTO game_stats (game_key, rating_count, rating_sum, "
+                "score_1, score_2, score_3, score_4, score_5, latest_version) "
+                "SELECT g.game_key, COUNT(r.id), COALESCE(SUM(r.score), 0), "
+                "COALESCE(SUM(r.score = 1), 0), COALESCE(SUM(r.score = 2), 0), COALESCE(SUM(r.score = 3), 0), "
+                "COALESCE(SUM(r.score = 4), 0), COALESCE(SUM(r.score = 5), 0), "
+                "(SELECT MAX(v.version) FROM versions v WHERE v.game_key = g.game_key) "
+                "FROM games g LEFT JOIN ratings r ON r.game_key = g.game_key "
+                "WHERE g.game_key NOT IN (SELECT game_key FROM game_stats) "
+                "GROUP BY g.game_key")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        """
+        一般呼叫：一個 API 一個 transaction；write_batch 裡面：整批共用外層的 transaction
+        """
+        conn = self._conn()
+        if getattr(self._local, "in_batch", False):
+            yield conn
+            return
+        with conn:
+            yield conn
+
+    def write_batch(self, ops):
+        conn = self._conn()
+        with conn:
+            self._local.in_batch = True
+            try:
+                super().write_batch(ops)
+            finally:
+                self._local.in_batch = False
+
+    def is_empty(self):
+        conn = self._conn()
+        for table in ("developers", "games", "players"):
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    # ---------- developers ----------
+    @staticmethod
+    def _account(row):
+        return {"password": row["password"], "online": bool(row["online"]), "last_seen": row["last_seen"]}
+
+    def get_developer(self, name):
+        row = self._conn().execute(
+            "SELECT password, online, last_seen FROM developers WHERE name = ?", (name,)).fetchone()
+        return self._account(row) if row else None
+
+    def add_developer(self, name, info):
+        with self._tx() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO developers (name, password, online, last_seen) VALUES (?, ?, ?, ?)",
+                (name, info["password"], int(bool(info.get("online"))), info.get("last_seen", 0)))
+        return cur.rowcount == 1
+
+    def put_developer(self, name, info):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO developers (name, password, online, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET password = excluded.password, "
+                "online = excluded.online, last_seen = excluded.last_seen",
+                (name, info["password"], int(bool(info.get("online"))), info.get("last_seen", 0)))
+
+    def list_developers(self):
+        rows = self._conn().execute("SELECT name, password, online, last_seen FROM developers")
+        return {row["name"]: self._account(row) for row in rows}
+
+    def set_developer_presence(self, changes):
+        with self._tx() as conn:
+            conn.executemany(
+                "UPDATE developers SET online = ?, last_seen = ? WHERE name = ?",
+                [(int(bool(online)), last_seen, name) for name, (online, last_seen) in changes.items()])
+
+    # ---------- games ----------
+    def _games_where(self, where, args):
+        conn = self._conn()
+        games = {}
+        for row in conn.execute(f"SELECT * FROM games {where} ORDER BY rowid", args):
+            games[row["game_key"]] = {
+                "developer": row["developer"],
+                "name": row["name"],
+                "description": row["description"],
+                "active": bool(row["active"]),
+                "versions": {},
+            }
+        if not games:
+            return games
+        # versions 一次查完，避免 N+1
+        keys = list(games)
+        marks = ",".join("?" * len(keys))
+        for row in conn.execute(
+                f"SELECT game_key, version, info FROM versions WHERE game_key IN ({marks}) "
+                "ORDER BY created_at, rowid", keys):
+            games[row["game_key"]]["versions"][row["version"]] = json.loads(row["info"])
+        return games
+
+    def get_game(self, game_key):
+        return self._games_where("WHERE game_key = ?", (game_key,)).get(game_key)
+
+    def list_games(self, developer=None):
+        if developer is None:
+            return self._games_where("", ())
+        return self._games_where("WHERE developer = ?", (developer,))
+
+    def put_game(self, game_key, info):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO games (game_key, developer, name, description, active) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(game_key) DO UPDATE SET developer = excluded.developer, name = excluded.name, "
+                "description = excluded.description, active = excluded.active",
+                (game_key, info["developer"], info["name"], info["description"],
+                 int(bool(info.get("active", True)))))
+            self._bump_catalog(conn)
+
+    def update_game(self, game_key, **fields):
+        allowed = {"developer", "name", "description", "active"}
+        cols = [f for f in fields if f in allowed]
+        if not cols:
+            return False
+        values = [int(bool(fields[c])) if c == "active" else fields[c] for c in cols]
+        with self._tx() as conn:
+            cur = conn.execute(
+                f"UPDATE games SET {', '.join(f'{c} = ?' for c in cols)} WHERE game_key = ?",
+                values + [game_key])
+            if cur.rowcount == 1:
+                self._bump_catalog(conn)
+        return cur.rowcount == 1
+
+    def put_version(self, game_key, version, info):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO versions (game_key, version, info, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(game_key, version) DO UPDATE SET info = excluded.info",
+                (game_key, version, json.dumps(info), time.time()))
+            # latest_version 和原本 sorted(versions)[-1] 一樣取字串最大值
+            conn.execute(
+                "INSERT INTO game_stats (game_key, latest_version) VALUES (?, ?) "
+                "ON CONFLICT(game_key) DO UPDATE SET latest_version = CASE "
+                "WHEN latest_version IS NULL OR excluded.latest_version > latest_version "
+                "THEN excluded.latest_version ELSE latest_version END",
+                (game_key, version))
+            self._bump_catalog(conn)
+
+    def add_rating(self, game_key, rating):
+        score = int(rating["score"])
+        bucket = f", score_{score} = score_{score} + 1" if 1 <= score <= 5 else ""
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO ratings (game_key, player, score, comment, created_at) VALUES (?, ?, ?, ?, ?)",
+                (game_key, rating["player"], score, rating.get("comment", ""), time.time()))
+            conn.execute("INSERT OR IGNORE INTO game_stats (game_key) VALUES (?)", (game_key,))
+            conn.execute(
+                f"UPDATE game_stats SET rating_count = rating_count + 1, "
+                f"rating_sum = rating_sum + ?{bucket} WHERE game_key = ?",
+                (score, game_key))
+            self._bump_catalog(conn)
+
+    @staticmethod
+    def _bump_catalog(conn):
+        # 和修改本身同一個 transaction，revision 不會比資料先出現
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'catalog_revision'")
+
+    def catalog_revision(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'catalog_revision'").fetchone()
+        return row["value"] if row else 0
+
+    # ---------- game summaries（running aggregates） ----------
+    SUMMARY_SQL = (
+        "SELECT g.game_key, g.developer, g.name, g.description, g.active, s.latest_version, "
+        "COALESCE(s.rating_count, 0) AS rating_count, COALESCE(s.rating_sum, 0) AS rating_sum, "
+        "COALESCE(s.score_1, 0) AS score_1, COALESCE(s.score_2, 0) AS score_2, "
+        "COALESCE(s.score_3, 0) AS score_3, COALESCE(s.score_4, 0) AS score_4, "
+        "COALESCE(s.score_5, 0) AS score_5 "
+        "FROM games g LEFT JOIN game_stats s ON s.game_key = g.game_key ")
+
+    @staticmethod
+    def _summary(row):
+        return {
+            "game_key": row["game_key"],
+            "name": row["name"],
+            "developer": row["developer"],
+            "description": row["description"],
+            "active": bool(row["active"]),
+            "latest_version": row["latest_version"],
+            "rating_count": row["rating_count"],
+            "rating_sum": row["rating_sum"],
+            "histogram": [row[f"score_{i}"] for i in range(1, 6)],
+        }
+
+    def get_game_summary(self, game_key):
+        row = self._conn().execute(self.SUMMARY_SQL + "WHERE g.game_key = ?", (game_key,)).fetchone()
+        return self._summary(row) if row else None
+
+    def list_game_summaries(self, developer=None):
+        if developer is None:
+            rows = self._conn().execute(self.SUMMARY_SQL + "ORDER BY g.rowid")
+        else:
+            rows = self._conn().execute(self.SUMMARY_SQL + "WHERE g.developer = ? ORDER BY g.rowid", (developer,))
+        return [self._summary(row) for row in rows]
+
+    def recent_ratings(self, game_key, limit=5):
+        rows = self._conn().execute(
+            "SELECT player, score, comment FROM ratings WHERE game_key = ? ORDER BY id DESC LIMIT ?",
+            (game_key, limit)).fetchall()
+        return [{"player": r["player"], "score": r["score"], "comment": r["comment"]} for r in reversed(rows)]
+
+    # ---------- lobby collections ----------
+    def load_lobby(self):
+        conn = self._conn()
+        players = {row["name"]: self._account(row)
+                   for row in conn.execute("SELECT name, password, online, last_seen FROM players")}
+        rooms = [json.loads(row["info"]) for row in conn.execute("SELECT info FROM rooms ORDER BY rowid")]
+        chats = {}
+        for row in conn.execute("SELECT room_key, info FROM chats ORDER BY id"):
+            chats.setdefault(row["room_key"], []).append(json.loads(row["info"]))
+        play_history = [{"player": row["player"], "game_key": row["game_key"]}
+                        for row in conn.execute("SELECT player, game_key FROM play_history ORDER BY id")]
+        return {"players": players, "rooms": rooms, "chats": chats, "play_history": play_history}
+
+    def apply(self, collection, op, key=None, value=None):
+        """
+        和 lobby WAL 一樣的 [collection, op, key, value] record，直接改對應的 row
+        """
+        conn = self._conn()
+        with conn:
+            self._apply(conn, collection, op, key, value)
+
+    def apply_many(self, records):
+        conn = self._conn()
+        with conn:
+            for collection, op, key, value in records:
+                self._apply(conn, collection, op, key, value)
+
+    @staticmethod
+    def _apply(conn, collection, op, key, value):
+        if collection == "players":
+            if op == "set":
+                conn.execute(
+                    "INSERT INTO players (name, password, online, last_seen) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET password = excluded.password, "
+                    "online = excluded.online, last_seen = excluded.last_seen",
+                    (key, value["password"], int(bool(value.get("online"))), value.get("last_seen", 0)))
+            elif op == "del":
+                conn.execute("DELETE FROM players WHERE name = ?", (key,))
+        elif collection == "rooms":
+            if op == "set":
+                # REPLACE 會換 rowid；用 upsert 保留房間原本的排序
+                conn.execute(
+                    "INSERT INTO rooms (room_id, game_key, info) VALUES (?, ?, ?) "
+                    "ON CONFLICT(room_id) DO UPDATE SET game_key = excluded.game_key, info = excluded.info",
+                    (key, value.get("game", ""), json.dumps(value)))
+            elif op == "del":
+                conn.execute("DELETE FROM rooms WHERE room_id = ?", (key,))
+        elif collection == "chats":
+            if op == "append":
+                conn.execute("INSERT INTO chats (room_key, info) VALUES (?, ?)", (key, json.dumps(value)))
+            elif op == "trim":
+                # 只留最新的 keep 則（舊的已經在 lobby 的聊天封存檔）
+                conn.execute(
+                    "DELETE FROM chats WHERE room_key = ? AND id NOT IN "
+                    "(SELECT id FROM chats WHERE room_key = ? ORDER BY id DESC LIMIT ?)",
+                    (key, key, value["keep"]))
+            elif op == "del":
+                conn.execute("DELETE FROM chats WHERE room_key = ?", (key,))
+        elif collection == "play_history":
+            if op in ("add", "append"):
+                conn.execute("INSERT OR IGNORE INTO play_history (player, game_key) VALUES (?, ?)",
+                             (value["player"], value["game_key"]))
+
+    # ---------- 一次匯入（migration tool 用） ----------
+    def import_all(self, catalog, lobby, replace=False, if_empty=False):
+        """
+        catalog: database.json 的內容；lobby: load_lobby() 同樣形狀的 dict。
+        replace=True 會先清空所有表。全部在同一個 transaction 內完成，失敗就整個 rollback。
+        if_empty=True 時 DB 已經有資料就不匯入、回傳 False（server 啟動時自動匯入用：
+        BEGIN IMMEDIATE 先拿 write lock 再檢查，lobby 和 developer server 同時啟動也只會匯入一次）
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if if_empty and not self.is_empty():
+                return False
+            if replace:
+                for table in ("developers", "games", "versions", "ratings", "game_stats",
+                              "players", "rooms", "chats", "play_history"):
+                    conn.execute(f"DELETE FROM {table}")
+            for name, info in catalog.get("developers", {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO developers (name, password, online, last_seen) VALUES (?, ?, ?, ?)",
+                    (name, info["password"], int(bool(info.get("online"))), info.get("last_seen", 0)))
+            for key, game in catalog.get("games", {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO games (game_key, developer, name, description, active) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, game["developer"], game["name"], game.get("description", ""),
+                     int(bool(game.get("active", True)))))
+                for order, (version, vinfo) in enumerate(game.get("versions", {}).items()):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO versions (game_key, version, info, created_at) VALUES (?, ?, ?, ?)",
+                        (key, version, json.dumps(vinfo), order))
+                for r in game.get("ratings", []):
+                    conn.execute(
+                        "INSERT INTO ratings (game_key, player, score, comment) VALUES (?, ?, ?, ?)",
+                        (key, r["player"], r["score"], r.get("comment", "")))
+            for name, info in lobby.get("players", {}).items():
+                self._apply(conn, "players", "set", name, info)
+            for room in lobby.get("rooms", []):
+                self._apply(conn, "rooms", "set", room["room_id"], room)
+            for room_key, msgs in lobby.get("chats", {}).items():
+                for msg in msgs:
+                    self._apply(conn, "chats", "append", room_key, msg)
+            for record in lobby.get("play_history", []):
+                self._apply(conn, "play_history", "add", None, record)
+            self._bump_catalog(conn)
+        self._backfill_game_stats(conn)
+        return True
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_storage(backend=None, path=None):
+    """
+    依 GAME_STORE_BACKEND（sqlite / json）開啟儲存層
+    """
+    backend = backend or BACKEND
+    if backend == "sqlite":
+        storage = SQLiteStorage(path or SQLITE_FILE)
+        if storage.is_empty():
+            # 從 JSON 升級上來的部署：DB 是空的但舊資料還在，先整份匯入（同一個 transaction）再開始服務，
+            # 不然會直接用空的 DB 跑，所有玩家 / 遊戲 / 評分都不見；匯入失敗就讓 server 啟動失敗
+            from common.migrate_json_to_sqlite import import_legacy
+            import_legacy(storage)
+        return storage
+    if backend == "json":
+        return JsonStorage(path or JSON_FILE)
+    raise ValueError(f"unknown storage backend: {backend}")
@@ -0,0 +1,232 @@
+"""
+Developer Server 的記憶體資料（唯一一份，所有連線共用）
+
+原本每個 request 都直接讀寫儲存層：登入 / 權限檢查 / 我的遊戲列表都要查 DB，
+每個修改各自一次 transaction（JSON backend 是整份 database.json 重寫一次），
+「檢查 game 是誰的 -> 寫入新版本」之間也沒有任何 lock，同一款遊戲同時更新 / 下架會交錯。
+這裡改成：
+
+- 啟動時把 developers / games 載入記憶體，之後讀取都不碰 DB
+  （developers / games / versions 只有 developer server 會寫；lobby 只寫 ratings，這裡用不到）
+- 細粒度 lock：developer_lock(name) / game_lock(game_key)，
+  handler 把「檢查 -> 收檔 / 寫入」整段包起來，不同遊戲、不同 developer 的上傳互不影響
+- 修改先套用到記憶體並排進 queue，由一個 flusher thread 每 DEV_FLUSH_MS 收集一批，
+  用 storage.write_batch 一次寫入（JSON：整份只寫一次；SQLite：一個 transaction）
+- 需要持久化後才回覆的修改（上架 / 更新 / 下架 / 註冊）呼叫 wait(ticket)，
+  同時進來的修改共用同一次寫入（group commit）；在線狀態不等
+- 寫入失敗：I/O、DB locked 這類暫時性錯誤整批重試 FLUSH_ATTEMPTS 次；儲存層直接拒絕的（資料錯誤、
+  integrity error）改成一筆一筆寫，只丟掉寫不進去的那幾筆並記 log，wait 回傳 False，
+  不會讓一筆壞資料卡住之後所有的寫入（丟掉的修改記憶體裡還在，重開 server 後以儲存層為準）
+"""
+import os
+import sqlite3
+import threading
+import time
+
+FLUSH_DELAY = float(os.environ.get("DEV_FLUSH_MS", "20")) / 1000
+FLUSH_RETRY = 1.0
+FLUSH_ATTEMPTS = 5
+WAIT_TIMEOUT = 30.0
+# 暫時性的錯誤（磁碟、DB 被鎖住）：等一下再試；其他例外視為這批資料本身有問題
+TRANSIENT_ERRORS = (OSError, sqlite3.OperationalError)
+
+
+class KeyedLocks:
+    """
+    每個 key 一把 lock（第一次用到時建立）；developers / games 的數量不多，lock 不回收
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def __call__(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+            return lock
+
+
+class DevStore:
+    def __init__(self, storage, flush_delay=FLUSH_DELAY):
+        self.storage = storage
+        self.flush_delay = flush_delay
+        self.lock = threading.Lock()            # 保護下面的 dict 和 queue，只在短時間內持有
+        self.ready = threading.Condition(self.lock)
+        self.flushed = threading.Condition(self.lock)
+        self.write_lock = threading.Lock()      # flusher / flush() 依序寫入
+        self.developer_lock = KeyedLocks()
+        self.game_lock = KeyedLocks()
+
+        self.developers = {name: dict(dev) for name, dev in storage.list_developers().items()}
+        self.games = {}                         # game_key -> {"developer", "name", "description", "active", "latest_version"}
+        self.by_developer = {}                  # developer -> [game_key]（上架順序）
+        for s in storage.list_game_summaries():
+            self._index_game(s["game_key"], {f: s[f] for f in
+                                             ("developer", "name", "description", "active", "latest_version")})
+
+        self.pending = []                       # [(method, args, kwargs)]
+        self.queued_seq = 0
+        self.flushed_seq = 0
+        self.dropped = {}                       # 寫不進去而丟掉的 ticket -> 丟掉的時間（給 wait 回報錯誤）
+        self.thread = None
+
+    def _index_game(self, game_key, game):
+        """
+        呼叫端持有 self.lock（或還在 __init__）
+        """
+        if game_key not in self.games:
+            self.by_developer.setdefault(game["developer"], []).append(game_key)
+        self.games[game_key] = game
+
+    # ---------- 讀取 ----------
+    def get_developer(self, name):
+        with self.lock:
+            dev = self.developers.get(name)
+            return dict(dev) if dev is not None else None
+
+    def get_game(self, game_key):
+        with self.lock:
+            game = self.games.get(game_key)
+            return dict(game) if game is not None else None
+
+    def list_games(self, developer):
+        with self.lock:
+            return [dict(self.games[k], game_key=k) for k in self.by_developer.get(developer, ())]
+
+    # ---------- 修改（記憶體馬上生效，回傳 ticket 給 wait） ----------
+    def _queue(self, method, *args, **kwargs):
+        """
+        呼叫端持有 self.lock
+        """
+        self.pending.append((method, args, kwargs))
+        self.queued_seq += 1
+        self.ready.notify()
+        return self.queued_seq
+
+    def add_developer(self, name, info):
+        """
+        帳號不存在才新增，回傳 ticket；已經存在回傳 None
+        """
+        with self.developer_lock(name):
+            with self.lock:
+                if name in self.developers:
+                    return None
+                self.developers[name] = dict(info)
+                return self._queue("add_developer", name, dict(info))
+
+    def set_presence(self, changes):
+        with self.lock:
+            for name, (online, last_seen) in changes.items():
+                dev = self.developers.get(name)
+                if dev is not None:
+                    dev["online"] = online
+                    dev["last_seen"] = last_seen
+            return self._queue("set_developer_presence", dict(changes))
+
+    def put_game(self, game_key, info):
+        with self.lock:
+            old = self.games.get(game_key) or {}
+            game = {f: info[f] for f in ("developer", "name", "description")}
+            game["active"] = info.get("active", True)
+            game["latest_version"] = old.get("latest_version")
+            self._index_game(game_key, game)
+            return self._queue("put_game", game_key, dict(info))
+
+    def update_game(self, game_key, **fields):
+        with self.lock:
+            game = self.games.get(game_key)
+            if game is None:
+                return None
+            game.update(fields)
+            return self._queue("update_game", game_key, **fields)
+
+    def put_version(self, game_key, version, info):
+        with self.lock:
+            game = self.games[game_key]
+            # 和儲存層一樣取字串最大值
+            if game["latest_version"] is None or version > game["latest_version"]:
+                game["latest_version"] = version
+            return self._queue("put_version", game_key, version, dict(info))
+
+    # ---------- 寫回儲存層 ----------
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._flusher, daemon=True)
+            self.thread.start()
+
+    def wait(self, *tickets, timeout=WAIT_TIMEOUT):
+        """
+        等到 tickets 裡最大的那個（含）之前的修改都寫進儲存層；
+        逾時（修改還在 queue 裡，之後仍會寫入）或其中有修改被丟掉時回傳 False
+        """
+        tickets = [t for t in tickets if t is not None]
+        if not tickets:
+            return True
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.flushed_seq < max(tickets):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.flushed.wait(remaining)
+            return not any(t in self.dropped for t in tickets)
+
+    def _flusher(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.ready.wait()
+            # 稍等一下，讓同時進來的修改湊成同一批
+            time.sleep(self.flush_delay)
+            self.flush()
+
+    def flush(self):
+        """
+        把目前 queue 裡的修改一次寫進儲存層（不換順序）；整批被拒絕時改成逐筆寫入，只丟掉寫不進去的
+        """
+        with self.write_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                upto = self.queued_seq
+            if not batch:
+                return
+            first = upto - len(batch) + 1
+            dropped = []
+            try:
+                self._write(batch)
+            except TRANSIENT_ERRORS as e:
+                print(f"[DevServer] flush of {len(batch)} changes failed {FLUSH_ATTEMPTS} times, dropping: {e!r}")
+                dropped = list(enumerate(batch, first))
+            except Exception as e:
+                print(f"[DevServer] flush of {len(batch)} changes rejected, writing one by one: {e!r}")
+                for seq, op in enumerate(batch, first):
+                    try:
+                        self._write([op])
+                    except Exception as e:
+                        print(f"[DevServer] dropped change: {e!r}")
+                        dropped.append((seq, op))
+            for seq, (method, args, kwargs) in dropped:
+                print(f"[DevServer]   #{seq} {method}{args!r} {kwargs or ''}")
+            with self.lock:
+                now = time.monotonic()
+                # 超過 wait 的逾時就沒有人會再問了
+                self.dropped = {t: at for t, at in self.dropped.items() if now - at < WAIT_TIMEOUT}
+                self.dropped.update((seq, now) for seq, _ in dropped)
+                self.flushed_seq = upto
+                self.flushed.notify_all()
+
+    def _write(self, batch):
+        """
+        暫時性錯誤等一下重試，最多 FLUSH_ATTEMPTS 次；其他錯誤直接 raise
+        """
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                self.storage.write_batch(batch)
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt == FLUSH_ATTEMPTS:
+                    raise
+                print(f"[DevServer] flush of {len(batch)} changes failed, retrying: {e!r}")
+                time.sleep(FLUSH_RETRY)
@@ -1,12 +1,39 @@
 import socket
 import json
+import hashlib
+import queue
+import sys
 import threading
+import time
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.framing import read_json_frame, send_json_frame  # noqa: E402
+from common.game_package import PackageError, inspect_package  # noqa: E402
+from discovery import query_udp, read_discovery_file  # noqa: E402
+
 SERVER_IP = "127.0.0.1"
 SERVER_PORT_START = 5050
 SERVER_PORT_MAX = 6000
+SCAN_TIMEOUT = 0.3
 HEARTBEAT_INTERVAL = 30
+UPLOAD_CHUNK = 64 * 1024
+# 比一個 chunk 大的檔案走可續傳上傳（upload_begin / upload_chunk / upload_commit）
+RESUMABLE_CHUNK = 1024 * 1024
+UPLOAD_WORKERS = int(os.environ.get("DEV_UPLOAD_WORKERS", "4"))
+UPLOAD_ROUNDS = 3       # 一輪沒送完（斷線）就重新 begin 拿 ranges，最多幾輪
+CHUNK_RETRIES = 3       # 單一 chunk 連線失敗重試幾次
+
+# 登入後 server 發的 session token，send_request 自動帶上；
+# server 重啟 / session 過期時用記住的帳密重新登入一次
+SESSION = {"name": None, "password": None, "token": None}
+_session_lock = threading.Lock()
+
+# 找到的 developer server port（之後的連線都直接用）；一般 request 整個 session 共用一條 framed 連線，
+# heartbeat thread 也走同一條
+ENDPOINT = {"port": None}
+_conn = None
+_conn_lock = threading.Lock()
 
 
 # ========= 連線設定 =========
@@ -37,45 +64,329 @@ def configure_dev_endpoint():
             SERVER_IP = ip
     else:
         SERVER_IP = env_ip
-    print(f"➡ 使用 Developer Server {SERVER_IP}，掃描埠 {SERVER_PORT_START}-{SERVER_PORT_MAX}")
+    print(f"➡ 使用 Developer Server {SERVER_IP}（找不到公布的 port 時掃描 {SERVER_PORT_START}-{SERVER_PORT_MAX}）")
+
+
+def _open(port, timeout=None):
+    s = socket.create_connection((SERVER_IP, port), timeout=timeout)
+    s.settimeout(None)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return s
+
+
+def _published_port():
+    """
+    server 寫的探索檔：只有檔案裡的 host 就是 SERVER_IP 這台機器時才用
+    """
+    info = read_discovery_file()
+    if info is None:
+        return None
+    if SERVER_IP not in ("127.0.0.1", "localhost"):
+        try:
+            if socket.gethostbyname(info.get("host", "")) != SERVER_IP:
+                return None
+        except OSError:
+            return None
+    return info["port"]
 
 
 def connect_to_server():
     """
-    find the developer server by scanning ports
+    連到 developer server，回傳 (socket, port)：依序試上次連上的 port、探索檔、UDP 查詢，
+    都不行才從 SERVER_PORT_START 掃到 SERVER_PORT_MAX。連上的 port 記在 ENDPOINT
     """
+    tried = set()
+    cached = ENDPOINT["port"]
+    for lookup in (lambda: cached, _published_port, lambda: query_udp(SERVER_IP)):
+        port = lookup()
+        if port is None or port in tried:
+            continue
+        tried.add(port)
+        try:
+            s = _open(port)
+        except OSError:
+            continue
+        ENDPOINT["port"] = port
+        return s, port
+
     last_error = None
     for port in range(SERVER_PORT_START, SERVER_PORT_MAX + 1):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if port in tried:
+            continue
         try:
-            s.connect((SERVER_IP, port))
-            return s, port
+            s = _open(port, timeout=SCAN_TIMEOUT)
         except OSError as e:
             last_error = e
-            s.close()
             continue
+        ENDPOINT["port"] = port
+        return s, port
     raise ConnectionError(f"oh oh !!!!!, can't connect to developer server: {last_error}")
 
 
+def _drop_connection():
+    global _conn
+    if _conn is not None:
+        try:
+            _conn.close()
+        except OSError:
+            pass
+        _conn = None
+
+
+def close_connection():
+    with _conn_lock:
+        _drop_connection()
+
+
 def send_request(data, expect_response=True):
     """
-    統一包裝 developer client <-> developer server 的連線
-    - expect_response=False 用在後面需要持續傳檔案的狀況時，先送 meta
+    統一包裝 developer client <-> developer server 的連線（自動帶 session token）
+    - expect_response=False 用在後面需要持續傳檔案的狀況時，先送 meta（另開一條連線）
     """
-    s, port = connect_to_server()
-    meta = json.dumps(data).encode()
-    s.sendall(len(meta).to_bytes(4, "big") + meta)
+    token = SESSION["token"]
+    s, res = _send_request(dict(data, token=token) if token else data, expect_response)
+    if (res and res.get("message") == "developer not logged in"
+            and SESSION["password"] and relogin(token)):
+        s, res = _send_request(dict(data, token=SESSION["token"]), expect_response)
+    return s, res
+
+
+def relogin(stale_token):
+    """
+    token 失效時用記住的帳密重新登入；其他 thread 已經換過 token 就直接沿用
+    """
+    with _session_lock:
+        if SESSION["token"] != stale_token:
+            return True
+        _, res = _send_request({"action": "login", "name": SESSION["name"], "password": SESSION["password"]})
+        if not res or res.get("status") != "ok":
+            return False
+        SESSION["token"] = res.get("token")
+        return True
+
 
+def _send_request(data, expect_response=True):
     if not expect_response:
+        s, port = connect_to_server()
+        meta = json.dumps(data).encode()
+        s.sendall(len(meta).to_bytes(4, "big") + meta)
         return s, None
+    return None, _roundtrip(data)
+
+
+def _roundtrip(data):
+    """
+    在共用的連線送一個 request（"framed": true，回覆也是 4-byte 長度 + JSON）並讀回覆；
+    第一次呼叫時才連線，沿用的連線已經失效（例如 server 重啟）時自動重連再送一次
+    """
+    global _conn
+    data = dict(data, framed=True)
+    with _conn_lock:
+        while True:
+            fresh = _conn is None
+            if fresh:
+                _conn, _ = connect_to_server()
+            try:
+                send_json_frame(_conn, data)
+                res = read_json_frame(_conn)
+            except OSError:
+                _drop_connection()
+                if fresh:
+                    raise
+                continue
+            except ValueError:
+                return None
+            if res is None:
+                # server 關掉了連線
+                _drop_connection()
+                if fresh:
+                    return None
+                continue
+            return res
+
+
+def file_digest(path):
+    """
+    回傳 (size, sha256)，上傳前先算好放進 meta，server 依此剛好讀 size bytes 並驗證
+    """
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(UPLOAD_CHUNK), b""):
+            h.update(buf)
+            size += len(buf)
+    return size, h.hexdigest()
+
+
+def send_file_request(meta, file_path):
+    """
+    送 meta（帶 size / sha256）後接著送整個 zip，再讀 server 的回覆；
+    token 失效時重新登入後整個重送一次
+    """
+    size, digest = file_digest(file_path)
+    meta = dict(meta, size=size, sha256=digest)
+    token = SESSION["token"]
+    res = _send_file(meta, file_path)
+    if (res and res.get("message") == "developer not logged in"
+            and SESSION["password"] and relogin(token)):
+        res = _send_file(meta, file_path)
+    return res
+
+
+def _send_file(meta, file_path):
+    token = SESSION["token"]
+    meta = dict(meta, framed=True)
+    s, _ = _send_request(dict(meta, token=token) if token else meta, expect_response=False)
+    try:
+        try:
+            with open(file_path, "rb") as f:
+                s.sendfile(f)
+        except OSError:
+            # server 提早拒絕（例如檔案太大）時會關線，還是試著讀它回的錯誤訊息
+            pass
+        return read_json_frame(s)
+    except (OSError, ValueError):
+        return None
+    finally:
+        s.close()
 
-    raw = s.recv(4096)
-    s.close()
 
+# ========= 可續傳上傳 =========
+def upload_file(meta, file_path):
+    """
+    upload_game / update_game 的入口：小檔案一次送完，大檔案分段上傳、中斷可以續傳。
+    送出前先在本機做一次和 server 一樣的 zip 檢查（只讀目錄），明顯不能上架的不用整份傳完才被拒絕
+    """
     try:
-        return None, json.loads(raw.decode())
-    except:
-        return None, None
+        inspect_package(file_path)
+    except PackageError as e:
+        return {"status": "error", "message": f"invalid game package: {e}"}
+    if os.path.getsize(file_path) <= RESUMABLE_CHUNK:
+        return send_file_request(meta, file_path)
+    return send_resumable(meta, file_path)
+
+
+def missing_ranges(received, size, chunk_size):
+    """
+    server 回報已收到的 ranges，回傳還要送的 (offset, length)，每段最多 chunk_size
+    """
+    chunks = []
+    pos = 0
+    for start, end in sorted(received) + [[size, size]]:
+        while pos < start:
+            length = min(chunk_size, start - pos)
+            chunks.append((pos, length))
+            pos += length
+        pos = max(pos, end)
+    return chunks
+
+
+def send_resumable(meta, file_path):
+    """
+    begin 拿到 upload_id 和 server 已經收到的 ranges，缺的 chunk 用 UPLOAD_WORKERS 條連線平行送，
+    全部送到才 commit。同一個檔案重新上傳時 server 會給同一個 session，只補缺的部分
+    """
+    size, digest = file_digest(file_path)
+    begin = dict(meta, action="upload_begin", kind=meta["action"], size=size, sha256=digest,
+                 chunk_size=RESUMABLE_CHUNK)
+    for _ in range(UPLOAD_ROUNDS):
+        _, res = send_request(begin)
+        if not res or res.get("status") != "ok":
+            return res
+        upload_id = res["upload_id"]
+        chunks = missing_ranges(res["received"], size, res["chunk_size"])
+        if chunks:
+            done = size - sum(length for _, length in chunks)
+            print(f"⬆ 上傳 {size // 1024} KB，已完成 {done // 1024} KB，剩 {len(chunks)} 段")
+            if not send_chunks(upload_id, file_path, chunks, size, done):
+                print("\n⚠ 有部分沒送成功，重新確認進度後續傳…")
+                continue
+            print()
+        _, res = send_request({"action": "upload_commit", "upload_id": upload_id})
+        if res and res.get("message") in ("upload incomplete", "upload still receiving chunks, retry commit"):
+            continue
+        return res
+    print("⚠ 上傳沒有完成；之後再上傳同一個檔案會從中斷的地方繼續")
+    return None
+
+
+def send_chunks(upload_id, file_path, chunks, size, done):
+    """
+    每個 worker 一條連線，從 queue 拿 chunk 依序送；回傳是不是全部送成功
+    """
+    pending = queue.Queue()
+    for chunk in chunks:
+        pending.put(chunk)
+    progress = {"done": done, "failed": False}
+    lock = threading.Lock()
+
+    def worker():
+        s = None
+        with open(file_path, "rb") as f:
+            while not progress["failed"]:
+                try:
+                    offset, length = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for attempt in range(CHUNK_RETRIES + 1):
+                    token = SESSION["token"]
+                    try:
+                        if s is None:
+                            s, _ = connect_to_server()
+                        res = send_chunk(s, f, token, upload_id, offset, length)
+                    except (OSError, ValueError):
+                        res = None
+                    if res and res.get("status") == "ok":
+                        break
+                    # 失敗的話 server 可能已經關掉這條連線，下一次重新連
+                    if s is not None:
+                        s.close()
+                        s = None
+                    if res and res.get("message") == "developer not logged in" and relogin(token):
+                        continue
+                    if res and res.get("message") != "chunk sha256 mismatch":
+                        # upload 不存在 / 範圍不對：重試也沒用，交給下一輪 begin
+                        print(f"\n❌ {res.get('message')}")
+                        progress["failed"] = True
+                        break
+                    time.sleep(min(2 ** attempt, 5))
+                else:
+                    progress["failed"] = True
+                if progress["failed"]:
+                    break
+                with lock:
+                    progress["done"] += length
+                    print_progress(progress["done"], size)
+        if s is not None:
+            s.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(UPLOAD_WORKERS, len(chunks)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return not progress["failed"] and pending.empty()
+
+
+def send_chunk(s, f, token, upload_id, offset, length):
+    """
+    在已經連上的 socket 送一個 chunk（meta + length bytes），回傳 server 的回覆
+    """
+    f.seek(offset)
+    buf = f.read(length)
+    send_json_frame(s, {"action": "upload_chunk", "token": token, "upload_id": upload_id,
+                        "offset": offset, "length": len(buf), "framed": True,
+                        "sha256": hashlib.sha256(buf).hexdigest()})
+    s.sendall(buf)
+    res = read_json_frame(s)
+    if res is None:
+        raise ConnectionError("developer server closed the connection")
+    return res
+
+
+def print_progress(done, total):
+    percent = done * 100 // total if total else 100
+    print(f"\r⬆ {done // 1024} / {total // 1024} KB ({percent}%)", end="", flush=True)
 
 
 def heartbeat_loop(name, stop_event): # for fear some one use ctrl + C and interrupt to exit
@@ -107,23 +418,9 @@ def upload_game(developer):
         "description": description
     }
 
-    # 先送 meta，不期待馬上有 response，因為接下來要傳檔案
-    s, _ = send_request(meta, expect_response=False)
-
-    # send file
-    with open(file_path, "rb") as f:
-        while True:
-            chunk = f.read(4096)
-            if not chunk:
-                break
-            s.sendall(chunk)
-    s.sendall(b"<END>")
-
-    # get server response
-    raw = s.recv(4096)
-    s.close()
-    res = json.loads(raw.decode())
-    print("📣", res["message"])
+    # 小檔案 meta 和檔案在同一條連線送出；大檔案分段送，斷線後可以續傳
+    res = upload_file(meta, file_path)
+    print("📣", res["message"] if res else "上傳失敗（沒有回應）")
 
 
 # ==========================
@@ -182,20 +479,8 @@ def update_game(developer):
         "version":   new_version
     }
 
-    s, _ = send_request(meta, expect_response=False)
-
-    with open(file_path, "rb") as f:
-        while True:
-            chunk = f.read(4096)
-            if not chunk:
-                break
-            s.sendall(chunk)
-    s.sendall(b"<END>")
-
-    raw = s.recv(4096)
-    s.close()
-    res = json.loads(raw.decode())
-    print("📣", res["message"])
+    res = upload_file(meta, file_path)
+    print("📣", res["message"] if res else "上傳失敗（沒有回應）")
 
 
 # ==========================
@@ -261,7 +546,9 @@ def main_menu():
             print("❌", (res or {}).get("message","登入/註冊失敗"))
             continue
 
-        # 登入成功，啟動 heartbeat 並進入功能選單
+        # 登入成功，記住 token，啟動 heartbeat 並進入功能選單
+        with _session_lock:
+            SESSION.update(name=developer, password=pwd, token=res.get("token"))
         stop_hb = threading.Event()
         hb_thread = threading.Thread(target=heartbeat_loop, args=(developer, stop_hb), daemon=True) # used to notify server that this client is still alive
         hb_thread.start()
@@ -285,9 +572,12 @@ def main_menu():
             elif choice == "4":
                 list_my_games(developer, show=True)
             elif choice == "5":
-                send_request({"action":"logout","name":developer})
                 stop_hb.set()
                 hb_thread.join(timeout=1)
+                send_request({"action":"logout","name":developer})
+                with _session_lock:
+                    SESSION.update(name=None, password=None, token=None)
+                close_connection()
                 print("bye bye!\n")
                 break  # 回到登入/註冊選單
             else:
@@ -296,4 +586,7 @@ def main_menu():
 
 if __name__ == "__main__":
     configure_dev_endpoint()
-    main_menu()
+    try:
+        main_menu()
+    finally:
+        close_connection()
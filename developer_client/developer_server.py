@@ -1,215 +1,521 @@
 import socket
 import threading
 import json
+import hashlib
 import os
+import sys
+import tempfile
 import time
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "database.json")
+ROOT_DIR = os.path.dirname(BASE_DIR)
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploaded_games")
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, "upload_sessions")
+UPLOAD_SUFFIX = ".uploading"
+UPLOAD_CHUNK = 64 * 1024
+# meta 宣告的 zip 大小上限，超過直接拒絕（不先收完再說）
+MAX_UPLOAD_SIZE = int(os.environ.get("DEV_MAX_UPLOAD_MB", "512")) * 1024 * 1024
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+sys.path.insert(0, ROOT_DIR)
+from common.storage import open_storage  # noqa: E402
+from common.blobstore import BlobStore  # noqa: E402
+from common.sessions import PresenceBatcher, SessionTable, start_presence_loop  # noqa: E402
+from common.hashing import sha256_file, store_file_index  # noqa: E402
+from common.game_package import PackageError, build_manifest, check_package  # noqa: E402
+from common.framing import encode_frame  # noqa: E402
+from upload_sessions import DEFAULT_CHUNK, MAX_CHUNK, UploadSessions, start_cleanup_loop  # noqa: E402
+from discovery import publish_endpoint, start_udp_responder, withdraw_endpoint  # noqa: E402
+from dev_store import DevStore  # noqa: E402
+
 # ==========================
-# DB 載入/儲存
+# DB：與 lobby server 共用的儲存層（預設 SQLite，見 common/storage.py）
 # ==========================
-def load_db():
-    if not os.path.exists(DB_FILE):
-        # developers: {name: {"password": "...", "online": False}}
-        return {"developers": {}, "games": {}}
-    with open(DB_FILE, "r") as f:
-        return json.load(f)
+STORAGE = None
+# developers / games 的記憶體資料（唯一一份），修改批次寫回 STORAGE，見 dev_store.py
+DB = None
+# 版本 zip 和 zip 內的檔案都依內容存一次，lobby 也讀同一個 blob store
+BLOBS = BlobStore()
+# 登入後發的 token -> developer（只在記憶體）；心跳 / 登入檢查都不再讀寫 DB
+SESSIONS = SessionTable()
+# 登入 / 登出 / 過期的在線狀態先記在記憶體，定期一次寫回 DB
+PRESENCE = PresenceBatcher(lambda changes: DB.set_presence(changes))
+# 可續傳上傳的 session（收到的區間記在磁碟上，server 重啟後還能繼續）
+UPLOADS = UploadSessions(UPLOAD_SESSION_DIR)
+
+
+def authenticate(data):
+    """
+    依 data["token"] 找出 developer，並把 data["developer"] 改成它（不相信 client 自己填的名字）；
+    token 無效回傳 None
+    """
+    developer = SESSIONS.validate(data.get("token"))
+    if developer is not None:
+        data["developer"] = developer
+    return developer
 
-def save_db(db):
-    with open(DB_FILE, "w") as f:
-        json.dump(db, f, indent=4)
+
+def store_version_file(tmp_path, file_path, package, digest=None):
+    """
+    檢查過的 zip（tmp_path）放進 blob store，再 atomic 改名成 file_path（指向 blob 的 hardlink），
+    per-file index 寫到 {zip}.files.json。
+    package：check_package 的結果（zip 裡的檔案和 .pyc 已經在 blob store 裡）。
+    digest：收檔時已經驗證過的 sha256，不用再讀一次檔案。
+    回傳 versions 裡這個版本的資料；sha256 / size 給 lobby 發佈，client 下載後驗證，
+    manifest 給 lobby 建房 / 啟動遊戲用
+    """
+    digest = BLOBS.put_file(tmp_path, digest)
+    os.replace(tmp_path, file_path)
+    store_file_index(file_path, package["files"])
+    return {
+        "file_path": file_path,
+        "size": os.path.getsize(file_path),
+        "sha256": digest,
+        "manifest": build_manifest(package)
+    }
 
 
 # ==========================
-# D1：upload new game
-# # ==========================
-def handle_upload_game(data, conn, db):
+# 接收上架 / 更新的 zip
+# ==========================
+class UploadError(Exception):
     """
-    上架新遊戲：
-    - 若該 game_key 尚未存在 => 建立新遊戲
-    - 若已存在 => 視為「補上初始版本」，通常 D2 用 update_game
-      會比較合理；這裡仍允許覆蓋，以防使用者一開始就用 upload。
+    收到的檔案和 meta 宣告的不符（或連線中斷），訊息直接回給 client
     """
-    developer   = data["developer"]
-    game_name   = data["game_name"]
-    version     = data["version"]
-    description = data["description"]
 
-    game_key = f"{developer}_{game_name}"
-    # 必須 login
-    if developer not in db["developers"] or not db["developers"][developer].get("online"):
-        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
-        return
-    # create new game entry if not exists
-    if game_key not in db["games"]:
-        db["games"][game_key] = {
-            "developer": developer,
-            "name": game_name,
-            "description": description,
-            "active": True,
-            "versions": {},
-            "ratings": []
-        }
-    else:
-        # if game exists
-        db["games"][game_key]["description"] = description 
-        db["games"][game_key]["active"] = True
-
-    # new version 的 zip 檔案路徑
-    file_path = os.path.join(UPLOAD_DIR, f"{game_key}_{version}.zip")
-    db["games"][game_key]["versions"][version] = {
-        "file_path": file_path
-    }
 
-    # 實際接收檔案資料
-    sentinel = b"<END>"
+# 每條連線一個 thread，recv_into 用的 buffer 每個 thread 配一次、之後重複使用
+_recv_buffers = threading.local()
+
+
+def upload_buffer():
+    view = getattr(_recv_buffers, "view", None)
+    if view is None:
+        view = _recv_buffers.view = memoryview(bytearray(UPLOAD_CHUNK))
+    return view
+
+
+def open_upload_tmp(file_path):
+    """
+    在 uploaded_games/ 裡開一個暫存檔（同一個 filesystem，收完才能 atomic 改名）；
+    同時有兩個人上傳同一個版本也不會寫到同一個暫存檔
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=os.path.basename(file_path) + ".",
+                                    suffix=UPLOAD_SUFFIX)
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+def upload_declared(data):
+    """
+    新版 client 在 meta 帶 size / sha256；舊 client 沒帶，檔案以 <END> 結尾
+    """
+    return "size" in data or "sha256" in data
+
+
+def check_upload_meta(data):
+    """
+    回傳錯誤訊息，沒問題回傳 None
+    """
+    size, digest = data.get("size"), data.get("sha256")
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return "invalid size"
+    if size > MAX_UPLOAD_SIZE:
+        return f"file too large (max {MAX_UPLOAD_SIZE} bytes)"
+    if not isinstance(digest, str) or len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return "invalid sha256"
+    return None
+
+
+def receive_exact(conn, f, size):
+    """
+    剛好讀 size bytes 寫進 f（recv_into 同一塊 buffer，不會一直產生新的 bytes），回傳 sha256
+    """
+    view = upload_buffer()
+    h = hashlib.sha256()
+    remaining = size
+    while remaining:
+        n = conn.recv_into(view, min(remaining, len(view)))
+        if not n:
+            raise UploadError(f"connection closed after {size - remaining} of {size} bytes")
+        h.update(view[:n])
+        f.write(view[:n])
+        remaining -= n
+    return h.hexdigest()
+
+
+def receive_until_sentinel(conn, f, sentinel=b"<END>"):
+    """
+    舊 client：讀到 <END> 為止（zip 內容剛好含有 <END> 會被截斷，只為了相容保留）
+    """
     buffer = b""
-    with open(file_path, "wb") as f:
-        while True:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            buffer += chunk
+    while True:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        buffer += chunk
 
-            idx = buffer.find(sentinel)
-            if idx != -1:
-                # 找到結尾標記，寫入標記前的資料即可
-                f.write(buffer[:idx])
-                buffer = b""
-                break
+        idx = buffer.find(sentinel)
+        if idx != -1:
+            # 找到結尾標記，寫入標記前的資料即可
+            f.write(buffer[:idx])
+            buffer = b""
+            break
+
+        # 未找到結尾，保留最後 len(sentinel) - 1 bytes 以防標記斷在 chunk 之間
+        if len(buffer) > len(sentinel):
+            f.write(buffer[:-len(sentinel)])
+            buffer = buffer[-len(sentinel):]
+
+    # 若未找到結尾但連線結束，把剩餘 buffer 寫入
+    if buffer:
+        f.write(buffer)
+
+
+def receive_game_file(data, conn, file_path):
+    """
+    收 meta 後面接著的 zip，回傳 (暫存檔路徑, 驗證過的 sha256 或 None)；
+    失敗時已經回覆錯誤，回傳 (None, None)
+    """
+    f, tmp_path = open_upload_tmp(file_path)
+    try:
+        with f:
+            if not upload_declared(data):
+                receive_until_sentinel(conn, f)
+                return tmp_path, None
+            digest = receive_exact(conn, f, data["size"])
+        if digest != data["sha256"]:
+            raise UploadError("sha256 mismatch")
+        return tmp_path, digest
+    except (UploadError, OSError) as e:
+        os.remove(tmp_path)
+        print(f"[DevServer] upload of {os.path.basename(file_path)} failed: {e}")
+        try:
+            conn.sendall(json.dumps({"status":"error","message":f"upload failed: {e}"}).encode())
+        except OSError:
+            pass
+        return None, None
+
+
+def reject_upload(conn, message):
+    """
+    還沒讀檔案就要回錯誤：client 已經在送檔案了，回覆後把連線關掉，
+    避免剩下的檔案內容被 client_thread 當成下一個 request 的 meta
+    """
+    conn.sendall(json.dumps({"status":"error","message":message}).encode())
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def remove_stale_uploads():
+    """
+    上次 server 中斷時沒收完的暫存檔
+    """
+    for fname in os.listdir(UPLOAD_DIR):
+        if fname.endswith(UPLOAD_SUFFIX):
+            os.remove(os.path.join(UPLOAD_DIR, fname))
+
+
+def upload_target(data):
+    """
+    upload_game / update_game 共用的檢查：回傳 (zip 要放的路徑, 錯誤訊息)
+    - upload_game：game_key = {developer}_{game_name}
+    - update_game：只能更新自己（developer）擁有的遊戲
+    """
+    developer = data["developer"]
+    if data["action"] == "upload_game":
+        game_key = f"{developer}_{data['game_name']}"
+    else:
+        game_key = data["game_key"]  # 直接用 developer_client 傳回來的 key
+        game = DB.get_game(game_key)
+        if game is None:
+            return None, "game not found"
+        if game["developer"] != developer:
+            return None, "no permission to update this game"
+    return os.path.join(UPLOAD_DIR, f"{game_key}_{data['version']}.zip"), None
+
+
+def durable(*tickets):
+    """
+    等修改寫進儲存層才回覆 client；寫不進去（逾時 / 被儲存層拒絕）時回傳錯誤訊息
+    """
+    return None if DB.wait(*tickets) else "storage busy, please retry"
 
-            # 未找到結尾，保留最後 len(sentinel) - 1 bytes 以防標記斷在 chunk 之間
-            if len(buffer) > len(sentinel):
-                f.write(buffer[:-len(sentinel)])
-                buffer = buffer[-len(sentinel):]
 
-        # 若未找到結尾但連線結束，把剩餘 buffer 寫入
-        if buffer:
-            f.write(buffer)
+def upload_game_key(data):
+    if data["action"] == "upload_game":
+        return f"{data['developer']}_{data['game_name']}"
+    return data["game_key"]
 
-    save_db(db)
 
-    response = {"status": "ok", "message": "Game uploaded successfully"}
-    conn.sendall(json.dumps(response).encode())
+def publish_upload(data, tmp_path, file_path, digest=None):
+    """
+    收好的 zip 先檢查內容（common/game_package.py），再改名到 file_path 並寫進 DB，回傳給 client 的回覆。
+    檢查 / 編譯只看暫存檔，不佔 lock；同一款遊戲的檢查 + 寫入包在 game lock 裡，不同遊戲可以同時上架
+    """
+    developer = data["developer"]
+    version   = data["version"]
+    game_key  = upload_game_key(data)
+    try:
+        package = check_package(tmp_path, BLOBS)
+    except PackageError as e:
+        os.remove(tmp_path)
+        return {"status": "error", "message": f"invalid game package: {e}"}
+    with DB.game_lock(game_key):
+        # 收檔期間遊戲可能被改動，寫入前在 lock 裡再檢查一次
+        _, error = upload_target(data)
+        if error:
+            os.remove(tmp_path)
+            return {"status": "error", "message": error}
+        info = store_version_file(tmp_path, file_path, package, digest)
+        if data["action"] == "upload_game":
+            # create new game entry if not exists, if game exists 更新簡介並重新上架
+            tickets = (DB.put_game(game_key, {
+                "developer": developer,
+                "name": data["game_name"],
+                "description": data["description"],
+                "active": True
+            }), DB.put_version(game_key, version, info))
+            message = "Game uploaded successfully"
+        else:
+            tickets = (DB.put_version(game_key, version, info),
+                       DB.update_game(game_key, active=True))  # ensure the game is active when updated
+            message = "Game updated successfully"
+    error = durable(*tickets)
+    if error:
+        return {"status": "error", "message": error}
+    return {"status": "ok", "message": message}
+
+
+# ==========================
+# D1：upload new game
+# # ==========================
+def handle_upload_game(data, conn):
+    """
+    上架新遊戲：
+    - 若該 game_key 尚未存在 => 建立新遊戲
+    - 若已存在 => 視為「補上初始版本」，通常 D2 用 update_game
+      會比較合理；這裡仍允許覆蓋，以防使用者一開始就用 upload。
+    """
+    receive_and_publish(data, conn)
 
 
 # ==========================
 # D2：update game version
 # ==========================
-def handle_update_game(data, conn, db):
+def handle_update_game(data, conn):
     """
     更新遊戲版本：
     - 只能更新自己（developer）擁有的遊戲
     - 新增一個新的 version entry，並存 zip 檔
     """
-    developer = data["developer"]
-    game_key  = data["game_key"]  # 直接用 developer_client 傳回來的 key
-    version   = data["version"]
+    receive_and_publish(data, conn)
 
-    # 權限檢查
-    if developer not in db["developers"] or not db["developers"][developer].get("online"):
-        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
+
+def receive_and_publish(data, conn):
+    """
+    meta 後面直接接整個 zip 的上傳（D1 / D2）
+    """
+    # 必須 login
+    if not authenticate(data):
+        reject_upload(conn, "developer not logged in")
         return
-    if game_key not in db["games"]:
-        conn.sendall(json.dumps({"status":"error","message":"game not found"}).encode())
+    if upload_declared(data):
+        error = check_upload_meta(data)
+        if error:
+            reject_upload(conn, error)
+            return
+    file_path, error = upload_target(data)
+    if error:
+        reject_upload(conn, error)
         return
 
-    game = db["games"][game_key]
-    if game["developer"] != developer:
-        conn.sendall(json.dumps({"status":"error","message":"no permission to update this game"}).encode())
+    # 實際接收檔案資料（先寫暫存檔，驗證完才改名成 file_path）
+    tmp_path, digest = receive_game_file(data, conn, file_path)
+    if tmp_path is None:
         return
+    conn.sendall(json.dumps(publish_upload(data, tmp_path, file_path, digest)).encode())
 
-    # 準備接新版本檔案
-    file_path = os.path.join(UPLOAD_DIR, f"{game_key}_{version}.zip")
-    game["versions"][version] = {
-        "file_path": file_path
-    }
-    game["active"] = True  # ensure the game is active when updated
 
-    sentinel = b"<END>"
-    buffer = b""
-    with open(file_path, "wb") as f:
-        while True:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            buffer += chunk
+# ==========================
+# 可續傳上傳：upload_begin -> upload_chunk（可平行、多條連線）-> upload_commit
+# ==========================
+def handle_upload_begin(data, conn):
+    """
+    data["kind"] 是 upload_game / update_game，其餘欄位和一次上傳的 meta 一樣（含 size / sha256）；
+    同一個檔案再 begin 一次會拿回原本的 session 和已收到的 ranges
+    """
+    if not authenticate(data):
+        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
+        return
+    kind = data.get("kind")
+    if kind not in ("upload_game", "update_game"):
+        conn.sendall(json.dumps({"status":"error","message":"invalid kind"}).encode())
+        return
+    meta = {k: data.get(k) for k in ("game_name", "description", "game_key", "version")}
+    meta.update(action=kind, developer=data["developer"])
+    error = check_upload_meta(data)
+    if not error:
+        file_path, error = upload_target(meta)
+    if error:
+        conn.sendall(json.dumps({"status":"error","message":error}).encode())
+        return
 
-            idx = buffer.find(sentinel)
-            if idx != -1:
-                f.write(buffer[:idx])
-                buffer = b""
-                break
+    chunk_size = data.get("chunk_size", DEFAULT_CHUNK)
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 1:
+        chunk_size = DEFAULT_CHUNK
+    chunk_size = min(chunk_size, MAX_CHUNK)
+    sess = UPLOADS.begin(data["developer"], os.path.basename(file_path), data["size"], data["sha256"],
+                         meta, chunk_size)
+    conn.sendall(json.dumps({
+        "status": "ok",
+        "upload_id": sess["upload_id"],
+        "chunk_size": sess["chunk_size"],
+        "received": sess["ranges"]
+    }).encode())
+
+
+def handle_upload_chunk(data, conn):
+    """
+    meta：upload_id / offset / length（/ sha256，這一段的 digest），後面剛好接 length bytes，
+    直接寫到 session data 檔的 offset；同一條連線可以連續送很多個 chunk。
+    寫入期間登記成 session 的 writer，commit 會等這段寫完；commit 開始之後的 chunk 直接拒絕
+    """
+    if not authenticate(data):
+        reject_upload(conn, "developer not logged in")
+        return
+    with UPLOADS.writing(data.get("upload_id"), data["developer"]) as sess:
+        if sess is None:
+            reject_upload(conn, "upload not found")
+            return
+        res = receive_chunk(data, conn, sess)
+    if res is not None:
+        conn.sendall(json.dumps(res).encode())
 
-            if len(buffer) > len(sentinel):
-                f.write(buffer[:-len(sentinel)])
-                buffer = buffer[-len(sentinel):]
 
-        if buffer:
-            f.write(buffer)
+def receive_chunk(data, conn, sess):
+    """
+    收一個 chunk 寫進 data 檔並記下區間，回傳給 client 的回覆；連線已經斷掉 / 拒絕過時回傳 None
+    """
+    offset, length = data.get("offset"), data.get("length")
+    if (not isinstance(offset, int) or not isinstance(length, int) or offset < 0 or length < 1
+            or length > MAX_CHUNK or offset + length > sess["size"]):
+        reject_upload(conn, "invalid chunk range")
+        return None
+
+    try:
+        with open(UPLOADS.data_path(sess["upload_id"]), "r+b") as f:
+            f.seek(offset)
+            digest = receive_exact(conn, f, length)
+    except (UploadError, OSError) as e:
+        # 連線斷了（沒辦法回覆）；這段沒記下來，client 會重送
+        print(f"[DevServer] chunk {offset}+{length} of {sess['upload_id']} failed: {e}")
+        return None
+    if data.get("sha256") not in (None, digest):
+        return {"status":"error","message":"chunk sha256 mismatch"}
+    received = UPLOADS.mark(sess["upload_id"], offset, offset + length)
+    if received is None:
+        return {"status":"error","message":"upload not found"}
+    return {"status":"ok","received":received}
+
+
+def handle_upload_commit(data, conn):
+    """
+    所有區間都收到後驗證整個檔案的 sha256，改名到 uploaded_games/ 並上架 / 更新；
+    檔案內容不符時 session 直接刪掉，client 要從頭重傳
+    """
+    if not authenticate(data):
+        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
+        return
+    upload_id = data.get("upload_id")
+    sess, error = UPLOADS.claim(upload_id, data["developer"])
+    if error:
+        res = {"status":"error","message":error}
+        if sess is not None:
+            res["received"] = sess["ranges"]
+        conn.sendall(json.dumps(res).encode())
+        return
 
-    save_db(db)
-    conn.sendall(json.dumps({"status":"ok","message":"Game updated successfully"}).encode())
+    try:
+        data_path = UPLOADS.data_path(upload_id)
+        if sha256_file(data_path) != sess["sha256"]:
+            UPLOADS.remove(upload_id)
+            conn.sendall(json.dumps({"status":"error","message":"sha256 mismatch, upload again"}).encode())
+            return
+        meta = sess["meta"]
+        file_path, error = upload_target(meta)
+        if error:
+            UPLOADS.remove(upload_id)
+            conn.sendall(json.dumps({"status":"error","message":error}).encode())
+            return
+        # session 的 data 檔和 uploaded_games/ 在同一個 filesystem，先改名成暫存檔再走原本的流程
+        f, tmp_path = open_upload_tmp(file_path)
+        f.close()
+        os.replace(data_path, tmp_path)
+        res = publish_upload(meta, tmp_path, file_path, sess["sha256"])
+    except BaseException:
+        UPLOADS.release(upload_id)
+        raise
+    UPLOADS.remove(upload_id)
+    conn.sendall(json.dumps(res).encode())
 
 
 # ==========================
 # D3：remove game
 # ==========================
-def handle_remove_game(data, conn, db):
+def handle_remove_game(data, conn):
     """
     下架遊戲：
     - 不直接刪資料，改成 active=False
     - 方便之後做「重新上架」或保留歷史評價
     """
+    if not authenticate(data):
+        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
+        return
     developer = data["developer"] # get developer name to confirm the request
     game_key  = data["game_key"]
 
-    if developer not in db["developers"] or not db["developers"][developer].get("online"):
-        conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
-        return
+    with DB.game_lock(game_key):
+        game = DB.get_game(game_key)
+        if game is None:
+            conn.sendall(json.dumps({"status":"error","message":"game not found"}).encode())
+            return
 
-    if game_key not in db["games"]:
-        conn.sendall(json.dumps({"status":"error","message":"game not found"}).encode())
-        return
+        if game["developer"] != developer: # not developer , shouldn't remove the game
+            conn.sendall(json.dumps({"status":"error","message":"no permission to remove this game"}).encode())
+            return
 
-    game = db["games"][game_key]
-    if game["developer"] != developer: # not developer , shouldn't remove the game
-        conn.sendall(json.dumps({"status":"error","message":"no permission to remove this game"}).encode())
+        ticket = DB.update_game(game_key, active=False)
+    error = durable(ticket)
+    if error:
+        conn.sendall(json.dumps({"status":"error","message":error}).encode())
         return
-
-    game["active"] = False
-    save_db(db)
     conn.sendall(json.dumps({"status":"ok","message":"Game removed (inactive)"}).encode())
 
 
 # ==========================
 # see the game list（for D2 / D3）
 # ==========================
-def handle_list_my_games(data, conn, db):
+def handle_list_my_games(data, conn):
     """
     回傳該 developer 擁有的所有遊戲（包含 active / inactive）
     """
-    developer = data["developer"]
-    if developer not in db["developers"] or not db["developers"][developer].get("online"):
+    if not authenticate(data):
         conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
         return
+    developer = data["developer"]
 
     my_games = []
-    for key, info in db["games"].items():
-        if info["developer"] == developer:
-            latest_version = sorted(info["versions"].keys())[-1] if info["versions"] else None
-            my_games.append({
-                "game_key": key,
-                "name": info["name"],
-                "description": info["description"],
-                "active": info.get("active", True),
-                "latest_version": latest_version
-            })
+    for game in DB.list_games(developer):
+        my_games.append({
+            "game_key": game["game_key"],
+            "name": game["name"],
+            "description": game["description"],
+            "active": game["active"],
+            "latest_version": game["latest_version"]
+        })
 
     conn.sendall(json.dumps({"status":"ok","games":my_games}).encode())
 
@@ -217,21 +523,34 @@ def handle_list_my_games(data, conn, db):
 # ==========================
 # the handler of each client connection
 # ==========================
-def client_thread(conn, addr):
-    print(f"[Developer Server] Client connected:", addr)
+class FramedReply:
+    """
+    request 帶 "framed": true 時用：每個回覆（handler 的一次 sendall）前面加 4-byte 長度，
+    client 在同一條連線連續送 request 也分得出每個回覆；收檔案用的 recv / recv_into 等直接交給 socket
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
 
-    # 每個 connection 開始時載入最新 DB
-    db = load_db()
+    def sendall(self, data):
+        self.sock.sendall(encode_frame(data))
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def client_thread(sock, addr):
+    print(f"[Developer Server] Client connected:", addr)
 
     while True:
         # 先讀取前 4 bytes 的長度，再讀完整 JSON meta，避免 meta 和檔案黏在同一個 recv
-        header = conn.recv(4)
+        header = sock.recv(4)
         if not header:
             break
         meta_len = int.from_bytes(header, "big")
         meta_bytes = b""
         while len(meta_bytes) < meta_len:
-            chunk = conn.recv(meta_len - len(meta_bytes))
+            chunk = sock.recv(meta_len - len(meta_bytes))
             if not chunk:
                 break
             meta_bytes += chunk
@@ -243,6 +562,8 @@ def client_thread(conn, addr):
         except json.JSONDecodeError:
             continue
 
+        # 舊 client 一個 request 一條連線、回覆是裸 JSON；新 client 整個 session 共用一條連線
+        conn = FramedReply(sock) if data.get("framed") is True else sock
         action = data.get("action")
 
         if action == "register":
@@ -251,50 +572,56 @@ def client_thread(conn, addr):
             if not name or not pwd:
                 conn.sendall(json.dumps({"status":"error","message":"missing fields"}).encode())
                 continue
-            if name in db["developers"]:
+            # update state as login after registeration ，方便首次使用
+            ticket = DB.add_developer(name, {"password": pwd, "online": True, "last_seen": time.time()})
+            if ticket is None:
                 conn.sendall(json.dumps({"status":"error","message":"account exists"}).encode())
                 continue
-            # update state as login after registeration ，方便首次使用
-            db["developers"][name] = {"password": pwd, "online": True, "last_seen": time.time()}
-            save_db(db)
-            conn.sendall(json.dumps({"status":"ok","message":"registered and logged in"}).encode())
+            error = durable(ticket)
+            if error:
+                conn.sendall(json.dumps({"status":"error","message":error}).encode())
+                continue
+            token = SESSIONS.create(name)
+            conn.sendall(json.dumps({"status":"ok","message":"registered and logged in","token":token}).encode())
         elif action == "login":
             name = data.get("name")
             pwd  = data.get("password")
-            dev = db["developers"].get(name)
+            dev = DB.get_developer(name)
             if not dev or dev.get("password") != pwd:
                 conn.sendall(json.dumps({"status":"error","message":"invalid credentials"}).encode())
                 continue
-            # 允許覆蓋舊 session，避免異常斷線卡在線
-            dev["online"] = True
-            dev["last_seen"] = time.time()
-            save_db(db)
-            conn.sendall(json.dumps({"status":"ok","message":"login success"}).encode())
+            # 允許覆蓋舊 session，避免異常斷線卡在線（舊 token 同時失效）
+            token = SESSIONS.create(name)
+            PRESENCE.mark(name, True)
+            conn.sendall(json.dumps({"status":"ok","message":"login success","token":token}).encode())
         elif action == "logout":
-            name = data.get("name")
-            dev = db["developers"].get(name)
-            if dev:
-                dev["online"] = False
-                dev["last_seen"] = 0
-                save_db(db)
+            # 只登出 token 對應的 developer
+            name = SESSIONS.revoke(data.get("token"))
+            if name is not None:
+                PRESENCE.mark(name, False)
             conn.sendall(json.dumps({"status":"ok","message":"logout"}).encode())
         elif action == "heartbeat":
-            name = data.get("name")
-            dev = db["developers"].get(name)
-            if dev and dev.get("online"):
-                dev["last_seen"] = time.time()
-                save_db(db)
-            conn.sendall(json.dumps({"status":"ok"}).encode())
+            # 只更新記憶體裡 session 的 last_seen，不寫 DB
+            if authenticate(data):
+                conn.sendall(json.dumps({"status":"ok"}).encode())
+            else:
+                conn.sendall(json.dumps({"status":"error","message":"developer not logged in"}).encode())
         elif action == "upload_game":
-            handle_upload_game(data, conn, db)
+            handle_upload_game(data, conn)
         elif action == "list_my_games":
-            handle_list_my_games(data, conn, db)
+            handle_list_my_games(data, conn)
         elif action == "update_game":
-            handle_update_game(data, conn, db)
+            handle_update_game(data, conn)
         elif action == "remove_game":
-            handle_remove_game(data, conn, db)
+            handle_remove_game(data, conn)
+        elif action == "upload_begin":
+            handle_upload_begin(data, conn)
+        elif action == "upload_chunk":
+            handle_upload_chunk(data, conn)
+        elif action == "upload_commit":
+            handle_upload_commit(data, conn)
 
-    conn.close()
+    sock.close()
 
 
 # ==========================
@@ -317,29 +644,37 @@ def find_available_port(start_port=5050, max_port=6000):
 
 
 def start_server():
+    global STORAGE, DB
+    STORAGE = open_storage()
+    DB = DevStore(STORAGE)
+    DB.start()
     server, port = find_available_port()
 
     print(f"Hello I am developer server, I'm running on port {port}...")
-
-    def expire_loop():
+    remove_stale_uploads()
+    # 超過 DEV_UPLOAD_TTL_HOURS 沒動靜的可續傳 session（啟動時先清一次，之後每小時）
+    start_cleanup_loop(UPLOADS)
+
+    # session 不會留到重啟之後，上次還標記在線的 developer 都要重新登入
+    stale = {name: (False, 0) for name, dev in DB.developers.items() if dev.get("online")}
+    if stale:
+        DB.set_presence(stale)
+
+    # 60 秒沒有任何 request（包含心跳）的 session 過期（heap，只處理到期的），在線狀態批次寫回
+    start_presence_loop(SESSIONS, PRESENCE, log_prefix="[DevServer]")
+
+    # 公布 port：探索檔 + UDP 查詢，client 不用再逐一掃 port
+    publish_endpoint(port)
+    start_udp_responder(port)
+    try:
         while True:
-            time.sleep(30)
-            db = load_db()
-            now = time.time()
-            changed = False
-            for dev in db["developers"].values():
-                last = dev.get("last_seen", 0)
-                if dev.get("online") and now - last > 60:
-                    dev["online"] = False
-                    changed = True
-            if changed:
-                save_db(db)
-
-    threading.Thread(target=expire_loop, daemon=True).start()
-
-    while True:
-        conn, addr = server.accept()
-        threading.Thread(target=client_thread, args=(conn, addr)).start()
+            conn, addr = server.accept()
+            threading.Thread(target=client_thread, args=(conn, addr)).start()
+    finally:
+        withdraw_endpoint()
+        # 還沒寫回的在線狀態 / 修改
+        PRESENCE.flush()
+        DB.flush()
 
 
 if __name__ == "__main__":
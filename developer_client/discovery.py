@@ -0,0 +1,97 @@
+"""
+Developer Server 位址探索
+
+原本 developer server 從 5050 往上找第一個能 bind 的 port，client 每個 request（包含心跳）
+都從 5050 掃到 6000 試 connect，server 在比較後面的 port 或在別台機器時一次操作要試上百次。
+現在 server 主動公布自己的 port：
+- 探索檔：啟動時寫 {"host", "port", "pid"} 到 DEV_DISCOVERY_FILE（預設 developer_client/dev_server.json），
+  結束時刪掉；同一台機器（或共用家目錄的工作站）的 client 直接讀
+- UDP：server 在固定的 DEV_DISCOVERY_PORT（預設 5049）回答查詢，別台機器的 client 送一個封包就知道 port
+
+client 找到之後整個 session 都沿用（見 developer_client.connect_to_server），兩種都失敗才退回掃 port。
+"""
+import json
+import os
+import socket
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DISCOVERY_FILE = os.environ.get("DEV_DISCOVERY_FILE", os.path.join(BASE_DIR, "dev_server.json"))
+DISCOVERY_PORT = int(os.environ.get("DEV_DISCOVERY_PORT", "5049"))
+QUERY = b"developer_server?"
+QUERY_TIMEOUT = 0.5
+
+
+# ========= server 端 =========
+def publish_endpoint(port):
+    info = {"host": socket.gethostname(), "port": port, "pid": os.getpid()}
+    tmp = f"{DISCOVERY_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(info, f)
+    os.replace(tmp, DISCOVERY_FILE)
+
+
+def withdraw_endpoint():
+    """
+    server 結束時刪掉探索檔（已經被新啟動的 server 蓋掉就不動）
+    """
+    info = read_discovery_file()
+    if info and info.get("pid") == os.getpid():
+        try:
+            os.remove(DISCOVERY_FILE)
+        except OSError:
+            pass
+
+
+def start_udp_responder(port, log_prefix="[DevServer]"):
+    """
+    在 DISCOVERY_PORT 回答 QUERY；port 被佔用（例如同一台機器開了第二個 server）就只靠探索檔
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(("0.0.0.0", DISCOVERY_PORT))
+    except OSError as e:
+        sock.close()
+        print(f"{log_prefix} UDP discovery disabled: {e}")
+        return None
+    reply = json.dumps({"service": "developer_server", "port": port}).encode()
+
+    def loop():
+        while True:
+            try:
+                data, addr = sock.recvfrom(512)
+                if data.strip() == QUERY:
+                    sock.sendto(reply, addr)
+            except OSError as e:
+                print(f"{log_prefix} UDP discovery error: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
+    return sock
+
+
+# ========= client 端 =========
+def read_discovery_file():
+    try:
+        with open(DISCOVERY_FILE, "r") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if isinstance(info, dict) and isinstance(info.get("port"), int) else None
+
+
+def query_udp(host, timeout=QUERY_TIMEOUT):
+    """
+    問 host 上的 developer server 在哪個 port，沒回應回傳 None
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(QUERY, (host, DISCOVERY_PORT))
+        data, _ = sock.recvfrom(512)
+        info = json.loads(data.decode())
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+    port = info.get("port") if isinstance(info, dict) else None
+    return port if isinstance(port, int) else None
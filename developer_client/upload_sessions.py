@@ -0,0 +1,231 @@
+"""
+Developer Server 的可續傳上傳：upload_begin -> upload_chunk（任意順序、可平行）-> upload_commit
+
+原本 upload_game / update_game 是一條連線從 byte 0 一路送到底，中途斷線就整個重來。
+這裡每個上傳是一個 session，存在 {root}/{upload_id}/：
+- data        ：預先 truncate 成宣告的大小（sparse file），每個 chunk 直接寫到自己的 offset
+- session.json：上傳的 meta 和已經收到的區間 ranges（[[start, end), ...]，合併過、排序過）
+
+- upload_id 由 (developer, 目標檔名, size, sha256) 算出來：同一個檔案再 begin 一次就拿回同一個 session
+  和已收到的 ranges，client 重開、server 重啟後都能從中斷的地方繼續
+- 先寫 data 再記 range：中途 crash 最多讓某個 chunk 重送；commit 時再驗整個檔案的 sha256
+- chunk 寫入期間登記成 writer（writing）；commit（claim）之後新的 chunk 一律拒絕，
+  並等還在寫的 chunk 都結束才驗 sha256 / 改名，晚到或重複的連線不會在驗完之後改到檔案。
+  同一個 session 的 chunk 之間不互斥（各寫各的 offset），平行上傳不受影響
+- 超過 DEV_UPLOAD_TTL_HOURS（預設 24）沒有動靜的 session 會被清掉
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_CHUNK = 1024 * 1024
+MAX_CHUNK = 8 * 1024 * 1024
+SESSION_TTL = float(os.environ.get("DEV_UPLOAD_TTL_HOURS", "24")) * 3600
+CLEANUP_INTERVAL = 3600
+COMMIT_WAIT = 30.0      # commit 最多等還在寫的 chunk 幾秒（卡住的連線不能讓 commit 一直等）
+
+
+def make_upload_id(developer, file_name, size, digest):
+    return hashlib.sha256(f"{developer}\0{file_name}\0{size}\0{digest}".encode()).hexdigest()[:32]
+
+
+def valid_upload_id(upload_id):
+    return (isinstance(upload_id, str) and len(upload_id) == 32
+            and all(c in "0123456789abcdef" for c in upload_id))
+
+
+def add_range(ranges, start, end):
+    """
+    把 [start, end) 併進已排序、不重疊的 ranges，回傳新的 list
+    """
+    merged = []
+    for s, e in ranges:
+        if e < start or s > end:
+            merged.append([s, e])
+        else:
+            start, end = min(s, start), max(e, end)
+    merged.append([start, end])
+    merged.sort()
+    return merged
+
+
+def received_bytes(ranges):
+    return sum(e - s for s, e in ranges)
+
+
+class UploadSessions:
+    def __init__(self, root, ttl=SESSION_TTL):
+        self.root = root
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)   # writer 結束時通知等著 commit 的 claim
+        self.sessions = {}      # upload_id -> session（從 session.json 載入後的快取）
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, upload_id):
+        return os.path.join(self.root, upload_id)
+
+    def data_path(self, upload_id):
+        return os.path.join(self._dir(upload_id), "data")
+
+    def _load(self, upload_id):
+        """
+        呼叫端持有 self.lock
+        """
+        sess = self.sessions.get(upload_id)
+        if sess is not None:
+            return sess
+        try:
+            with open(os.path.join(self._dir(upload_id), "session.json"), "r") as f:
+                sess = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.data_path(upload_id)):
+            return None
+        sess["committing"] = False
+        sess["writers"] = 0
+        self.sessions[upload_id] = sess
+        return sess
+
+    def _save(self, sess):
+        path = os.path.join(self._dir(sess["upload_id"]), "session.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: v for k, v in sess.items() if k not in ("committing", "writers")}, f)
+        os.replace(tmp, path)
+
+    # ---------- begin / chunk ----------
+    def begin(self, developer, file_name, size, digest, meta, chunk_size=DEFAULT_CHUNK):
+        """
+        開新的 session，或拿回同一個檔案還沒完成的 session；回傳 session 的複本
+        """
+        upload_id = make_upload_id(developer, file_name, size, digest)
+        with self.lock:
+            sess = self._load(upload_id)
+            if sess is None:
+                os.makedirs(self._dir(upload_id), exist_ok=True)
+                with open(self.data_path(upload_id), "wb") as f:
+                    f.truncate(size)
+                sess = {
+                    "upload_id": upload_id,
+                    "developer": developer,
+                    "file_name": file_name,
+                    "size": size,
+                    "sha256": digest,
+                    "chunk_size": chunk_size,
+                    "meta": meta,
+                    "ranges": [],
+                    "committing": False,
+                    "writers": 0,
+                }
+                self.sessions[upload_id] = sess
+            sess["updated"] = time.time()
+            self._save(sess)
+            return dict(sess)
+
+    @contextmanager
+    def writing(self, upload_id, developer):
+        """
+        with 區塊內登記成這個 session 的 writer，拿到 developer 自己的 session 複本；
+        session 不在或已經在 commit 拿到 None。寫完用 mark 記區間
+        """
+        live = None
+        if valid_upload_id(upload_id):
+            with self.lock:
+                sess = self._load(upload_id)
+                if sess is not None and sess["developer"] == developer and not sess["committing"]:
+                    sess["writers"] += 1
+                    live = sess
+        try:
+            yield dict(live) if live is not None else None
+        finally:
+            if live is not None:
+                with self.lock:
+                    live["writers"] -= 1
+                    self.idle.notify_all()
+
+    def mark(self, upload_id, start, end):
+        """
+        chunk 寫進 data 之後記下區間；回傳目前收到的 bytes 數，session 已經不在回傳 None
+        """
+        with self.lock:
+            sess = self.sessions.get(upload_id)
+            if sess is None or sess["committing"]:
+                return None
+            sess["ranges"] = add_range(sess["ranges"], start, end)
+            sess["updated"] = time.time()
+            self._save(sess)
+            return received_bytes(sess["ranges"])
+
+    # ---------- commit ----------
+    def claim(self, upload_id, developer):
+        """
+        開始 commit：回傳 (session, 錯誤訊息)。成功後之後的 chunk 都會被拒絕，
+        而且會等到還在寫的 chunk 都結束才回傳（等超過 COMMIT_WAIT 就放棄，client 稍後再 commit）；
+        呼叫端最後要 remove（完成 / 檔案壞掉）或 release（暫時失敗，可以再 commit）
+        """
+        if not valid_upload_id(upload_id):
+            return None, "upload not found"
+        with self.lock:
+            sess = self._load(upload_id)
+            if sess is None or sess["developer"] != developer:
+                return None, "upload not found"
+            if sess["committing"]:
+                return None, "upload is already being committed"
+            if received_bytes(sess["ranges"]) != sess["size"]:
+                return dict(sess), "upload incomplete"
+            sess["committing"] = True
+            deadline = time.monotonic() + COMMIT_WAIT
+            while sess["writers"]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    sess["committing"] = False
+                    return dict(sess), "upload still receiving chunks, retry commit"
+                self.idle.wait(remaining)
+            return dict(sess), None
+
+    def release(self, upload_id):
+        with self.lock:
+            sess = self.sessions.get(upload_id)
+            if sess is not None:
+                sess["committing"] = False
+
+    def remove(self, upload_id):
+        with self.lock:
+            self.sessions.pop(upload_id, None)
+            shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def cleanup(self, now=None):
+        """
+        刪掉超過 ttl 沒有更新的 session，回傳刪掉的數量
+        """
+        now = now or time.time()
+        removed = 0
+        for upload_id in os.listdir(self.root):
+            with self.lock:
+                sess = self._load(upload_id)
+                if sess is not None and (sess["committing"] or sess["writers"]
+                                         or now - sess.get("updated", 0) < self.ttl):
+                    continue
+                self.sessions.pop(upload_id, None)
+                shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def start_cleanup_loop(sessions, log_prefix="[DevServer]"):
+    def loop():
+        while True:
+            try:
+                removed = sessions.cleanup()
+                if removed:
+                    print(f"{log_prefix} removed {removed} expired upload sessions")
+            except OSError as e:
+                print(f"{log_prefix} upload session cleanup failed: {e}")
+            time.sleep(CLEANUP_INTERVAL)
+
+    threading.Thread(target=loop, daemon=True).start()
@@ -1,57 +1,333 @@
 import socket
 import json
+import hashlib
 import os
 import subprocess
 import sys
 import zipfile
+import shutil
 import threading
-import base64
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.framing import send_json_frame, read_json_frame  # noqa: E402
+from common.game_package import local_entry  # noqa: E402
 
 LOBBY_IP   = "127.0.0.1"
 LOBBY_PORT = 6060
 BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
 HEARTBEAT_INTERVAL = 20 # seconds
+DOWNLOAD_CHUNK = 64 * 1024
+DOWNLOAD_RETRIES = 3
 
 # the record of installed plugins for each player
 PLUGIN_FILE_TEMPLATE = "plugins_{player}.json"
 
 
 # ========= socket 傳送工具 =========
+# 整個 session 共用一條 framed 連線（4-byte 長度 + JSON），heartbeat thread 也走同一條
+_conn = None
+_conn_lock = threading.Lock()
+
+# 登入後 server 發的 session token，每個 request 自動帶上；
+# server 重啟 / session 過期時用記住的帳密重新登入一次
+SESSION = {"name": None, "password": None, "token": None}
+_session_lock = threading.Lock()
+NO_RELOGIN_ACTIONS = {"player_login", "player_register", "player_logout"}
+
+
+def _connect():
+    s = socket.create_connection((LOBBY_IP, LOBBY_PORT))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return s
+
+
+def _drop_connection():
+    global _conn
+    if _conn is not None:
+        try:
+            _conn.close()
+        except OSError:
+            pass
+        _conn = None
+
+
+def close_connection():
+    with _conn_lock:
+        _drop_connection()
+
+
+def _with_token(data):
+    if SESSION["token"] and "token" not in data:
+        data = dict(data, token=SESSION["token"])
+    return data
+
+
+def _session_lost(data, res):
+    return (res is not None and res.get("message") == "player not logged in"
+            and data.get("action") not in NO_RELOGIN_ACTIONS and SESSION["password"])
+
+
+def relogin(stale_token):
+    """
+    token 失效時用記住的帳密重新登入；其他 thread 已經換過 token 就直接沿用
+    """
+    with _session_lock:
+        if SESSION["token"] != stale_token:
+            return True
+        res = _roundtrip({"action": "player_login", "name": SESSION["name"], "password": SESSION["password"]})
+        if not res or res.get("status") != "ok":
+            return False
+        SESSION["token"] = res.get("token")
+        return True
+
+
+def start_session(name, password, token):
+    with _session_lock:
+        SESSION.update(name=name, password=password, token=token)
+
+
+def end_session():
+    with _session_lock:
+        SESSION.update(name=None, password=None, token=None)
+
+
 def send_request(data):
     """
-    封裝好與 Lobby Server 的一次性 Request/Response 互動：
-    1. 建立 socket
-    2. 傳送 JSON
-    3. 接收回覆 JSON
+    封裝好與 Lobby Server 的 Request/Response 互動（自動帶 session token）
+    token 失效（server 重啟 / 太久沒心跳）時重新登入一次再送
+    """
+    token = SESSION["token"]
+    res = _roundtrip(_with_token(data))
+    if _session_lost(data, res) and relogin(token):
+        res = _roundtrip(_with_token(data))
+    return res
+
+
+def _roundtrip(data):
+    """
+    1. 第一次呼叫時建立連線，之後一直沿用
+    2. 傳送一個 frame（JSON）
+    3. 接收回覆的 frame
+    沿用的連線已經失效（例如 server 重啟）時自動重連再送一次
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((LOBBY_IP, LOBBY_PORT))
-    s.sendall(json.dumps(data).encode())
-    # 半關閉寫端，讓 server 知道不再有更多資料
+    global _conn
+    with _conn_lock:
+        while True:
+            fresh = _conn is None
+            if fresh:
+                _conn = _connect()
+            try:
+                send_json_frame(_conn, data)
+                res = read_json_frame(_conn)
+            except OSError:
+                _drop_connection()
+                if fresh:
+                    raise
+                continue
+            except ValueError:
+                return None
+            if res is None:
+                # server 關掉了連線
+                _drop_connection()
+                if fresh:
+                    return None
+                continue
+            return res
+
+
+def send_stream_request(data):
+    """
+    給回覆是「JSON header + 原始 bytes」的 request（例如 stream 下載）：
+    另開一條連線，不佔住 session 連線（下載時 heartbeat 照常送）。
+    回傳 (socket, reader, header)，呼叫端從 reader 繼續讀 bytes，用完自己 close
+    """
+    token = SESSION["token"]
+    s, reader, header = _stream_roundtrip(_with_token(data))
+    if _session_lost(data, header) and relogin(token):
+        s.close()
+        s, reader, header = _stream_roundtrip(_with_token(data))
+    return s, reader, header
+
+
+def _stream_roundtrip(data):
+    s = _connect()
+    send_json_frame(s, data)
+    # 這條連線只用一次：半關閉寫端，server 送完就會關線
     try:
         s.shutdown(socket.SHUT_WR)
     except OSError:
         pass
-
-    # Responses (e.g., download_game) can be large; keep reading until server closes.
-    chunks = []
+    try:
+        header = read_json_frame(s)
+    except (OSError, ValueError):
+        header = None
+    reader = s.makefile("rb")
+    return s, reader, header
+
+
+# ========= server push：房間 / 聊天事件 =========
+# 另開一條連線送 subscribe，之後 server 把房間變動 / 同房聊天推過來（server/lobby_events.py），
+# 房間列表和「我在哪個房間」直接看本地的 view，不用每個選單都重新 list_rooms
+EVENT_RETRY = 3          # seconds，訂閱連線斷掉後多久重連
+CHAT_INBOX_LIMIT = 200   # 每個房間最多留幾則推過來、還沒顯示的訊息
+CHAT_HISTORY_LIMIT = 500 # 聊天室畫面最多留幾則
+EVENTS = None            # 登入後的 LobbyEvents
+
+
+class LobbyEvents:
+    def __init__(self, player):
+        self.player = player
+        self.lock = threading.Lock()
+        self.rooms = {}         # room_id -> room（server 推過來的最新狀態）
+        self.chat = {}          # room_id -> deque([{"player", "message"}])
+        self.ready = threading.Event()   # 拿到 snapshot 且連線還在
+        self.generation = 0     # 每次重新訂閱 +1：中間斷線可能漏掉事件，聊天要重新用 since 補
+        self.stop_event = threading.Event()
+        self.sock = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.ready.clear()
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join(timeout=1)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                if not self._listen():
+                    return   # 舊版 server 沒有 subscribe，維持原本的查詢方式
+            except (OSError, ValueError):
+                pass
+            self.ready.clear()
+            self.stop_event.wait(EVENT_RETRY)
+
+    def _listen(self):
+        token = SESSION["token"]
+        s = _connect()
+        self.sock = s
+        try:
+            send_json_frame(s, {"action": "subscribe", "token": token, "topics": ["rooms", "chat"]})
+            res = read_json_frame(s)
+            if res is None:
+                return True
+            if res.get("status") != "ok":
+                if str(res.get("message", "")).startswith("unknown action"):
+                    return False
+                if res.get("message") == "player not logged in" and SESSION["password"]:
+                    relogin(token)
+                return True
+            with self.lock:
+                self.rooms = {r["room_id"]: r for r in res["rooms"]}
+                self.generation += 1
+            self.ready.set()
+            while True:
+                event = read_json_frame(s)
+                if event is None:
+                    return True
+                self._apply(event)
+        finally:
+            self.sock = None
+            s.close()
+
+    def _apply(self, event):
+        kind = event.get("event")
+        with self.lock:
+            if kind == "room" and event.get("op") == "update":
+                room = event["room"]
+                old = self.rooms.get(room["room_id"]) or {}
+                self.rooms[room["room_id"]] = room
+                if (self.player in room.get("players", []) and room.get("started")
+                        and not old.get("started") and room.get("creator") != self.player):
+                    print(f"\n📣 Room {room['room_id']} 房主已開始遊戲（port {room.get('server_port')}），"
+                          f"可選『啟動遊戲 client』進入")
+            elif kind == "room" and event.get("op") == "delete":
+                old = self.rooms.pop(event["room_id"], None)
+                self.chat.pop(event["room_id"], None)
+                if old and self.player in old.get("players", []) and old.get("creator") != self.player:
+                    print(f"\n📣 Room {event['room_id']} 已被刪除")
+            elif kind == "chat":
+                inbox = self.chat.setdefault(event["room_id"], deque(maxlen=CHAT_INBOX_LIMIT))
+                inbox.append(event["message"])
+
+    # ---------- 給選單用 ----------
+    def room_list(self):
+        with self.lock:
+            return list(self.rooms.values())
+
+    def take_chat(self, room_id):
+        with self.lock:
+            inbox = self.chat.pop(room_id, None)
+            return list(inbox or ())
+
+    def note_room(self, room):
+        """
+        自己的 request 回覆帶回的房間：先套用，server 推的事件之後會依序跟上
+        """
+        with self.lock:
+            self.rooms[room["room_id"]] = room
+
+    def note_left(self, player):
+        with self.lock:
+            for rid, r in list(self.rooms.items()):
+                if player in r.get("players", []):
+                    players = [p for p in r["players"] if p != player]
+                    if players:
+                        self.rooms[rid] = dict(r, players=players)
+                    else:
+                        del self.rooms[rid]
+
+    def note_deleted(self, room_id):
+        with self.lock:
+            self.rooms.pop(room_id, None)
+            self.chat.pop(room_id, None)
+
+
+def events_ready():
+    return EVENTS is not None and EVENTS.ready.is_set()
+
+
+# ========= 分頁列表（list_rooms / get_games / list_players） =========
+LIST_PAGE = 20    # 列表一次顯示 / 抓幾筆
+GAME_PAGE = 100   # 同步遊戲目錄時一次抓幾筆
+
+
+def iter_pages(req, limit=LIST_PAGE):
+    """
+    依 next_cursor 一頁一頁送 list 類的 request，yield 每頁的回覆；失敗時 yield None 後結束
+    """
+    cursor = None
     while True:
-        buf = s.recv(4096)
-        if not buf:
-            break
-        chunks.append(buf)
-    s.close()
+        page_req = dict(req, limit=limit)
+        if cursor:
+            page_req["cursor"] = cursor
+        res = send_request(page_req)
+        if not res or res.get("status") != "ok":
+            yield None
+            return
+        yield res
+        cursor = res.get("next_cursor")
+        if not cursor:
+            return
 
-    raw = b"".join(chunks)
-    try:
-        return json.loads(raw.decode())
-    except:
-        return None
+
+def more_pages():
+    return input("Enter 看下一頁，q 結束: ").strip().lower() != "q"
 
 
 def heartbeat_loop(player, stop_event):
     while not stop_event.wait(HEARTBEAT_INTERVAL):
         try:
+            # 玩家由 token 決定，name 只是給舊版 server 看的
             send_request({"action":"player_heartbeat","name":player})
         except:
             pass
@@ -109,16 +385,48 @@ def configure_lobby_endpoint():
 
 
 # ========= P1：view game =========
+# 上次拿到的商城列表；revision 沒變時 server 只回 not_modified，不用重傳整份列表
+CATALOG_CACHE = {"revision": None, "games": []}
+
+
+def fetch_games():
+    """
+    目錄沒變就用快取；有變就分頁抓完整目錄（每頁 GAME_PAGE 筆，回覆大小有上限）
+    抓到一半目錄又被改（cursor expired）就從頭再抓一次
+    """
+    res = send_request({"action": "get_games", "revision": CATALOG_CACHE["revision"], "limit": GAME_PAGE})
+    if not res:
+        return None
+    if res["status"] == "not_modified":
+        return CATALOG_CACHE["games"]
+    for _ in range(2):
+        if not res or res["status"] != "ok":
+            return None
+        games = list(res["games"])
+        while res.get("next_cursor"):
+            res = send_request({"action": "get_games", "limit": GAME_PAGE, "cursor": res["next_cursor"]})
+            if not res or res["status"] != "ok":
+                break
+            games.extend(res["games"])
+        else:
+            CATALOG_CACHE["revision"] = res.get("revision")
+            CATALOG_CACHE["games"] = games
+            return games
+        res = send_request({"action": "get_games", "limit": GAME_PAGE})
+    return None
+
+
 def view_games():
-    res = send_request({"action": "get_games"})
+    games = fetch_games()
 
-    if not res or res["status"] != "ok":
+    if games is None:
         print("❌ 無法取得遊戲列表")
         return []
 
-    games = res["games"]
     print("\n=== 可遊玩遊戲列表 ===")
     for idx, g in enumerate(games):
+        if idx and idx % LIST_PAGE == 0 and not more_pages():
+            break
         print(f"{idx+1}. {g['name']} ({g['latest_version']}) - by {g['developer']}")
         # average rating
         if g["avg_score"] is not None:
@@ -143,32 +451,197 @@ def download_game(player):
         return
 
     # Rax : always get new version
+    game_key = game["game_key"]
+    version  = game["latest_version"]
     req = {
         "action": "download_game",
         "player": player,
-        "game_key": game["game_key"],
-        "version": game["latest_version"]
+        "game_key": game_key,
+        "version": version,
+        "stream": True
     }
 
-    res = send_request(req)
-    if not res or res.get("status") != "ok":
-        print("❌ 下載失敗：", (res or {}).get("message", "無回應"))
-        return
-
-    # 儲存 zip 到玩家本地 downloads/{player}/
-    b64_data = res.get("file_data")
-    filename = res.get("filename")
-    if not b64_data or not filename:
-        print("❌ 回傳內容缺少檔案資料")
-        return
+    # 本地已經有舊版本：只下載有變動的檔案，在本地組出新版本
+    older = [v for v in local_versions(player, game_key) if v != version]
+    if version not in local_versions(player, game_key) and older:
+        if download_delta(player, game_key, older[-1], version):
+            return
+        print("⚠ 差異更新失敗，改為下載完整檔案")
 
+    # 儲存 zip 到玩家本地 downloads/{player}/，先寫 .part，驗證 sha256 後再改名
     base_dir = os.path.join(BASE_DIR, "downloads", player)
     os.makedirs(base_dir, exist_ok=True)
-    zip_path = os.path.join(base_dir, filename)
-    with open(zip_path, "wb") as f:
-        f.write(base64.b64decode(b64_data))
+    zip_path = os.path.join(base_dir, f"{game_key}_{version}.zip")
+    part_path = zip_path + ".part"
+
+    for _ in range(DOWNLOAD_RETRIES):
+        # 上次沒下載完的 .part 從中斷處繼續
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        req["offset"] = offset
+        if offset:
+            print(f"↻ 從 {offset // 1024} KB 處繼續下載")
+        try:
+            header, received = download_range(req, part_path)
+        except OSError as e:
+            print(f"\n⚠ 連線中斷：{e}")
+            continue
+
+        if not header:
+            print("❌ 下載失敗：無回應")
+            return
+        if header.get("status") != "ok":
+            if header.get("message") == "invalid range" and offset:
+                # 本地 .part 比 server 上的檔案還大（版本被重新上傳），從頭下載
+                os.remove(part_path)
+                continue
+            print("❌ 下載失敗：", header.get("message", "無回應"))
+            return
+
+        if offset + received < header["size"]:
+            print(f"⚠ 下載中斷（{offset + received}/{header['size']} bytes）")
+            continue
+
+        if file_sha256(part_path) != header["sha256"]:
+            print("⚠ 檔案校驗失敗，重新下載")
+            os.remove(part_path)
+            continue
 
-    print("📣", res["message"])
+        os.replace(part_path, zip_path)
+        print("📣", header["message"])
+        return
+
+    print("❌ 下載未完成，已下載的部分會保留，下次下載時從中斷處繼續")
+
+
+def download_delta(player, game_key, from_version, version):
+    """
+    向 server 要 from_version -> version 的差異檔案，
+    在 downloads/{player}/{game_key}/{version}/ 組出新版本（沒變的檔案從本地舊版本複製）。
+    成功回傳 True；任何一步失敗回傳 False，由呼叫端改下載完整 zip
+    """
+    base_dir = ensure_game_unzipped_for_player(player, game_key, from_version)
+    if not base_dir:
+        return False
+
+    # 本地舊版本的內容依 sha256 建索引（順便確認本地檔案沒被改壞）
+    local = {}
+    for root, _, fnames in os.walk(base_dir):
+        for fname in fnames:
+            path = os.path.join(root, fname)
+            local.setdefault(file_sha256(path), path)
+
+    target_dir = os.path.join(BASE_DIR, "downloads", player, game_key, version)
+    tmp_dir = target_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    s, reader, header = send_stream_request({
+        "action": "download_delta",
+        "player": player,
+        "game_key": game_key,
+        "version": version,
+        "from_version": from_version
+    })
+    try:
+        if not header or header.get("status") != "ok":
+            print("⚠ 差異更新：", (header or {}).get("message", "無回應"))
+            return False
+
+        files = header["files"]
+        total = sum(item["size"] for item in header["delta"])
+        done = 0
+        print(f"⬇ 差異更新 {from_version} → {version}：{len(header['delta'])}/{len(files)} 個檔案需要下載")
+        for item in header["delta"]:
+            dst = safe_join(tmp_dir, item["path"])
+            if dst is None:
+                return False
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            remaining = item["size"]
+            with open(dst, "wb") as f:
+                while remaining:
+                    buf = reader.read(min(DOWNLOAD_CHUNK, remaining))
+                    if not buf:
+                        return False
+                    f.write(buf)
+                    remaining -= len(buf)
+                    done += len(buf)
+                    print_progress(done, total)
+        if header["delta"]:
+            print()
+    except OSError as e:
+        print(f"⚠ 差異更新連線中斷：{e}")
+        return False
+    finally:
+        reader.close()
+        s.close()
+
+    # 沒下載的檔案從舊版本複製，全部檔案都要對得上新版本的 sha256
+    for path, entry in files.items():
+        dst = safe_join(tmp_dir, path)
+        if dst is None:
+            return False
+        if not os.path.exists(dst):
+            src = local.get(entry["sha256"])
+            if src is None:
+                return False
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst)
+        elif file_sha256(dst) != entry["sha256"]:
+            return False
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(tmp_dir, target_dir)
+    print(f"📣 已更新到 {version}")
+    return True
+
+
+def safe_join(root, rel_path):
+    """
+    server 給的路徑只能落在 root 底下（擋掉 ../ 和絕對路徑）
+    """
+    dst = os.path.normpath(os.path.join(root, rel_path))
+    if os.path.isabs(rel_path) or not dst.startswith(os.path.normpath(root) + os.sep):
+        return None
+    return dst
+
+
+def download_range(req, part_path):
+    """
+    送出一次 stream 下載，把收到的 bytes 接在 part_path 後面。
+    回傳 (header, 這次收到的 bytes 數)
+    """
+    s, reader, header = send_stream_request(req)
+    received = 0
+    try:
+        if not header or header.get("status") != "ok":
+            return header, 0
+
+        size, offset, length = header["size"], header["offset"], header["length"]
+        with open(part_path, "ab") as f:
+            while received < length:
+                buf = reader.read(min(DOWNLOAD_CHUNK, length - received))
+                if not buf:
+                    break
+                f.write(buf)
+                received += len(buf)
+                print_progress(offset + received, size)
+        print()
+    finally:
+        reader.close()
+        s.close()
+    return header, received
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def print_progress(done, total):
+    percent = done * 100 // total if total else 100
+    print(f"\r⬇ {done // 1024} / {total // 1024} KB ({percent}%)", end="", flush=True)
 
 
 # ========= P3：launch game（示意用 launcher） =========
@@ -177,22 +650,26 @@ def ensure_game_unzipped_for_player(player, game_key, version):
     確保玩家端的 zip 已解壓縮：
     - zip 路徑: downloads/{player}/{game_key}_{version}.zip
     - unzip 到: downloads/{player}/{game_key}/{version}/
+    delta 更新組出來的版本只有資料夾、沒有 zip，資料夾在就直接用
     """
     base_dir = os.path.join(BASE_DIR, "downloads", player)
     os.makedirs(base_dir, exist_ok=True)
+    target_dir = os.path.join(base_dir, game_key, version)
+    if os.path.isdir(target_dir) and os.listdir(target_dir):
+        return target_dir
+
     zip_name = f"{game_key}_{version}.zip"
     zip_path = os.path.join(base_dir, zip_name)
-
     if not os.path.exists(zip_path):
         return None
 
-    target_dir = os.path.join(base_dir, game_key, version)
-    if os.path.exists(target_dir) and os.listdir(target_dir):
-        return target_dir
-
-    os.makedirs(target_dir, exist_ok=True)
+    # 先解到暫存資料夾再改名，解到一半中斷不會留下不完整的版本
+    tmp_dir = target_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
     with zipfile.ZipFile(zip_path, "r") as zf:
-        zf.extractall(target_dir)
+        zf.extractall(tmp_dir)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(tmp_dir, target_dir)
     return target_dir
 
 
@@ -200,17 +677,21 @@ def local_versions(player, game_key):
     base_dir = os.path.join(BASE_DIR, "downloads", player)
     if not os.path.exists(base_dir):
         return []
-    versions = []
+    versions = set()
     for fname in os.listdir(base_dir):
         if fname.startswith(f"{game_key}_") and fname.endswith(".zip"):
             v = fname[len(game_key) + 1 : -4]
-            versions.append(v)
-    return versions
+            versions.add(v)
+    game_dir = os.path.join(base_dir, game_key)
+    if os.path.isdir(game_dir):
+        for v in os.listdir(game_dir):
+            if not v.endswith(".tmp") and os.listdir(os.path.join(game_dir, v)):
+                versions.add(v)
+    return sorted(versions)
 
 
 def has_latest_version(player, game_key, version):
-    zip_path = os.path.join(BASE_DIR, "downloads", player, f"{game_key}_{version}.zip")
-    if os.path.exists(zip_path):
+    if version in local_versions(player, game_key):
         return True
     # 若有其他版本但不是最新版，提醒更新 
     if local_versions(player, game_key):
@@ -224,7 +705,7 @@ def launch_game_client(player, game_key, version, room_id, server_ip, server_por
     """
     啟動 game client：
     - 解壓縮 zip（若尚未解壓）
-    - 尋找 game_client.py
+    - 尋找 game_client.py（遊戲的 game.json 可以指定別的檔名）
     - 使用 subprocess.Popen 啟動，將 server_ip/server_port/room_id 當作參數
     """
     runtime_dir = ensure_game_unzipped_for_player(player, game_key, version)
@@ -232,9 +713,10 @@ def launch_game_client(player, game_key, version, room_id, server_ip, server_por
         print("⚠ 尚未下載此遊戲或 zip 檔案遺失，請先『下載遊戲』")
         return
 
-    client_script = os.path.join(runtime_dir, "game_client.py")
+    entry = local_entry(runtime_dir, "client")
+    client_script = os.path.join(runtime_dir, entry)
     if not os.path.exists(client_script):
-        print(f"⚠ 找不到 game_client.py（{runtime_dir}）")
+        print(f"⚠ 找不到 {entry}（{runtime_dir}）")
         return
 
     print(f"▶ 啟動 game client：房間 {room_id}, 遊戲 {game_key}, {version}")
@@ -252,44 +734,80 @@ def launch_game_client(player, game_key, version, room_id, server_ip, server_por
 
 
 # ========= 房間相關：列表 / 建立 / 加入 / 離開 / 刪除 =========
-def list_rooms(player, show=True):
-    res = send_request({"action": "list_rooms"})
-    if not res or res["status"] != "ok":
-        print("❌ 無法取得房間列表")
-        return []
+def room_matches(room, filters):
+    """
+    和 server 端 list_rooms 相同的篩選條件（訂閱中時對本地 view 篩選）
+    """
+    players = room.get("players", [])
+    if filters.get("game_key") is not None and room.get("game") != filters["game_key"]:
+        return False
+    if filters.get("started") is not None and bool(room.get("started")) != filters["started"]:
+        return False
+    if filters.get("player_in") is not None and filters["player_in"] not in players:
+        return False
+    cap = room.get("max_players")
+    if filters.get("free_slots") is not None and cap is not None and len(players) + filters["free_slots"] > cap:
+        return False
+    return True
+
+
+def room_pages(filters):
+    if events_ready():
+        # 訂閱中：本地 view 由 server push 維持，不用再問一次
+        rooms = [r for r in EVENTS.room_list() if room_matches(r, filters)]
+        for i in range(0, max(len(rooms), 1), LIST_PAGE):
+            yield rooms[i:i + LIST_PAGE]
+        return
+    for res in iter_pages(dict(filters, action="list_rooms")):
+        yield None if res is None else res["rooms"]
+
 
-    rooms = res["rooms"]
-    if show:
-        print("\n=== 房間列表 ===")
-        if not rooms:
-            print("（目前沒有房間）")
+def list_rooms(player, show=True, **filters):
+    """
+    filters：game_key / started / free_slots / player_in（server 端篩選）
+    show=True 時每頁 LIST_PAGE 筆印出，問要不要看下一頁；show=False 只回傳第一頁
+    """
+    seen = []
+    for i, rooms in enumerate(room_pages(filters)):
+        if rooms is None:
+            print("❌ 無法取得房間列表")
+            break
+        if not show:
+            return rooms
+        if i == 0:
+            print("\n=== 房間列表 ===")
+            if not rooms:
+                print("（目前沒有房間）")
+        elif not more_pages():
+            break
         for r in rooms:
             mark = "★" if player in r.get("players", []) else " "
-            print(f"{mark} Room {r['room_id']} - {r['game']} v{r['version']} | 玩家: {', '.join(r['players'])} | 建立者: {r.get('creator','')}")
-    return rooms
+            cap = f"/{r['max_players']}" if r.get("max_players") else ""
+            print(f"{mark} Room {r['room_id']} - {r['game']} v{r['version']} | 玩家{cap}: {', '.join(r['players'])} | 建立者: {r.get('creator','')}")
+        seen.extend(rooms)
+    return seen
 
 
 def current_room_on_server(player):
     """
-    向 server 查詢玩家所在房間（避免本地狀態與 server 不一致）
+    查詢玩家所在房間（避免本地狀態與 server 不一致）；訂閱中時看 server push 維持的 view
     """
-    rooms = list_rooms(player, show=False)
-    for r in rooms:
-        if player in r.get("players", []):
-            return r
-    return None
+    rooms = list_rooms(player, show=False, player_in=player)
+    return rooms[0] if rooms else None
 
 
 def list_online_players():
-    res = send_request({"action": "list_players"})
-    if not res or res.get("status") != "ok":
-        print("❌ 無法取得玩家列表")
-        return
-    players = res["players"]
-    print("\n=== 線上玩家 ===")
-    if not players:
-        print("（目前無人在線）")
-    else:
+    for i, res in enumerate(iter_pages({"action": "list_players"})):
+        if res is None:
+            print("❌ 無法取得玩家列表")
+            return
+        players = res["players"]
+        if i == 0:
+            print("\n=== 線上玩家 ===")
+            if not players:
+                print("（目前無人在線）")
+        elif not more_pages():
+            return
         for p in players:
             print("-", p)
 
@@ -322,6 +840,14 @@ def create_room(player, current_room_id):
         print("❌ 建立房間前請先下載/更新遊戲")
         return None
 
+    cap = input("人數上限（Enter 不限）: ").strip()
+    if cap:
+        try:
+            req["max_players"] = int(cap)
+        except ValueError:
+            print("❌ 無效輸入")
+            return None
+
     res = send_request(req)
     if not res or res["status"] != "ok":
         print("❌ 建立房間失敗：", (res or {}).get("message",""))
@@ -329,6 +855,8 @@ def create_room(player, current_room_id):
 
     room = res["room"]
     room_id = room["room_id"]
+    if EVENTS:
+        EVENTS.note_room(room)
 
     print(f"📣 房間建立成功：Room {room_id}, 遊戲 {room['game']} ({room['version']})")
     print("   房主可按『開始遊戲』啟動 game server，所有玩家再按『啟動遊戲 client』進入。")
@@ -342,7 +870,8 @@ def join_room(player, current_room_id):
         print("⚠ 你已在房間內，請先離開再加入其他房間")
         return server_room["room_id"], server_room
 
-    rooms = list_rooms(player)
+    # 只列出還沒開始、有空位的房間
+    rooms = list_rooms(player, started=False, free_slots=1)
     if not rooms:
         return None
 
@@ -362,6 +891,8 @@ def join_room(player, current_room_id):
         return None
 
     room = res["room"]
+    if EVENTS:
+        EVENTS.note_room(room)
 
     if not has_latest_version(player, room["game"], room["version"]):
         print("❌ 請先下載/更新該遊戲最新版本，再啟動 client")
@@ -381,6 +912,8 @@ def leave_room(player):
         print("❌ 離開房間失敗：", (res or {}).get("message",""))
         return False
 
+    if EVENTS:
+        EVENTS.note_left(player)
     print("✅ 已離開房間")
     return True
 
@@ -409,6 +942,8 @@ def delete_room(player, current_room_id):
         print("❌ 刪除失敗：", (res or {}).get("message",""))
         return False
 
+    if EVENTS:
+        EVENTS.note_deleted(target_id)
     print("✅ 已刪除房間")
     return True
 
@@ -432,6 +967,8 @@ def start_room(player, current_room_id):
         return False
 
     room = res["room"]
+    if EVENTS:
+        EVENTS.note_room(room)
     print(f"✅ 遊戲已啟動，房間 {room['room_id']} 伺服器埠 {room['server_port']}")
     # 房主按開始後直接啟動自己的 client
     launch_game_client(player, room["game"], room["version"], room["room_id"],
@@ -477,7 +1014,8 @@ def room_menu(player, current_room_id):
         choice = input("選擇操作: ")
 
         if choice == "1":
-            list_rooms(player)
+            game_key = input("只看某款遊戲（輸入 game_key，Enter 全部）: ").strip()
+            list_rooms(player, game_key=game_key or None)
         elif choice == "2":
             result = create_room(player, current_room_id)
             if result is not None:
@@ -538,6 +1076,10 @@ def rate_game(player):
     print("簡介:", detail["description"])
     if detail["avg_score"] is not None:
         print(f"平均評分: ★ {detail['avg_score']:.2f} ({detail['rating_count']} 則)")
+        histogram = detail.get("score_histogram")
+        if histogram:
+            for star in range(5, 0, -1):
+                print(f"  {star}★ {histogram[star - 1]}")
     else:
         print("尚無評分")
 
@@ -660,6 +1202,44 @@ def remove_plugin(player):
 
 
 # ========= Plugin：房間聊天（PL3 / PL4） =========
+def refresh_chat(player, room_id, log):
+    """
+    更新本地聊天紀錄 log = {"messages", "cursor", "generation"}
+    - 訂閱中且訂閱連線沒有重連過：只合併 server 推過來的訊息，不送 request
+    - 否則送 room_chat_fetch（since=cursor），只拿 cursor 之後的訊息
+    推送和 fetch 可能重疊，依 seq 去重。回傳 False 表示取得失敗
+    """
+    pushed = EVENTS.take_chat(room_id) if events_ready() else []
+    generation = EVENTS.generation if events_ready() else None
+    if generation is None or generation != log["generation"]:
+        res = send_request({
+            "action": "room_chat_fetch",
+            "room_id": room_id,
+            "player": player,
+            "since": log["cursor"]
+        })
+        if not res or res["status"] != "ok":
+            print("❌ 無法取得訊息：", (res or {}).get("message", ""))
+            return False
+        if res.get("reset") or "last_seq" not in res:
+            # 聊天室被清過（或是舊版 server 每次都回傳全部）
+            log["messages"], log["cursor"] = [], 0
+        if res.get("truncated"):
+            print("（較早的訊息已封存）")
+        pushed = res["messages"] + pushed
+        log["generation"] = generation
+
+    for m in sorted(pushed, key=lambda m: m.get("seq", 0)):
+        seq = m.get("seq")
+        if seq is None:
+            log["messages"].append(m)
+        elif seq > log["cursor"]:
+            log["messages"].append(m)
+            log["cursor"] = seq
+    del log["messages"][:-CHAT_HISTORY_LIMIT]
+    return True
+
+
 def room_chat_ui(player, current_room_id):
     """
     這個 UI 只會在玩家：
@@ -678,8 +1258,11 @@ def room_chat_ui(player, current_room_id):
         print("⚠ 你沒有安裝 room_chat Plugin")
         return
 
+    # 本地聊天紀錄；seq 是 server 在每個房間內遞增的編號，cursor = 看過的最大 seq
+    log = {"messages": [], "cursor": 0, "generation": None}
+
     while True:
-        # 確認仍在房間，避免房間被清除後還留著舊 ID
+        # 確認仍在房間，避免房間被清除後還留著舊 ID（訂閱中只看本地 view）
         server_room = current_room_on_server(player)
         if not server_room or server_room["room_id"] != current_room_id:
             print("⚠ 你目前不在任何房間或房間已被移除")
@@ -692,20 +1275,13 @@ def room_chat_ui(player, current_room_id):
         c = input("選擇操作: ")
 
         if c == "1":
-            res = send_request({
-                "action": "room_chat_fetch",
-                "room_id": current_room_id,
-                "player": player
-            })
-            if res and res["status"] == "ok":
-                msgs = res["messages"]
+            if refresh_chat(player, current_room_id, log):
+                msgs = log["messages"]
                 if not msgs:
                     print("（沒有訊息）")
                 else:
                     for m in msgs:
                         print(f"{m['player']}: {m['message']}")
-            else:
-                print("❌ 無法取得訊息：", (res or {}).get("message", ""))
 
         elif c == "2":
             msg = input("輸入訊息：")
@@ -758,6 +1334,7 @@ def main_menu(player):
             room_chat_ui(player, current_room_id)
         elif c == "8":
             send_request({"action":"player_logout","name":player})
+            end_session()
             break
         else:
             print("❌ 無效輸入")
@@ -789,6 +1366,7 @@ def login_flow():
             print("❌", (res or {}).get("message", "登入/註冊失敗"))
             # back to menu without退出
             continue
+        start_session(player, pwd, res.get("token"))
         return player
 
 
@@ -806,13 +1384,19 @@ if __name__ == "__main__":
     hb_thread = threading.Thread(target=heartbeat_loop, args=(player, stop_hb), daemon=True)
     hb_thread.start()
 
+    EVENTS = LobbyEvents(player)
+    EVENTS.start()
+
     try:
         main_menu(player)
     finally:
         stop_hb.set()
         hb_thread.join(timeout=1)
+        EVENTS.stop()
         # 確保離線通知送出（包含 Ctrl+C）
         try:
-            send_request({"action":"player_logout","name":player})
+            if SESSION["token"]:
+                send_request({"action":"player_logout","name":player})
         except:
             pass
+        close_connection()
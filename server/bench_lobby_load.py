@@ -0,0 +1,218 @@
+"""
+Lobby 連線負載 benchmark：比較 thread 核心和 asyncio 核心（LOBBY_CORE）
+
+每一輪各起一個 lobby_server.py（暫存的 GAME_STORE_DB / GAME_BLOB_DIR，不動到正式資料），然後：
+- 開 --idle 條只連線不送 request 的 framed 連線（模擬大量掛著不動的 client）
+- --active 個 client 同時 register（= 登入），再各自在自己的 persistent 連線上
+  不停送 player_heartbeat / list_rooms，持續 --seconds 秒
+最後印出 throughput、p50 / p99 latency、server 的 OS thread 數和 RSS。
+
+用法：
+    python3 server/bench_lobby_load.py
+    python3 server/bench_lobby_load.py --idle 5000 --active 200 --seconds 10 --cores thread async
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+HEADER_SIZE = 4
+
+
+def raise_fd_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"lobby did not start on port {port}")
+
+
+def proc_status(pid):
+    """
+    /proc/{pid}/status 裡的 Threads 和 VmRSS（KB）
+    """
+    threads = rss = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+                elif line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+    except OSError:
+        pass
+    return threads, rss
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# ========= client（asyncio，一個 process 撐得住上千條連線） =========
+async def request(reader, writer, obj):
+    payload = json.dumps(obj).encode()
+    writer.write(len(payload).to_bytes(HEADER_SIZE, "big") + payload)
+    await writer.drain()
+    length = int.from_bytes(await reader.readexactly(HEADER_SIZE), "big")
+    return json.loads((await reader.readexactly(length)).decode())
+
+
+async def open_idle(port, n):
+    conns = []
+    for _ in range(n):
+        try:
+            conns.append(await asyncio.open_connection("127.0.0.1", port))
+        except OSError as e:
+            print(f"  idle connection {len(conns)} failed: {e!r}")
+            break
+    return conns
+
+
+async def active_client(port, idx, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    name = f"bench_{idx}"
+    try:
+        t0 = time.perf_counter()
+        resp = await request(reader, writer, {"action": "player_register", "name": name, "password": "x"})
+        latencies["login"].append(time.perf_counter() - t0)
+        if resp.get("status") != "ok":
+            errors.append(resp)
+        token = resp.get("token")
+        i = 0
+        while time.time() < deadline:
+            if i % 2 == 0:
+                req, kind = {"action": "player_heartbeat", "name": name, "token": token}, "heartbeat"
+            else:
+                req, kind = {"action": "list_rooms"}, "list_rooms"
+            t0 = time.perf_counter()
+            resp = await request(reader, writer, req)
+            latencies[kind].append(time.perf_counter() - t0)
+            if resp.get("status") != "ok":
+                errors.append(resp)
+            i += 1
+    except (OSError, asyncio.IncompleteReadError) as e:
+        errors.append(repr(e))
+    finally:
+        writer.close()
+
+
+async def drive(port, args, pid):
+    idle = await open_idle(port, args.idle)
+    # 讓 server 把 idle 連線都 accept 完再開始量
+    await asyncio.sleep(1.0)
+    threads_idle, rss_idle = proc_status(pid)
+
+    latencies = {"login": [], "heartbeat": [], "list_rooms": []}
+    errors = []
+    start = time.time()
+    deadline = start + args.seconds
+    await asyncio.gather(*(active_client(port, i, deadline, latencies, errors) for i in range(args.active)))
+    elapsed = time.time() - start
+    threads_peak, rss_peak = proc_status(pid)
+
+    for _, writer in idle:
+        writer.close()
+    return {
+        "idle_open": len(idle),
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "errors": errors,
+        "threads_idle": threads_idle,
+        "threads_peak": threads_peak,
+        "rss_idle": rss_idle,
+        "rss_peak": rss_peak,
+    }
+
+
+# ========= 每個核心跑一輪 =========
+def run_core(core, args):
+    tmp = tempfile.mkdtemp(prefix=f"bench_lobby_{core}_")
+    port = free_port()
+    env = dict(os.environ,
+               LOBBY_CORE=core,
+               LOBBY_PORT=str(port),
+               LOBBY_RATE_LIMIT="0",   # 量的是 server 本身，不要被限流擋下
+               GAME_STORE_BACKEND="sqlite",
+               GAME_STORE_DB=os.path.join(tmp, "game_store.sqlite3"),
+               GAME_BLOB_DIR=os.path.join(tmp, "blobs"))
+    log = open(os.path.join(tmp, "lobby.log"), "w")
+    proc = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, "lobby_server.py")],
+                            env=env, stdout=log, stderr=subprocess.STDOUT,
+                            preexec_fn=lambda: raise_fd_limit(args.idle + args.active + 1024))
+    try:
+        wait_port(port)
+        result = asyncio.run(drive(port, args, proc.pid))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result
+
+
+def report(core, r):
+    lat = r["latencies"]
+    ops = len(lat["heartbeat"]) + len(lat["list_rooms"])
+    print(f"[{core}] idle={r['idle_open']} "
+          f"threads idle/peak={r['threads_idle']}/{r['threads_peak']} "
+          f"RSS idle/peak={(r['rss_idle'] or 0) // 1024}/{(r['rss_peak'] or 0) // 1024} MB")
+    print(f"  throughput: {ops / r['elapsed']:.0f} req/s ({ops} requests in {r['elapsed']:.1f}s)")
+    for kind in ("login", "heartbeat", "list_rooms"):
+        values = lat[kind]
+        print(f"  {kind:10s} n={len(values):6d} "
+              f"p50={percentile(values, 50) * 1000:7.2f} ms  p99={percentile(values, 99) * 1000:7.2f} ms")
+    if r["errors"]:
+        print(f"  errors: {len(r['errors'])} (first: {r['errors'][0]})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--idle", type=int, default=1000)
+    parser.add_argument("--active", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--cores", nargs="+", default=["thread", "async"], choices=["thread", "async"])
+    args = parser.parse_args()
+
+    limit = raise_fd_limit(args.idle + args.active + 1024)
+    if limit < args.idle + args.active + 64:
+        print(f"fd limit {limit} too low, reducing --idle")
+        args.idle = max(0, limit - args.active - 64)
+
+    for core in args.cores:
+        report(core, run_core(core, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Lobby 常駐狀態 benchmark：量 player_heartbeat / list_rooms 的 p50 / p99 latency
+
+- legacy：模擬原本每個 request 都 load_json + 整份 save_json 的做法
+- sqlite：目前 lobby_server 預設的 handler（LobbyState + SQLiteStorage，修改直接寫進 SQLite）
+- json  ：GAME_STORE_BACKEND=json 時的 handler（LobbyState，修改寫進 WAL）
+presence_write 是心跳 / 登入的在線狀態批次寫回（PresenceBatcher -> STATE.set_presence），
+兩個 backend 的差別主要在這裡；心跳和 list_rooms 本身都只碰記憶體
+
+用法：
+    python3 server/bench_lobby_state.py
+    python3 server/bench_lobby_state.py --players 100 1000 5000 --requests 500 --backend sqlite
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LOBBY_RATE_LIMIT", "0")   # 量的是 handler 本身
+
+import lobby_server                      # noqa: E402
+from lobby_state import LobbyState, load_json  # noqa: E402
+from common.migrate_json_to_sqlite import load_legacy_lobby  # noqa: E402
+from common.storage import SQLiteStorage  # noqa: E402
+
+
+class NullConn:
+    """假的 socket，只吃掉回覆"""
+
+    def sendall(self, data):
+        pass
+
+
+def seed_files(tmp, n_players):
+    now = time.time()
+    players = {f"p{i}": {"password": "x", "online": True, "last_seen": now} for i in range(n_players)}
+    rooms = []
+    names = list(players)
+    for rid in range(1, n_players // 4 + 1):
+        rooms.append({
+            "room_id": rid,
+            "game": "dev_game",
+            "version": "1.0",
+            "creator": names[(rid - 1) * 4],
+            "players": names[(rid - 1) * 4:(rid - 1) * 4 + 2],
+            "server_port": 7000 + rid,
+            "started": False,
+        })
+    paths = {
+        "players": os.path.join(tmp, "players.json"),
+        "rooms": os.path.join(tmp, "rooms.json"),
+        "chats": os.path.join(tmp, "room_chats.json"),
+        "play_history": os.path.join(tmp, "play_history.json"),
+    }
+    with open(paths["players"], "w") as f:
+        json.dump({"players": players}, f, indent=4)
+    with open(paths["rooms"], "w") as f:
+        json.dump({"rooms": rooms}, f, indent=4)
+    return paths, names
+
+
+# ========= 原本的做法（每個 request 讀寫整份檔案） =========
+def legacy_heartbeat(paths, name, conn):
+    players = load_json(paths["players"], {"players": {}})
+    info = players["players"].get(name)
+    if info and info.get("online"):
+        info["last_seen"] = time.time()
+        with open(paths["players"], "w") as f:
+            json.dump(players, f, indent=4)
+        conn.sendall(json.dumps({"status": "ok"}).encode())
+
+
+def legacy_list_rooms(paths, conn):
+    rooms = load_json(paths["rooms"], {"rooms": []})
+    conn.sendall(json.dumps({"status": "ok", "rooms": rooms["rooms"]}).encode())
+
+
+# ========= 目前的做法 =========
+def open_state(tmp, paths, backend):
+    """
+    和 lobby_server.init_state 一樣建 LobbyState；sqlite 時先把 seed 的 JSON 匯入 DB
+    """
+    storage = None
+    if backend == "sqlite":
+        storage = SQLiteStorage(os.path.join(tmp, "store.sqlite3"))
+        storage.import_all({}, load_legacy_lobby(tmp))
+    state = LobbyState(paths, wal_dir=os.path.join(tmp, "wal"), storage=storage)
+    state.load()
+    return state, storage
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return p50 * 1000, p99 * 1000
+
+
+def measure(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return percentiles(samples)
+
+
+def run(player_counts, n_requests, backends):
+    conn = NullConn()
+    print(f"{'players':>8} {'impl':>7} {'action':>17} {'p50 ms':>9} {'p99 ms':>9}")
+    for n in player_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths, names = seed_files(tmp, n)
+
+            rows = [
+                ("legacy", "player_heartbeat",
+                 lambda: legacy_heartbeat(paths, random.choice(names), conn)),
+                ("legacy", "list_rooms",
+                 lambda: legacy_list_rooms(paths, conn)),
+            ]
+
+            for impl, action, fn in rows:
+                p50, p99 = measure(fn, n_requests)
+                print(f"{n:>8} {impl:>7} {action:>17} {p50:>9.3f} {p99:>9.3f}")
+
+            # 新版心跳走 dispatch：token 驗證（記憶體）+ handler
+            tokens = [lobby_server.SESSIONS.create(name) for name in names]
+            for backend in backends:
+                state, storage = open_state(tmp, paths, backend)
+                lobby_server.STATE = state
+                rows = [
+                    ("player_heartbeat",
+                     lambda: lobby_server.dispatch({"action": "player_heartbeat", "token": random.choice(tokens)}, conn)),
+                    ("list_rooms",
+                     lambda: lobby_server.handle_list_rooms({}, conn)),
+                    ("presence_write",
+                     lambda: state.set_presence({random.choice(names): (True, time.time())})),
+                ]
+                for action, fn in rows:
+                    p50, p99 = measure(fn, n_requests)
+                    print(f"{n:>8} {backend:>7} {action:>17} {p50:>9.3f} {p99:>9.3f}")
+                state.close()
+                if storage is not None:
+                    storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, nargs="+", default=[10, 100, 500, 1000, 5000])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--backend", nargs="+", choices=["sqlite", "json"], default=["sqlite", "json"],
+                        help="要量的儲存 backend（預設兩個都量；sqlite 是 lobby 的預設）")
+    args = parser.parse_args()
+    run(args.players, args.requests, args.backend)
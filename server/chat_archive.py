@@ -0,0 +1,61 @@
+"""
+房間聊天的 append-only 封存
+
+LobbyState 每個房間只在記憶體留最近 LOBBY_CHAT_BUFFER 則訊息（ring buffer），
+被擠出去的舊訊息依房號 append 到 {archive_dir}/{room_key}.jsonl（一行一則，含 seq），
+snapshot / SQLite 裡的聊天紀錄因此有上限，完整紀錄仍可以從封存檔找回。
+
+- 先寫封存再寫 trim record：中途 crash 最多讓同一則訊息在封存檔出現兩次（讀的時候依 seq 去重）
+- 房間刪除 / 遊戲結束清掉聊天室時，封存檔改名成 {room_key}.{timestamp}.jsonl，
+  房號之後被重複使用也不會和新的聊天室混在一起
+"""
+import json
+import os
+import threading
+import time
+
+
+class ChatArchive:
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.lock = threading.Lock()
+
+    def _path(self, room_key):
+        return os.path.join(self.archive_dir, f"{room_key}.jsonl")
+
+    def append(self, room_key, msgs):
+        if not msgs:
+            return
+        data = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in msgs)
+        with self.lock:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(self._path(room_key), "a", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+
+    def read(self, room_key):
+        """
+        回傳封存的訊息（依 seq 排序、去重）；讀到寫一半的最後一行就停
+        """
+        path = self._path(room_key)
+        if not os.path.exists(path):
+            return []
+        msgs = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    break
+                msgs[msg.get("seq")] = msg
+        return [msgs[s] for s in sorted(msgs, key=lambda s: s or 0)]
+
+    def rotate(self, room_key):
+        path = self._path(room_key)
+        with self.lock:
+            if not os.path.exists(path):
+                return
+            stamp = int(time.time())
+            while os.path.exists(os.path.join(self.archive_dir, f"{room_key}.{stamp}.jsonl")):
+                stamp += 1
+            os.replace(path, os.path.join(self.archive_dir, f"{room_key}.{stamp}.jsonl"))
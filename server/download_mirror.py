@@ -0,0 +1,211 @@
+"""
+Server 端的玩家下載資料夾（mirror）
+
+原本每次下載都 shutil.copy 一份 zip 到 player_client/downloads/{player}/，
+client 自己也會存一份，server 端等於每位玩家 x 每個版本都多一份檔案。
+現在預設只送 canonical 檔案（uploaded_games/ 裡那份），真的需要 server 端 mirror 時
+用 LOBBY_DOWNLOAD_MIRROR 設定：
+
+- none（預設）：不建立 mirror
+- link：hardlink（不佔額外空間），跨 filesystem 時退回複製
+- reflink：copy-on-write clone（btrfs / xfs 等支援 FICLONE 的 filesystem），不支援時退回複製
+- copy：完整複製（舊行為）
+
+mirror 放在 server 自己的 server/mirror/{player}/（LOBBY_MIRROR_DIR），不和 client 的
+player_client/downloads/ 共用：client 的舊版本 zip 是 delta 下載的 base，不能被 server 刪掉或換掉。
+
+mirror 出去的檔案記在 server/download_mirror.json（路徑 + 建立時的 inode）；garbage collector 只刪
+這份紀錄裡、而且還是當初建立的那個檔案（inode 沒變），其他檔案一律不碰：
+遊戲已下架 / 刪除、不是最新版本、或超過 LOBBY_MIRROR_MAX_AGE_DAYS 天的都算 stale。
+每次下載只在 server/download_mirror.journal append 一行（和 lobby 的 WAL 一樣，寫入成本 O(1)），
+讀紀錄時 snapshot + replay journal；GC 時把結果寫回 snapshot 並清空 journal。
+
+手動執行：
+    python3 server/download_mirror.py            # 跑一次 GC
+    python3 server/download_mirror.py --dry-run  # 只列出會刪的檔案
+"""
+import argparse
+import errno
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from common.blobstore import replace_with_link  # noqa: E402
+from lobby_state import atomic_write, load_json  # noqa: E402
+
+MIRROR_POLICY   = os.environ.get("LOBBY_DOWNLOAD_MIRROR", "none")
+MIRROR_DIR      = os.environ.get("LOBBY_MIRROR_DIR", os.path.join(BASE_DIR, "mirror"))
+MIRROR_MAX_AGE  = float(os.environ.get("LOBBY_MIRROR_MAX_AGE_DAYS", "7")) * 86400
+LEDGER_FILE     = os.path.join(BASE_DIR, "download_mirror.json")
+JOURNAL_FILE    = os.path.join(BASE_DIR, "download_mirror.journal")
+GC_INTERVAL     = 3600   # seconds
+
+FICLONE = 0x40049409     # linux/fs.h：ioctl(dst_fd, FICLONE, src_fd)
+
+_lock = threading.Lock()
+
+
+# ========= mirror 紀錄（snapshot + journal） =========
+def load_ledger():
+    """
+    snapshot 再 replay journal；呼叫端持有 _lock
+    """
+    ledger = load_json(LEDGER_FILE, {"players": {}})
+    try:
+        with open(JOURNAL_FILE, "r") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # 寫到一半的最後一行（crash）
+                    break
+                ledger["players"].setdefault(rec.pop("player"), {})[rec.pop("file")] = rec
+    except FileNotFoundError:
+        pass
+    return ledger
+
+
+def compact_ledger(ledger):
+    """
+    整份紀錄寫回 snapshot 後清空 journal；呼叫端持有 _lock。
+    兩步之間 crash 時 journal 會再 replay 一次，只會讓 GC 多檢查幾個已經刪掉的檔案
+    """
+    atomic_write(LEDGER_FILE, json.dumps(ledger, indent=4))
+    with open(JOURNAL_FILE, "w"):
+        pass
+
+
+# ========= 建立 mirror =========
+def reflink_or_copy(src, dst):
+    try:
+        import fcntl
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except (ImportError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY,
+                                                      errno.EINVAL, errno.ENOSYS):
+            raise
+        shutil.copyfile(src, dst)
+
+
+def mirror_download(player, game_key, version, src_path, policy=None):
+    """
+    依 policy 在 MIRROR_DIR/{player}/ 放一份下載檔；policy 為 none 時什麼都不做
+    """
+    policy = policy or MIRROR_POLICY
+    if policy == "none":
+        return None
+
+    dst_dir = os.path.join(MIRROR_DIR, player)
+    os.makedirs(dst_dir, exist_ok=True)
+    filename = os.path.basename(src_path)
+    dst = os.path.join(dst_dir, filename)
+    tmp = f"{dst}.mirror.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if os.path.exists(dst) and os.path.samefile(src_path, dst):
+        pass    # 已經是同一個 inode 的 hardlink
+    elif policy == "link":
+        replace_with_link(src_path, dst)
+    else:
+        if policy == "reflink":
+            reflink_or_copy(src_path, tmp)
+        else:
+            shutil.copyfile(src_path, tmp)
+        os.replace(tmp, dst)
+
+    st = os.stat(dst)
+    record = json.dumps({"player": player, "file": filename, "game_key": game_key, "version": version,
+                         "created_at": time.time(), "path": dst, "dev": st.st_dev, "ino": st.st_ino},
+                        separators=(",", ":"))
+    with _lock:
+        with open(JOURNAL_FILE, "a") as f:
+            f.write(record + "\n")
+    return dst
+
+
+# ========= garbage collector =========
+def _stale_reason(entry, games, now):
+    game = games.get(entry["game_key"])
+    if game is None or not game["active"]:
+        return "game removed"
+    if entry["version"] != game["latest_version"]:
+        return "outdated version"
+    if now - entry["created_at"] > MIRROR_MAX_AGE:
+        return "expired"
+    return None
+
+
+def _created_by_mirror(entry):
+    """
+    紀錄裡的檔案還是 mirror 當初建立的那個（同一個 inode）；舊紀錄沒有路徑 / inode，無法確認就不算
+    """
+    path = entry.get("path")
+    if not path or "ino" not in entry:
+        return False
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (st.st_dev, st.st_ino) == (entry["dev"], entry["ino"])
+
+
+def collect_garbage(storage, dry_run=False):
+    """
+    刪掉 stale 的 mirror 檔案，回傳 [(path, reason), ...]。
+    只刪紀錄裡、inode 沒變的檔案；已經不見或被換掉（不是 mirror 建立的）的只把紀錄拿掉
+    """
+    games = {g["game_key"]: g for g in storage.list_game_summaries()}
+    now = time.time()
+    removed = []
+
+    with _lock:
+        ledger = load_ledger()
+        for player, files in ledger["players"].items():
+            for filename, entry in list(files.items()):
+                reason = _stale_reason(entry, games, now)
+                if reason is None:
+                    continue
+                if _created_by_mirror(entry):
+                    removed.append((entry["path"], reason))
+                    if not dry_run:
+                        os.remove(entry["path"])
+                if not dry_run:
+                    del files[filename]
+        if not dry_run:
+            ledger["players"] = {p: f for p, f in ledger["players"].items() if f}
+            compact_ledger(ledger)
+    return removed
+
+
+def start_gc_loop(storage):
+    def loop():
+        while True:
+            time.sleep(GC_INTERVAL)
+            try:
+                for path, reason in collect_garbage(storage):
+                    print(f"[Lobby] mirror GC removed {path} ({reason})")
+            except OSError as e:
+                print(f"[Lobby] mirror GC failed: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
+
+
+if __name__ == "__main__":
+    from common.storage import open_storage
+
+    parser = argparse.ArgumentParser(description="清掉 server 端 stale 的玩家下載拷貝")
+    parser.add_argument("--dry-run", action="store_true", help="只列出，不刪除")
+    args = parser.parse_args()
+
+    removed = collect_garbage(open_storage(), dry_run=args.dry_run)
+    for path, reason in removed:
+        print(f"{'would remove' if args.dry_run else 'removed'} {path} ({reason})")
+    print(f"{len(removed)} file(s)")
@@ -0,0 +1,146 @@
+"""
+Lobby Server 的 asyncio 核心（LOBBY_CORE=async python3 server/lobby_server.py）
+
+thread 核心每條連線一個 OS thread，大量閒置的 persistent 連線 / 同時登入時 thread 會一直堆上去。
+這裡改成：
+- 所有連線都在同一個 event loop 上讀寫，閒置連線只佔一個 coroutine + socket
+- 每個 request 交給固定大小的 thread pool（LOBBY_WORKERS）跑原本的 handler，
+  檔案 I/O、SQLite、啟動 game server 的 subprocess 都不會卡住 event loop
+- handler 仍然呼叫 conn.sendall / send_header / sendfile（lobby_protocol.py 的介面），
+  實際寫入交回 event loop 做，sendfile 走 loop.sendfile（zero-copy）
+- 協定和 thread 核心完全相同：第一個 byte 是 '{' 為舊版 client，其餘為 4-byte framed
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from common.framing import HEADER_SIZE, MAX_FRAME, encode_frame
+from lobby_protocol import FramedConn, LegacyConn, LegacyDecoder, safe_dispatch, LEGACY_RECV_SIZE
+
+WORKERS = int(os.environ.get("LOBBY_WORKERS", "32"))
+
+
+class LoopSocket:
+    """
+    給 worker thread 用的「socket」：寫入都交給 event loop 做
+    - sendall：用 call_soon_threadsafe 排進 loop 就返回（FIFO，順序不會亂），
+      handler 結束後 loop 端再 drain，送得慢的 client 只會卡住自己的下一個 request
+    - sendfile：要等前面的資料寫完才能開始，所以排進 loop 並等它結束
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    async def _sendfile(self, f, offset, count):
+        await self.writer.drain()
+        await self.loop.sendfile(self.writer.transport, f, offset, count)
+
+    def sendall(self, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError("client connection closed")
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def sendfile(self, f, offset=0, count=None):
+        asyncio.run_coroutine_threadsafe(self._sendfile(f, offset, count), self.loop).result()
+
+    def shutdown(self, how=None):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def buffered(self):
+        # 還沒寫出去的 bytes；server push 用來判斷訂閱者是不是跟不上
+        return self.writer.transport.get_write_buffer_size()
+
+
+class AsyncLobby:
+    def __init__(self, dispatch, workers=WORKERS):
+        self.dispatch = dispatch
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lobby-worker")
+        self.connections = 0
+
+    async def _run_handler(self, req, conn, addr):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, safe_dispatch, self.dispatch, req, conn, addr)
+        await conn.sock.writer.drain()
+
+    async def _serve_legacy(self, reader, first, conn, addr):
+        decoder = LegacyDecoder()
+        raw = first
+        while raw:
+            for req in decoder.feed(raw):
+                await self._run_handler(req, conn, addr)
+            raw = await reader.read(LEGACY_RECV_SIZE)
+
+    async def _serve_framed(self, reader, writer, first, conn, addr):
+        header = first + await reader.readexactly(HEADER_SIZE - len(first))
+        while True:
+            length = int.from_bytes(header, "big")
+            if length > MAX_FRAME:
+                print(f"[Lobby] {addr} frame too large: {length} bytes")
+                return
+            payload = await reader.readexactly(length)
+            try:
+                req = json.loads(payload.decode())
+            except ValueError:
+                # 在 event loop 上，不能走 conn.sendall（它會等 event loop 自己）
+                writer.write(encode_frame(json.dumps({"status": "error", "message": "invalid json"}).encode()))
+                await writer.drain()
+                req = None
+            if isinstance(req, dict):
+                await self._run_handler(req, conn, addr)
+            header = await reader.read(HEADER_SIZE)
+            if not header:
+                return
+            if len(header) < HEADER_SIZE:
+                header += await reader.readexactly(HEADER_SIZE - len(header))
+
+    async def handle_connection(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        print(f"[Lobby] Connected by {addr}")
+        self.connections += 1
+        sock = LoopSocket(asyncio.get_running_loop(), writer)
+        conn = None
+        try:
+            first = await reader.read(1)
+            if not first:
+                return
+            if first == b"{":
+                conn = LegacyConn(sock, addr)
+                await self._serve_legacy(reader, first, conn, addr)
+            else:
+                conn = FramedConn(sock, addr)
+                await self._serve_framed(reader, writer, first, conn, addr)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"[Lobby] connection {addr} dropped: {e!r}")
+        finally:
+            self.connections -= 1
+            if conn is not None:
+                conn.run_close_callbacks()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, server_sock):
+        server = await asyncio.start_server(self.handle_connection, sock=server_sock)
+        async with server:
+            await server.serve_forever()
+
+
+def start_lobby_async(lobby_server):
+    """
+    lobby_server 由 lobby_server.py 的 __main__ 傳進來（直接 import 會再載入一份 module、兩份狀態）
+    """
+    server_sock, chosen_port = lobby_server.bind_lobby_socket()
+    lobby_server.start_services()
+
+    print(f"[Lobby Server] Running on port {chosen_port} (asyncio, {WORKERS} workers)...")
+
+    lobby = AsyncLobby(lobby_server.dispatch)
+    try:
+        asyncio.run(lobby.serve(server_sock))
+    finally:
+        lobby.executor.shutdown(wait=False)
+        lobby_server.shutdown_services()
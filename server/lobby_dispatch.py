@@ -0,0 +1,185 @@
+"""
+Lobby 的 action 表和 middleware
+
+原本 dispatch 是一長串 if/elif，每個 handler 開頭自己呼叫 require_player_online。
+這裡改成：
+- 每個 action 註冊時帶 metadata：
+    auth      ：需要已登入（req["token"] 必須是有效的 session）
+    mutating  ：會不會改狀態（只是標記；沒指定 rate 時決定預設的 rate class）
+    rate      ：rate class（見 RATE_CLASSES）
+    user_field：哪個欄位是玩家名稱（大部分是 "player"，登入相關是 "name"）
+- dispatch 依序經過 middleware（timing -> auth -> rate limit）才呼叫 handler，
+  auth 只查記憶體裡的 session table（common/sessions.py），一個 request 檢查一次，
+  並把 req[user_field] 改成 token 對應的玩家（不相信 client 自己填的名字）
+
+middleware 的形式：mw(action, req, conn, call_next)，不處理就 return call_next()
+"""
+import json
+import os
+import threading
+import time
+
+# rate class -> (每秒補幾個 token, bucket 容量)；LOBBY_RATE_LIMIT=0 關閉限流
+RATE_CLASSES = {
+    "auth":  (2.0, 10),      # 註冊 / 登入，擋暴力嘗試
+    "read":  (100.0, 200),   # 列表、心跳、聊天紀錄
+    "write": (20.0, 40),     # 建房、加入、聊天、評分
+    "heavy": (5.0, 30),      # 下載（續傳 / delta 會連續送好幾個）、啟動 game server
+}
+RATE_LIMIT_ENABLED = os.environ.get("LOBBY_RATE_LIMIT", "1") != "0"
+SLOW_REQUEST_MS    = float(os.environ.get("LOBBY_SLOW_MS", "500"))
+BUCKET_IDLE_TTL    = 600.0   # 這麼久沒用到的 bucket 就丟掉
+
+
+def reply_error(conn, message, **extra):
+    conn.sendall(json.dumps({"status": "error", "message": message, **extra}).encode())
+
+
+class Action:
+    def __init__(self, name, handler, auth, mutating, rate, user_field):
+        self.name = name
+        self.handler = handler
+        self.auth = auth
+        self.mutating = mutating
+        self.rate = rate or ("write" if mutating else "read")
+        self.user_field = user_field
+
+    def user(self, req):
+        return req.get(self.user_field)
+
+
+# ========= action 表 =========
+class ActionRegistry:
+    def __init__(self):
+        self.actions = {}
+        self.middleware = []
+
+    def action(self, name, auth=True, mutating=False, rate=None, user_field="player"):
+        """
+        decorator：@ACTIONS.action("join_room", mutating=True)
+        """
+        def register(handler):
+            if name in self.actions:
+                raise ValueError(f"action registered twice: {name}")
+            self.actions[name] = Action(name, handler, auth, mutating, rate, user_field)
+            return handler
+        return register
+
+    def use(self, middleware):
+        self.middleware.append(middleware)
+
+    def dispatch(self, req, conn):
+        name = req.get("action")
+        action = self.actions.get(name)
+        if action is None:
+            # framed client 會等回覆，未知的 action 也要回
+            reply_error(conn, f"unknown action: {name}")
+            return
+
+        def run(i):
+            if i == len(self.middleware):
+                return action.handler(req, conn)
+            return self.middleware[i](action, req, conn, lambda: run(i + 1))
+
+        run(0)
+
+
+# ========= middleware =========
+def auth_middleware(sessions):
+    """
+    sessions：common.sessions.SessionTable
+    """
+    def mw(action, req, conn, call_next):
+        if action.auth:
+            user = sessions.validate(req.get("token"))
+            if user is None:
+                reply_error(conn, "player not logged in")
+                return None
+            req[action.user_field] = user
+        return call_next()
+    return mw
+
+
+class ActionStats:
+    """
+    每個 action 的次數 / 總時間 / 最慢一次；超過 SLOW_REQUEST_MS 的 request 印 log
+    """
+
+    def __init__(self, slow_ms=SLOW_REQUEST_MS):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, name, elapsed):
+        with self.lock:
+            entry = self.stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += elapsed
+            entry["max"] = max(entry["max"], elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    "count": e["count"],
+                    "avg_ms": e["total"] / e["count"] * 1000,
+                    "max_ms": e["max"] * 1000,
+                }
+                for name, e in self.stats.items()
+            }
+
+    def middleware(self, action, req, conn, call_next):
+        start = time.perf_counter()
+        try:
+            return call_next()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record(action.name, elapsed)
+            if elapsed * 1000 > self.slow_ms:
+                print(f"[Lobby] slow request: {action.name} took {elapsed * 1000:.0f} ms")
+
+
+class RateLimiter:
+    """
+    token bucket，key 為 (玩家或對方 IP, rate class)
+    需要登入的 action 依 auth 驗證過的玩家，其餘（註冊 / 登入 / 公開列表）依 IP
+    """
+
+    def __init__(self, classes=RATE_CLASSES):
+        self.classes = classes
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.last_sweep = time.monotonic()
+
+    def allow(self, key, rate_class):
+        """
+        回傳 0 表示放行，否則是建議等待的秒數
+        """
+        rate, burst = self.classes[rate_class]
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_sweep > BUCKET_IDLE_TTL:
+                self._sweep(now)
+            tokens, updated = self.buckets.get((key, rate_class), (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self.buckets[(key, rate_class)] = (tokens, now)
+                return (1 - tokens) / rate
+            self.buckets[(key, rate_class)] = (tokens - 1, now)
+            return 0
+
+    def _sweep(self, now):
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < BUCKET_IDLE_TTL}
+        self.last_sweep = now
+
+    def middleware(self, action, req, conn, call_next):
+        addr = getattr(conn, "addr", None)
+        if action.auth:
+            key = action.user(req)
+        else:
+            key = addr[0] if addr else action.user(req)
+        wait = self.allow(key, action.rate)
+        if wait:
+            reply_error(conn, "rate limited", retry_after=round(wait, 3))
+            return None
+        return call_next()
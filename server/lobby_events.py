@@ -0,0 +1,196 @@
+"""
+Lobby 的 server push：房間 / 聊天事件訂閱
+
+原本 client 要知道房間人數、房主有沒有開始遊戲、有沒有新聊天，只能一直送 list_rooms /
+room_chat_fetch，每次都是整份房間列表 / 整份聊天紀錄。這裡改成：
+- client 另開一條 framed 連線送 {"action": "subscribe", "token", "topics": [...]}，
+  回覆帶目前的房間列表（snapshot），之後這條連線只收 server push 的事件（delta）
+- topics：
+    "rooms"：任何房間建立 / 成員變動 / 開始遊戲（分配 port）/ 刪除
+    "chat" ：自己所在房間的新訊息
+- 事件來源是 LobbyState 的 mutation listener（_mutate 時呼叫，持有 STATE.lock），
+  所以不會漏掉任何一條修改路徑，順序也和狀態一致
+- 每個事件只 encode 一次；每個訂閱者一個有上限的 queue，由一個 sender thread 負責寫出，
+  handler 不會被慢的訂閱者卡住；queue 滿了（client 跟不上）就斷線，client 重連後拿新的 snapshot
+
+事件格式（framed JSON）：
+    {"event": "room", "op": "update", "room": {...}}
+    {"event": "room", "op": "delete", "room_id": 1}
+    {"event": "chat", "room_id": 1, "message": {"player", "message"}}
+"""
+import json
+import os
+import socket
+import struct
+import threading
+from collections import deque
+
+TOPICS = {"rooms", "chat"}
+MAX_PENDING = 1000      # 每個訂閱者最多累積多少個還沒送出的事件
+SEND_TIMEOUT = 5.0      # thread 核心：寫給訂閱者最多卡這麼久（SO_SNDTIMEO），超過就斷線
+MAX_BUFFERED = 1 << 20  # asyncio 核心：寫入不會卡住，改看 transport 裡還沒送出的 bytes
+
+
+class Subscriber:
+    def __init__(self, conn, player, topics):
+        self.conn = conn
+        self.player = player
+        self.topics = topics
+        self.pending = deque()
+        self.closed = False
+        self.scheduled = False
+
+
+class EventHub:
+    """
+    members(room_key) -> 房間玩家名單（chat 事件只送給同房的訂閱者），由 lobby_server 提供
+    """
+
+    def __init__(self, members=None, max_pending=MAX_PENDING):
+        self.members = members
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.by_topic = {t: set() for t in TOPICS}
+        self.by_player = {}     # player -> set(Subscriber)
+        self.queue = deque()    # 有事件要送的訂閱者
+        self.thread = None
+
+    # ---------- 訂閱管理 ----------
+    def subscribe(self, conn, player, topics, first=None):
+        """
+        first：訂閱的回覆（snapshot），排在所有事件之前送出
+        呼叫端要持有 STATE.lock，snapshot 和之後的事件才會接得上
+        """
+        sub = Subscriber(conn, player, topics)
+        set_send_timeout(conn)
+        with self.lock:
+            for t in topics:
+                self.by_topic[t].add(sub)
+            self.by_player.setdefault(player, set()).add(sub)
+            if first is not None:
+                self._push(sub, first)
+        conn.on_close(lambda: self.unsubscribe(sub))
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self._remove(sub)
+
+    def _remove(self, sub):
+        sub.closed = True
+        sub.pending.clear()
+        for subs in self.by_topic.values():
+            subs.discard(sub)
+        subs = self.by_player.get(sub.player)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self.by_player[sub.player]
+
+    def drop_player(self, player):
+        """
+        玩家登出：關掉他的訂閱連線
+        """
+        with self.lock:
+            subs = list(self.by_player.get(player, ()))
+            for sub in subs:
+                self._remove(sub)
+        for sub in subs:
+            sub.conn.close()
+
+    def count(self):
+        with self.lock:
+            return sum(len(s) for s in self.by_player.values())
+
+    # ---------- 發佈 ----------
+    def _push(self, sub, payload):
+        """
+        呼叫端持有 self.lock
+        """
+        if sub.closed:
+            return
+        if len(sub.pending) >= self.max_pending:
+            # client 跟不上，斷線讓它重新訂閱拿 snapshot
+            print(f"[Lobby] subscriber {sub.player} is too slow, dropping")
+            self._remove(sub)
+            threading.Thread(target=sub.conn.close, daemon=True).start()
+            return
+        sub.pending.append(payload)
+        if not sub.scheduled:
+            sub.scheduled = True
+            self.queue.append(sub)
+            self.ready.notify()
+
+    def publish(self, topic, event, players=None):
+        """
+        players 不是 None 時只送給這些玩家（而且有訂閱 topic）的連線
+        """
+        payload = json.dumps(event).encode()
+        with self.lock:
+            if players is None:
+                targets = self.by_topic[topic]
+            else:
+                targets = [s for p in players for s in self.by_player.get(p, ()) if topic in s.topics]
+            for sub in list(targets):
+                self._push(sub, payload)
+
+    def on_mutation(self, collection, op, key, value):
+        """
+        LobbyState listener：把狀態修改轉成事件（在 STATE.lock 內呼叫，只 encode + 排隊）
+        """
+        if collection == "rooms":
+            if op == "set":
+                self.publish("rooms", {"event": "room", "op": "update", "room": value})
+            elif op == "del":
+                self.publish("rooms", {"event": "room", "op": "delete", "room_id": key})
+        elif collection == "chats" and op == "append" and self.members is not None:
+            self.publish("chat", {"event": "chat", "room_id": int(key), "message": value},
+                         players=self.members(key))
+
+    # ---------- 寫出 ----------
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._sender, daemon=True)
+            self.thread.start()
+
+    def _sender(self):
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.ready.wait()
+                sub = self.queue.popleft()
+                batch = list(sub.pending)
+                sub.pending.clear()
+                sub.scheduled = False
+            if sub.closed:
+                continue
+            try:
+                for payload in batch:
+                    sub.conn.sendall(payload)
+                buffered = getattr(sub.conn.sock, "buffered", None)
+                if buffered is not None and buffered() > MAX_BUFFERED:
+                    raise ConnectionResetError("subscriber is too slow")
+            except OSError as e:
+                print(f"[Lobby] subscriber {sub.player} dropped: {e!r}")
+                self.unsubscribe(sub)
+                sub.conn.close()
+
+
+def set_send_timeout(conn):
+    """
+    thread 核心的訂閱連線是 blocking socket：設 SO_SNDTIMEO，只影響寫入，
+    讀取（偵測 client 關線）仍然 blocking（settimeout 會把整個 fd 改成 non-blocking，讀取也跟著逾時）。
+    asyncio 核心的寫入本來就不會卡住
+    """
+    sock = getattr(conn, "sock", None)
+    if not isinstance(sock, socket.socket):
+        return
+    if os.name == "nt":
+        # Windows 的 SO_SNDTIMEO 是 DWORD 毫秒
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, int(SEND_TIMEOUT * 1000))
+        return
+    # struct timeval 依平台的 native long 大小 / byte order 打包（macOS 的 tv_usec 是 int，後面補 padding）
+    sec = int(SEND_TIMEOUT)
+    usec = int((SEND_TIMEOUT - sec) * 1e6)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", sec, usec))
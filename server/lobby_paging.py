@@ -0,0 +1,68 @@
+"""
+list_rooms / get_games / list_players 共用的分頁參數
+
+- limit ：一頁幾筆，預設 DEFAULT_PAGE，最多 MAX_PAGE（LOBBY_MAX_PAGE）；
+          沒帶 limit 的舊 client 也最多拿 MAX_PAGE 筆，回覆大小有上限
+- cursor：上一頁回覆的 next_cursor（不透明的字串），next_cursor 是 None 表示沒有下一頁
+cursor 內容由各 action 決定（房號、玩家名稱、排序後的位置），client 只要原封不動帶回來
+"""
+import base64
+import json
+import os
+
+DEFAULT_PAGE = 50
+MAX_PAGE = int(os.environ.get("LOBBY_MAX_PAGE", "500"))
+
+
+class PageError(ValueError):
+    """
+    分頁 / 篩選參數不合法，訊息直接回給 client
+    """
+
+
+def page_limit(req):
+    limit = req.get("limit")
+    if limit is None:
+        return MAX_PAGE
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise PageError("invalid limit")
+    return min(limit, MAX_PAGE)
+
+
+def encode_cursor(value):
+    if value is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def decode_cursor(req):
+    cursor = req.get("cursor")
+    if cursor is None:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (AttributeError, ValueError):
+        raise PageError("invalid cursor")
+
+
+def bool_param(req, name):
+    value = req.get(name)
+    if value is not None and not isinstance(value, bool):
+        raise PageError(f"invalid {name}")
+    return value
+
+
+def int_param(req, name, minimum=0):
+    value = req.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise PageError(f"invalid {name}")
+    return value
+
+
+def str_param(req, name):
+    value = req.get(name)
+    if value is not None and not isinstance(value, str):
+        raise PageError(f"invalid {name}")
+    return value or None
@@ -0,0 +1,181 @@
+"""
+Lobby 連線層：一條連線上讀 request、呼叫 dispatch、把回覆送回去
+
+兩種格式，看第一個 byte 自動判斷：
+- 舊版（第一個 byte 是 '{'）：client 送一個 JSON 後 shutdown(SHUT_WR)，回覆是裸 JSON，
+  讀到 EOF 為止。這裡改用 raw_decode 逐個解析，超過 4 KB 或黏在一起的 request 也不會壞
+- framed：每個 request / response 都是 4-byte 長度 + JSON（common/framing.py），
+  同一條連線可以一直用（client 一個 session 一條連線）
+
+handler 只透過下面幾個方法回覆，不用管是哪種格式：
+- conn.sendall(json_bytes)：一般的 JSON 回覆
+- conn.send_header(dict)：串流回覆的 header（後面接 raw bytes，長度寫在 header 裡）
+- conn.send_raw(bytes) / conn.sendfile(f, offset, count)：串流的 raw bytes
+- conn.on_close(callback)：連線結束時呼叫（例如取消事件訂閱）；conn.close() 由 server 主動斷線
+"""
+import codecs
+import json
+import socket
+
+from common.framing import MAX_FRAME, FrameError, encode_frame, read_frame
+
+LEGACY_RECV_SIZE = 4096
+
+
+class LegacyConn:
+    def __init__(self, sock, addr=None):
+        self.sock = sock
+        self.addr = addr   # 對方位址，給限流等 middleware 用
+        self.streaming = False   # 這個 request 已經開始送串流（header / raw bytes），safe_dispatch 每次重設
+        self._close_callbacks = []
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def send_header(self, header):
+        # 舊版串流格式：一行 JSON（"\n" 結尾）
+        self.streaming = True
+        self.sock.sendall(json.dumps(header).encode() + b"\n")
+
+    def send_raw(self, data):
+        self.streaming = True
+        self.sock.sendall(data)
+
+    def sendfile(self, f, offset=0, count=None):
+        self.streaming = True
+        self.sock.sendfile(f, offset, count)
+
+    def on_close(self, callback):
+        self._close_callbacks.append(callback)
+
+    def close(self):
+        # 只 shutdown，讓這條連線自己的讀取迴圈收到 EOF 後照正常流程結束
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def run_close_callbacks(self):
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[Lobby] close callback for {self.addr} failed: {e!r}")
+
+
+class FramedConn(LegacyConn):
+    def sendall(self, data):
+        self.sock.sendall(encode_frame(data))
+
+    def send_header(self, header):
+        self.streaming = True
+        self.sock.sendall(encode_frame(json.dumps(header).encode()))
+
+
+def safe_dispatch(dispatch, req, conn, addr):
+    conn.streaming = False
+    try:
+        dispatch(req, conn)
+    except OSError:
+        raise
+    except Exception as e:
+        print(f"[Lobby] {addr} action={req.get('action')} failed: {e!r}")
+        if conn.streaming:
+            # 串流的 header / raw bytes 已經送出一部分，再插一個 JSON 回覆只會讓 client 收到壞掉的檔案；
+            # 直接斷線，client 看到串流沒收完就知道失敗了
+            conn.close()
+            return
+        # handler 出錯不要讓整條連線（framed 時是整個 session）斷掉
+        conn.sendall(json.dumps({"status": "error", "message": "internal error"}).encode())
+
+
+class LegacyDecoder:
+    """
+    舊版連線的 byte stream -> 一個個完整的 JSON request。
+    還沒解析完的部分和 framed 一樣最多 MAX_FRAME，超過就 raise FrameError（呼叫端斷線），
+    一直送湊不成 JSON 的 bytes 不會把 server 記憶體吃光
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        # 多 byte 字元被切在兩次 recv 之間時 incremental decoder 會留著等下一段；
+        # 不合法的 UTF-8 換成 U+FFFD，request 照常處理（回錯誤），不會卡在 buffer 裡讓連線停住
+        self._utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buf = ""
+        self._incomplete = False   # buffer 裡剩下的是還沒收完整的 request
+
+    def feed(self, raw):
+        text = self._utf8.decode(raw)
+        self._buf += text
+        # request 一定是 object，以 "}" 結尾；新資料沒有 "}" 就不可能湊成完整的 request，不用重新解析整個 buffer
+        requests = self._parse() if not self._incomplete or "}" in text else []
+        if len(self._buf) > MAX_FRAME:
+            raise FrameError(f"legacy request too large: over {MAX_FRAME} bytes without a complete JSON")
+        return requests
+
+    def _parse(self):
+        requests = []
+        while True:
+            self._buf = self._buf.lstrip()
+            if not self._buf:
+                break
+            try:
+                req, end = self._decoder.raw_decode(self._buf)
+            except ValueError:
+                break   # 還沒收完整，繼續 recv
+            self._buf = self._buf[end:]
+            if isinstance(req, dict):
+                requests.append(req)
+        self._incomplete = bool(self._buf)
+        return requests
+
+
+def serve_legacy(sock, addr, dispatch):
+    conn = LegacyConn(sock, addr)
+    decoder = LegacyDecoder()
+    try:
+        while True:
+            raw = sock.recv(LEGACY_RECV_SIZE)
+            if not raw:
+                break
+            for req in decoder.feed(raw):
+                safe_dispatch(dispatch, req, conn, addr)
+    finally:
+        conn.run_close_callbacks()
+
+
+def serve_framed(sock, addr, dispatch):
+    conn = FramedConn(sock, addr)
+    try:
+        while True:
+            payload = read_frame(sock)
+            if payload is None:
+                break
+            try:
+                req = json.loads(payload.decode())
+            except ValueError:
+                conn.sendall(json.dumps({"status": "error", "message": "invalid json"}).encode())
+                continue
+            if isinstance(req, dict):
+                safe_dispatch(dispatch, req, conn, addr)
+    finally:
+        conn.run_close_callbacks()
+
+
+def serve_connection(sock, addr, dispatch):
+    """
+    一條 client 連線的主迴圈，直到對方關閉為止
+    """
+    try:
+        first = sock.recv(1, socket.MSG_PEEK)
+        if not first:
+            return
+        if first == b"{":
+            serve_legacy(sock, addr, dispatch)
+        else:
+            serve_framed(sock, addr, dispatch)
+    except OSError as e:   # 包含 FrameError
+        print(f"[Lobby] connection {addr} dropped: {e}")
+    finally:
+        sock.close()
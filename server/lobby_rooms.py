@@ -0,0 +1,169 @@
+"""
+Lobby 的房間索引（只在記憶體，由 LobbyState._apply 維護）
+
+原本找「玩家在哪個房間」要掃過所有房間，建房時還要把所有房號排序找最小的空號。
+這裡改成三個索引，和房間資料一起更新：
+- rooms    ：room_id -> room（dict 保留插入順序，輸出時和原本 list 一樣）
+- by_player：player -> {room_id}（正常只會有一個；舊資料重複加入時也不會找不到）
+- free ids ：min-heap，放「小於 next_id 而且目前沒人用」的房號；
+             分配時看 heap 頂端（已經被用掉的項目 lazy 丟掉），heap 空了就用 next_id。
+             另外用 free_set 記 heap 裡有哪些房號，同一個房號反覆建立 / 刪除時不會重複 push
+
+查房間 / 查玩家 O(1)，分配房號 O(log n)，和目前開了多少房間無關。
+房間 dict 會在 handler 裡原地修改後再 put_room，所以另外記一份成員集合，set 時比對差異。
+
+分頁用的索引（list_rooms）：
+- sorted_ids：所有房號排序，依房號分頁時用 bisect 直接跳到 cursor 的位置
+- by_game   ：game_key -> 排序的房號，依遊戲篩選時只看這款遊戲的房間
+"""
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+
+class RoomManager:
+    def __init__(self, rooms=()):
+        self.rooms = {}
+        self.members = {}       # room_id -> set(players)，上一次 set 時的成員
+        self.games = {}         # room_id -> game_key，上一次 set 時的遊戲
+        self.by_player = {}     # player -> set(room_id)
+        self.free_ids = []      # min-heap
+        self.free_set = set()   # free_ids 裡的房號（可能已經被用掉，還沒 lazy 丟掉）
+        self.next_id = 1
+        self.sorted_ids = []
+        self.by_game = {}       # game_key -> sorted [room_id]
+        for room in rooms:
+            self.set(room["room_id"], room)
+
+    # ---------- dict 介面（LobbyState 原本把 rooms 當 dict 用） ----------
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def values(self):
+        return self.rooms.values()
+
+    def __contains__(self, room_id):
+        return room_id in self.rooms
+
+    def __len__(self):
+        return len(self.rooms)
+
+    # ---------- 修改 ----------
+    def set(self, room_id, room):
+        if room_id not in self.rooms:
+            self._claim_id(room_id)
+            insort(self.sorted_ids, room_id)
+        game = room.get("game")
+        if room_id not in self.games or self.games[room_id] != game:
+            if room_id in self.games:
+                self._unindex_game(self.games[room_id], room_id)
+            insort(self.by_game.setdefault(game, []), room_id)
+            self.games[room_id] = game
+        self.rooms[room_id] = room
+        old = self.members.get(room_id, set())
+        new = set(room.get("players", []))
+        for p in old - new:
+            self._unlink(p, room_id)
+        for p in new - old:
+            self.by_player.setdefault(p, set()).add(room_id)
+        self.members[room_id] = new
+
+    def remove(self, room_id):
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return None
+        for p in self.members.pop(room_id, ()):
+            self._unlink(p, room_id)
+        del self.sorted_ids[bisect_left(self.sorted_ids, room_id)]
+        self._unindex_game(self.games.pop(room_id, None), room_id)
+        self._push_free(room_id)
+        return room
+
+    def _push_free(self, room_id):
+        if room_id not in self.free_set:
+            self.free_set.add(room_id)
+            heapq.heappush(self.free_ids, room_id)
+
+    def _unindex_game(self, game, room_id):
+        ids = self.by_game.get(game)
+        if not ids:
+            return
+        i = bisect_left(ids, room_id)
+        if i < len(ids) and ids[i] == room_id:
+            del ids[i]
+        if not ids:
+            del self.by_game[game]
+
+    def _unlink(self, player, room_id):
+        ids = self.by_player.get(player)
+        if ids is None:
+            return
+        ids.discard(room_id)
+        if not ids:
+            del self.by_player[player]
+
+    def _claim_id(self, room_id):
+        if not isinstance(room_id, int) or room_id < self.next_id:
+            return   # 在 heap 裡的話，分配時發現已經被用掉就丟掉
+        # 跳號（載入舊資料 / replay）：中間沒用到的房號都放進 heap
+        for rid in range(self.next_id, room_id):
+            self._push_free(rid)
+        self.next_id = room_id + 1
+
+    # ---------- 查詢 ----------
+    def room_of(self, player):
+        """
+        玩家所在的房間，不在任何房間回傳 None
+        """
+        ids = self.by_player.get(player)
+        if not ids:
+            return None
+        return self.rooms[min(ids)]
+
+    def rooms_of(self, player):
+        return [self.rooms[rid] for rid in sorted(self.by_player.get(player, ()))]
+
+    def smallest_free_id(self):
+        """
+        最小可用房號（從 1 開始），不會保留；呼叫端拿到後馬上 set
+        """
+        heap = self.free_ids
+        while heap and heap[0] in self.rooms:
+            self.free_set.discard(heapq.heappop(heap))
+        return heap[0] if heap else self.next_id
+
+    def page(self, limit, after=None, descending=False, game=None, started=None, free_slots=None, player=None):
+        """
+        依房號排序的一頁房間：after 是上一頁最後一個房號（不含），回傳 (rooms, 下一頁的 after 或 None)
+        game / player 走索引；started / free_slots 逐筆檢查（沒有 max_players 的房間不限人數）
+        """
+        if player is not None:
+            ids = sorted(self.by_player.get(player, ()))
+        elif game is not None:
+            ids = self.by_game.get(game, [])
+        else:
+            ids = self.sorted_ids
+
+        if descending:
+            end = len(ids) if after is None else bisect_left(ids, after)
+            candidates = (ids[i] for i in range(end - 1, -1, -1))
+        else:
+            start = 0 if after is None else bisect_right(ids, after)
+            candidates = (ids[i] for i in range(start, len(ids)))
+
+        rooms = []
+        for rid in candidates:
+            room = self.rooms[rid]
+            if started is not None and bool(room.get("started")) != started:
+                continue
+            if free_slots is not None and not has_free_slots(room, free_slots):
+                continue
+            if len(rooms) == limit:
+                # 後面還有符合條件的房間
+                return rooms, rooms[-1]["room_id"]
+            rooms.append(room)
+        return rooms, None
+
+
+def has_free_slots(room, n=1):
+    cap = room.get("max_players")
+    return cap is None or len(room.get("players", [])) + n <= cap
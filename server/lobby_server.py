@@ -3,20 +3,35 @@ import errno
 import threading
 import json
 import os
-import shutil
 import subprocess
 import zipfile
 import tempfile
 import time
 import base64
+import sys
 
 # ========= 檔案路徑設定 =========
 BASE_DIR       = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR       = os.path.dirname(BASE_DIR)
 DEV_DIR        = os.path.join(ROOT_DIR, "developer_client")
 
-# 與 developer_server 共用的遊戲資料與上傳檔案（直接讀 developer_client 資料夾）
-DB_FILE        = os.path.join(DEV_DIR, "database.json")
+sys.path.insert(0, ROOT_DIR)
+from common.storage import open_storage  # noqa: E402
+from common.hashing import sha256_file, load_file_index  # noqa: E402
+from common.blobstore import BlobStore  # noqa: E402
+from common.game_package import entry_module, player_limits, runtime_files, version_manifest  # noqa: E402
+from common.sessions import PresenceBatcher, SessionTable, start_presence_loop  # noqa: E402
+from lobby_state import LobbyState  # noqa: E402
+from lobby_rooms import has_free_slots  # noqa: E402
+from chat_archive import ChatArchive  # noqa: E402
+from download_mirror import mirror_download, start_gc_loop  # noqa: E402
+from lobby_protocol import FramedConn, serve_connection  # noqa: E402
+from lobby_events import EventHub, TOPICS as EVENT_TOPICS  # noqa: E402
+from lobby_paging import (PageError, bool_param, decode_cursor, encode_cursor, int_param,  # noqa: E402
+                          page_limit, str_param)
+from lobby_dispatch import ActionRegistry, ActionStats, RateLimiter, RATE_LIMIT_ENABLED, auth_middleware  # noqa: E402
+
+# 與 developer_server 共用的遊戲資料（common/storage.py）與上傳檔案（直接讀 developer_client 資料夾）
 UPLOAD_DIR     = os.path.join(DEV_DIR, "uploaded_games")
 PLAYER_FILE    = os.path.join(BASE_DIR, "players.json")
 
@@ -24,6 +39,13 @@ PLAYER_FILE    = os.path.join(BASE_DIR, "players.json")
 ROOM_FILE      = os.path.join(BASE_DIR, "rooms.json")             # room list
 PLAY_FILE      = os.path.join(BASE_DIR, "play_history.json")      # 玩家玩過哪些遊戲
 CHAT_FILE      = os.path.join(BASE_DIR, "room_chats.json")        # chat records
+WAL_DIR        = os.path.join(BASE_DIR, "wal")                    # players/rooms/chats 的 write-ahead log
+CHAT_ARCHIVE_DIR = os.environ.get("LOBBY_CHAT_ARCHIVE", os.path.join(BASE_DIR, "chat_archive"))  # 擠出 ring buffer 的舊訊息
+
+# 設成 1 則每筆 WAL 都 fsync（防斷電，但每筆修改多一次磁碟同步）
+WAL_FSYNC      = os.environ.get("LOBBY_WAL_FSYNC", "0") == "1"
+LOBBY_CORE     = os.environ.get("LOBBY_CORE", "thread")              # thread / async
+LISTEN_BACKLOG = int(os.environ.get("LOBBY_BACKLOG", "1024"))
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -39,213 +61,307 @@ AVAILABLE_PLUGINS = [
 ]
 
 
-# ========= load/save JSON =========
-def load_json(path, default):
-    """
-    小工具：安全載入 JSON 檔案
-    若檔案不存在則回傳 default
-    """
-    if not os.path.exists(path):
-        return default
-    with open(path, "r") as f:
-        return json.load(f)
-
-
-def save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
-
-
-def load_db():
-    # 遊戲資料庫，與 Developer 共用
-    return load_json(DB_FILE, {"developers": {}, "games": {}})
-
-
-def save_db(db):
-    save_json(DB_FILE, db)
-
-
-def load_rooms():
-    return load_json(ROOM_FILE, {"rooms": []})
-
-
-def save_rooms(rooms):
-    save_json(ROOM_FILE, rooms)
-
-
-def load_players():
-    return load_json(PLAYER_FILE, {"players": {}})
-
-
-def save_players(p):
-    save_json(PLAYER_FILE, p)
+# ========= 常駐狀態（取代每個 request 都 load/save JSON） =========
+# STORAGE：與 developer server 共用的遊戲資料（SQLite 時也存 players/rooms/chats/play_history）
+# STATE：lobby 常駐記憶體狀態；JSON backend 時修改寫進 WAL
+STORAGE = None
+STATE = None
+# 與 developer server 共用的 content-addressed blob store（解壓 / 玩家下載資料夾都用 hardlink）
+BLOBS = BlobStore()
+# 登入後發的 token -> 玩家（只在記憶體，common/sessions.py）；request 裡的玩家名稱以 token 為準
+SESSIONS = SessionTable()
+# 登入 / 登出 / 過期的在線狀態先記在記憶體，定期批次寫回 STATE（STATE 在 init_state() 才建立）
+PRESENCE = PresenceBatcher(lambda changes: STATE.set_presence(changes))
+# 房間 / 聊天修改推給訂閱的 client（lobby_events.py）；chat 事件只送給房間裡的玩家
+EVENTS = EventHub(members=lambda room_key: (STATE.get_room(int(room_key)) or {}).get("players", []))
+
+
+def init_state():
+    global STORAGE, STATE
+    STORAGE = open_storage()
+    STATE = LobbyState(
+        paths={
+            "players": PLAYER_FILE,
+            "rooms": ROOM_FILE,
+            "chats": CHAT_FILE,
+            "play_history": PLAY_FILE,
+        },
+        wal_dir=WAL_DIR,
+        fsync=WAL_FSYNC,
+        storage=STORAGE,
+        chat_archive=ChatArchive(CHAT_ARCHIVE_DIR),
+    )
+    # 載入 snapshot + replay WAL，之後 handler 都走記憶體
+    replayed = STATE.load()
+    if replayed:
+        print(f"[Lobby] Replayed {replayed} WAL records")
+    # 舊資料的聊天訊息補上 seq、超過 ring buffer 的部分封存
+    if STATE.normalize_chats():
+        print("[Lobby] Normalized chat history (seq / ring buffer)")
+    STATE.add_listener(EVENTS.on_mutation)
+    # session 不會留到重啟之後，上次還標記在線的玩家都要重新登入
+    stale = STATE.set_presence({name: (False, 0) for name in STATE.online_players()})
+    if stale:
+        print(f"[Lobby] Marked {stale} players offline (no session after restart)")
+
+
+# ========= action 表（lobby_dispatch.py） =========
+# 每個 handler 用 @ACTIONS.action(...) 註冊，auth / 限流 / 計時都在 middleware 做，handler 不用自己檢查登入
+ACTIONS = ActionRegistry()
+ACTION_STATS = ActionStats()
+RATE_LIMITER = RateLimiter()
 
 
 # ========================== 玩家帳號相關 ==========================
+@ACTIONS.action("player_register", auth=False, mutating=True, rate="auth", user_field="name")
 def handle_player_register(req, conn):
     name = req.get("name")
     pwd  = req.get("password")
     if not name or not pwd:
         conn.sendall(json.dumps({"status":"error","message":"missing fields"}).encode())
         return
-    players = load_players()
-    if name in players["players"]:
-        conn.sendall(json.dumps({"status":"error","message":"account exists"}).encode())
-        return
-    # 註冊後直接視為已登入，方便首次使用 -> same as the developer server change
-    players["players"][name] = {"password": pwd, "online": True, "last_seen": time.time()}
-    save_players(players)
-    conn.sendall(json.dumps({"status":"ok","message":"registered and logged in"}).encode())
+    with STATE.lock:
+        if STATE.get_player(name) is not None:
+            conn.sendall(json.dumps({"status":"error","message":"account exists"}).encode())
+            return
+        # 註冊後直接視為已登入，方便首次使用 -> same as the developer server change
+        STATE.set_player(name, {"password": pwd, "online": True, "last_seen": time.time()})
+    token = SESSIONS.create(name)
+    conn.sendall(json.dumps({"status":"ok","message":"registered and logged in","token":token}).encode())
 
 
+@ACTIONS.action("player_login", auth=False, mutating=True, rate="auth", user_field="name")
 def handle_player_login(req, conn):
     name = req.get("name")
     pwd  = req.get("password")
-    players = load_players()
-    info = players["players"].get(name)
+    info = STATE.get_player(name)
     if not info or info.get("password") != pwd:
         conn.sendall(json.dumps({"status":"error","message":"invalid credentials"}).encode())
         return
-    # 允許覆蓋舊 session，若之前異常未登出也能重新登入
-    info["online"] = True
-    info["last_seen"] = time.time()
-    save_players(players)
-    conn.sendall(json.dumps({"status":"ok","message":"login success"}).encode())
+    # 允許覆蓋舊 session，若之前異常未登出也能重新登入（舊 token 同時失效）
+    token = SESSIONS.create(name)
+    PRESENCE.mark(name, True)
+    conn.sendall(json.dumps({"status":"ok","message":"login success","token":token}).encode())
 
 
+@ACTIONS.action("player_logout", auth=False, mutating=True, user_field="name")
 def handle_player_logout(req, conn):
-    name = req.get("name")
-    players = load_players()
-    if name in players["players"]:
-        players["players"][name]["online"] = False
-        players["players"][name]["last_seen"] = 0
-        save_players(players)
-
+    # 只登出 token 對應的玩家；token 已失效（過期、重啟）時沒有需要清的東西
+    name = SESSIONS.revoke(req.get("token"))
+    if name is None:
+        conn.sendall(json.dumps({"status":"ok","message":"logout"}).encode())
+        return
+    PRESENCE.mark(name, False)
+    EVENTS.drop_player(name)
     # 清理玩家在房間的紀錄，避免掉線後仍卡在房間內
-    rooms = load_rooms()
-    rooms, removed = cleanup_player_in_rooms(rooms, name)
-    if removed:
-        save_rooms(rooms)
+    STATE.remove_player_from_rooms(name)
 
     conn.sendall(json.dumps({"status":"ok","message":"logout"}).encode())
 
 
-def handle_list_players(conn):
-    players = load_players()
-    online = [p for p, info in players["players"].items() if info.get("online")]
-    conn.sendall(json.dumps({"status":"ok","players": online}).encode())
-
-
-def require_player_online(player):
-    players = load_players()
-    info = players["players"].get(player)
-    if info and info.get("online"):
-        info["last_seen"] = time.time()
-        save_players(players)
-        return True
-    return False
-
-
-def handle_player_heartbeat(req, conn):
-    name = req.get("name")
-    players = load_players()
-    info = players["players"].get(name)
-    if info and info.get("online"):
-        info["last_seen"] = time.time()
-        save_players(players)
-        conn.sendall(json.dumps({"status":"ok"}).encode())
-    else:
-        conn.sendall(json.dumps({"status":"error","message":"not logged in"}).encode())
-
-
-def find_player_room(rooms, player):
+@ACTIONS.action("list_players", auth=False)
+def handle_list_players(req, conn):
     """
-    回傳玩家所在的房間物件，若不在任何房間回傳 None
+    req 可帶 limit / cursor（分頁，lobby_paging.py）、prefix（名稱前綴）；依名稱排序
     """
-    for r in rooms["rooms"]:
-        if player in r.get("players", []):
-            return r
-    return None
+    try:
+        limit = page_limit(req)
+        after = decode_cursor(req)
+        if after is not None and not isinstance(after, str):
+            raise PageError("invalid cursor")
+        prefix = str_param(req, "prefix")
+    except PageError as e:
+        conn.sendall(json.dumps({"status":"error","message":str(e)}).encode())
+        return
+    # 在線 = 有有效的 session（persist 的 online 欄位是批次寫回的，可能稍微落後）
+    online, last = SESSIONS.users_page(limit, after=after, prefix=prefix)
+    conn.sendall(json.dumps({"status":"ok","players": online,"next_cursor": encode_cursor(last)}).encode())
 
 
-def cleanup_player_in_rooms(rooms, player):
-    """
-    移除玩家在所有房間中的紀錄，若房間變空則刪除。
-    回傳 (updated_rooms, removed_any)
-    """
-    removed = False
-    new_rooms = []
-    for r in rooms["rooms"]:
-        if player in r.get("players", []):
-            removed = True
-            r["players"] = [p for p in r["players"] if p != player]
-        if r.get("players"):
-            new_rooms.append(r) # save the room only if not empty, (may be someone else still inside)
-    if removed:
-        rooms["rooms"] = new_rooms
-    return rooms, removed
+@ACTIONS.action("player_heartbeat", user_field="name")
+def handle_player_heartbeat(req, conn):
+    # auth middleware 驗證 token 時已經更新 session 的 last_seen（只在記憶體）
+    conn.sendall(json.dumps({"status":"ok"}).encode())
 
 
-def save_rooms(rooms):
-    save_json(ROOM_FILE, rooms)
+def clear_chat_room(room_id):
+    STATE.clear_chat(str(room_id))
 
 
-def load_play_history():
-    # play_history , check if the player has played this game before（P4）
-    return load_json(PLAY_FILE, {"records": []})
+# ========= P1：取得商城遊戲列表（include rating） =========
+# 商城列表只有上架 / 更新 / 下架 / 評分時才會變，依 storage 的 catalog revision
+# 快取已經 encode 好的回覆：沒有篩選的第一頁依 (sort, limit) 各存一份，同一個 revision 只組一次
+CATALOG_LOCK  = threading.Lock()
+CATALOG_CACHE = {"revision": None, "games": [], "orders": {}, "payloads": {}}
 
 
-def save_play_history(ph):
-    save_json(PLAY_FILE, ph)
+def build_catalog(revision):
+    game_list = []
+    # rating 數量 / 總分 / 最新版本都是 storage 裡增量維護的 aggregate，不用每次掃全部評分
+    for summary in STORAGE.list_game_summaries():
+        count = summary["rating_count"]
+        game_list.append({
+            "game_key": summary["game_key"],   # 唯一 ID（developer_gameName）
+            "name": summary["name"],
+            "developer": summary["developer"],
+            "description": summary["description"],
+            "latest_version": summary["latest_version"],
+            "avg_score": summary["rating_sum"] / count if count else None,
+            "rating_count": count
+        })
+    return {"revision": revision, "games": game_list, "orders": {}, "payloads": {}}
 
 
-def load_chats():
-    # room_chats 格式：{"rooms": {"1": [ {player,message}, ... ] } }
-    return load_json(CHAT_FILE, {"rooms": {}})
+# get_games 的排序；每個 revision 第一次用到時排一次，之後分頁直接用排好的位置
+GAME_SORTS = {
+    "default": None,   # 上架順序
+    "name": lambda g: (g["name"].lower(), g["game_key"]),
+    "rating": lambda g: (g["avg_score"] is None, -(g["avg_score"] or 0), g["game_key"]),
+    "popular": lambda g: (-g["rating_count"], g["game_key"]),
+}
 
 
-def save_chats(chats):
-    save_json(CHAT_FILE, chats)
+def catalog_snapshot(revision, sort):
+    """
+    回傳 (catalog, order)：order 是依 sort 排好的 index；catalog 依 revision 快取
+    """
+    with CATALOG_LOCK:
+        if CATALOG_CACHE.get("revision") != revision:
+            CATALOG_CACHE.clear()
+            CATALOG_CACHE.update(build_catalog(revision))
+        catalog = dict(CATALOG_CACHE)
+        order = catalog["orders"].get(sort)
+        if order is None:
+            games = catalog["games"]
+            key = GAME_SORTS[sort]
+            order = list(range(len(games))) if key is None else sorted(range(len(games)), key=lambda i: key(games[i]))
+            catalog["orders"][sort] = order
+    return catalog, order
+
+
+def game_matches(game, developer, query):
+    if developer and game["developer"] != developer:
+        return False
+    return not query or query in game["name"].lower() or query in game["game_key"].lower()
+
+
+@ACTIONS.action("get_games", auth=False)
+def handle_get_games(req, conn):
+    """
+    req 可帶：
+    - "revision"（client 上次拿到的版本）：只對沒有 cursor / sort / developer / q 的請求有效
+      （client 快取的是整份沒篩選的列表），沒變就回 not_modified，client 用自己的快取
+    - limit / cursor（分頁）、sort（GAME_SORTS）、developer、q（名稱 / game_key 包含的字）
+    cursor 綁定 revision 和 sort：目錄改過之後舊 cursor 回 "cursor expired"，client 從頭重抓
+    """
+    # 先讀 revision 再組列表：組到的資料只會比 revision 新，不會把舊資料標成新版本
+    revision = STORAGE.catalog_revision()
+    try:
+        limit = page_limit(req)
+        cursor = decode_cursor(req)
+        sort = req.get("sort") or "default"
+        if sort not in GAME_SORTS:
+            raise PageError(f"unknown sort: {sort}")
+        developer = str_param(req, "developer")
+        query = (str_param(req, "q") or "").lower()
+    except PageError as e:
+        conn.sendall(json.dumps({"status":"error","message":str(e)}).encode())
+        return
+    unfiltered = sort == "default" and not developer and not query
+    if cursor is None and unfiltered and req.get("revision") == revision:
+        conn.sendall(json.dumps({"status": "not_modified", "revision": revision}).encode())
+        return
+    if cursor is not None and (not isinstance(cursor, dict) or cursor.get("revision") != revision
+                               or cursor.get("sort") != sort):
+        conn.sendall(json.dumps({"status":"error","message":"cursor expired","revision":revision}).encode())
+        return
 
+    # 沒有篩選的第一頁（一般 client 每次看商城都是這個）直接回快取；limit 已經正規化過
+    first_page = (sort, limit) if cursor is None and not developer and not query else None
+    catalog, order = catalog_snapshot(revision, sort)
+    payload = catalog["payloads"].get(first_page) if first_page else None
+    if payload is not None:
+        conn.sendall(payload)
+        return
 
-def clear_chat_room(room_id):
-    chats = load_chats()
-    room_key = str(room_id)
-    if room_key in chats["rooms"]:
-        del chats["rooms"][room_key]
-        save_chats(chats)
+    games = catalog["games"]
+    pos = cursor["pos"] if cursor else 0
+    page = []
+    while pos < len(order) and len(page) < limit:
+        game = games[order[pos]]
+        pos += 1
+        if game_matches(game, developer, query):
+            page.append(game)
+    # 下一頁從下一個符合條件的位置開始，最後一頁不會是空的
+    while pos < len(order) and not game_matches(games[order[pos]], developer, query):
+        pos += 1
+    next_cursor = encode_cursor({"revision": revision, "sort": sort, "pos": pos}) if pos < len(order) else None
+
+    payload = json.dumps({"status": "ok", "revision": revision, "games": page, "next_cursor": next_cursor}).encode()
+    if first_page:
+        with CATALOG_LOCK:
+            if CATALOG_CACHE.get("revision") == revision:
+                CATALOG_CACHE["payloads"][first_page] = payload
+    conn.sendall(payload)
 
 
-# ========= P1：取得商城遊戲列表（include rating） =========
-def handle_get_games(conn):
-    db = load_db()
+# ========= P2：download game =========
+# 舊資料的 version 沒有 sha256：第一次下載時算一次，依 (path, mtime, size) 快取
+DIGEST_LOCK  = threading.Lock()
+DIGEST_CACHE = {}
+
+
+def version_digest(version_info, src_path):
+    if version_info.get("sha256"):
+        return version_info["sha256"]
+    st = os.stat(src_path)
+    stamp = (src_path, st.st_mtime_ns, st.st_size)
+    with DIGEST_LOCK:
+        digest = DIGEST_CACHE.get(stamp)
+    if digest is None:
+        digest = sha256_file(src_path)
+        with DIGEST_LOCK:
+            DIGEST_CACHE[stamp] = digest
+    return digest
+
+
+def resolve_version(game_key, version):
+    """
+    回傳 (error_message, src_path, version_info)；成功時 error_message 為 None
+    """
+    game = STORAGE.get_game(game_key)
+    if game is None:
+        return "game not found", None, None
 
-    game_list = []
-    for key, info in db["games"].items():
-        # 可能舊資料沒有 ratings 欄位，所以用 get
-        ratings = info.get("ratings", [])
-        if ratings:
-            avg_score = sum(r["score"] for r in ratings) / len(ratings)
-        else:
-            avg_score = None
+    # 找對應版本的檔案路徑
+    version_info = game["versions"].get(version)
+    if not version_info:
+        return "version not exists", None, None
 
-        latest_version = sorted(info["versions"].keys())[-1]
+    src_path = version_info["file_path"]
+    if not os.path.isabs(src_path):
+        src_path = os.path.join(DEV_DIR, src_path)
+    if not os.path.exists(src_path):
+        return "game file missing", None, None
+    return None, src_path, version_info
 
-        game_list.append({
-            "game_key": key,                  # 唯一 ID（developer_gameName）
-            "name": info["name"],
-            "developer": info["developer"],
-            "description": info["description"],
-            "latest_version": latest_version,
-            "avg_score": avg_score,
-            "rating_count": len(ratings)
-        })
 
-    response = {"status": "ok", "games": game_list}
-    conn.sendall(json.dumps(response).encode())
+def prepare_download(req):
+    """
+    檢查下載 request，回傳 (error_message, src_path, sha256)；成功時 error_message 為 None
+    """
+    player = req["player"]
+    error, src_path, version_info = resolve_version(req["game_key"], req["version"])
+    if error:
+        return error, None, None
 
+    # server 端的玩家下載資料夾預設不建立（LOBBY_DOWNLOAD_MIRROR），續傳時不重做
+    if not req.get("offset"):
+        mirror_download(player, req["game_key"], req["version"], src_path)
+    return None, src_path, version_digest(version_info, src_path)
 
-# ========= P2：download game =========
+
+@ACTIONS.action("download_game", rate="heavy")
 def handle_download(req, conn):
     """
     req 內容：
@@ -253,56 +369,125 @@ def handle_download(req, conn):
         "action": "download_game",
         "game_key": "...",
         "version": "...",
-        "player": "PlayerName"
+        "player": "PlayerName",
+        "stream": true,         # 新版 client：JSON header + 原始 bytes
+        "offset": 0,            # stream 模式可選：從第幾個 byte 開始（續傳）
+        "length": null          # stream 模式可選：最多送幾個 bytes，預設送到檔尾
     }
-    """
-    game_key = req["game_key"]
-    version  = req["version"]
-    player   = req["player"]
-
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
-        return
 
-    db = load_db()
-    if game_key not in db["games"]:
-        conn.sendall(json.dumps({"status": "error", "message": "game not found"}).encode())
-        return
-
-    # 找對應版本的檔案路徑
-    version_info = db["games"][game_key]["versions"].get(version)
-    if not version_info:
-        conn.sendall(json.dumps({"status": "error", "message": "version not exists"}).encode())
+    stream 模式回覆：JSON header（含完整檔案的 "size" / "sha256"，以及這次送的 "offset" / "length"；
+    舊版連線是一行 "\n" 結尾的 JSON，framed 連線是一個 frame），後面直接接那段 bytes，
+    server 用 socket.sendfile 送（zero-copy），兩端都不用把整個檔案讀進記憶體。
+    沒帶 stream 的舊 client 仍回 base64 的 file_data。
+    """
+    error, src_path, digest = prepare_download(req)
+    stream = req.get("stream", False)
+    if error:
+        reply = {"status": "error", "message": error}
+        if stream:
+            conn.send_header(reply)
+        else:
+            conn.sendall(json.dumps(reply).encode())
         return
 
-    src_path = version_info["file_path"]
-    if not os.path.isabs(src_path):
-        src_path = os.path.join(DEV_DIR, src_path)
-    if not os.path.exists(src_path):
-        conn.sendall(json.dumps({"status": "error", "message": "game file missing"}).encode())
+    filename = os.path.basename(src_path)
+    if stream:
+        with open(src_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                offset = int(req.get("offset") or 0)
+                length = req.get("length")
+                length = size - offset if length is None else min(int(length), size - offset)
+            except (TypeError, ValueError):
+                offset, length = -1, -1
+            if offset < 0 or offset > size or length < 0:
+                conn.send_header({"status": "error", "message": "invalid range", "size": size})
+                return
+
+            header = {
+                "status": "ok",
+                "message": "download success",
+                "filename": filename,
+                "size": size,
+                "sha256": digest,
+                "offset": offset,
+                "length": length
+            }
+            conn.send_header(header)
+            if length:
+                conn.sendfile(f, offset, length)
         return
 
-    # 玩家下載目的地（-> 每位玩家一個資料夾）
-    # 讀取 zip 並回傳給 client 儲存（同時保留 server 端拷貝）
+    # 舊版：讀取 zip 並以 base64 放進 JSON 回傳
     with open(src_path, "rb") as f:
         raw_bytes = f.read()
     b64_data = base64.b64encode(raw_bytes).decode()
-    filename = os.path.basename(src_path)
-
-    # 仍保留一份在 server 端（原本行為）
-    dst_dir = os.path.join(ROOT_DIR, "player_client", "downloads", player)
-    os.makedirs(dst_dir, exist_ok=True)
-    shutil.copy(src_path, os.path.join(dst_dir, filename))
 
     conn.sendall(json.dumps({
         "status": "ok",
         "message": "download success",
         "filename": filename,
+        "sha256": digest,
         "file_data": b64_data
     }).encode())
 
 
+# ========= P2：delta update =========
+@ACTIONS.action("download_delta", rate="heavy")
+def handle_download_delta(req, conn):
+    """
+    req 內容：
+    {
+        "action": "download_delta",
+        "game_key": "...",
+        "version": "1.1",          # 要組出來的版本
+        "from_version": "1.0",     # client 手上已經有的版本
+        "player": "PlayerName"
+    }
+
+    回覆：JSON header（conn.send_header，格式同 stream 下載）
+    {"status": "ok", "files": {path: {"sha256", "size"}}（新版本完整的 file index）,
+     "delta": [{"path", "size"}, ...]}
+    後面依 delta 的順序直接接各檔案的內容。
+    內容（sha256）在舊版本出現過的檔案都不送，client 從自己的舊版本複製。
+    """
+    def reply_error(message):
+        conn.send_header({"status": "error", "message": message})
+
+    error, target_path, _ = resolve_version(req["game_key"], req["version"])
+    if error:
+        reply_error(error)
+        return
+    error, base_path, _ = resolve_version(req["game_key"], req.get("from_version"))
+    if error:
+        reply_error(f"base version: {error}")
+        return
+
+    target_files = load_file_index(target_path)
+    base_hashes = {e["sha256"] for e in load_file_index(base_path).values()}
+    delta = [{"path": path, "size": e["size"]}
+             for path, e in target_files.items() if e["sha256"] not in base_hashes]
+
+    header = {"status": "ok", "files": target_files, "delta": delta}
+    conn.send_header(header)
+    with zipfile.ZipFile(target_path, "r") as zf:
+        for item in delta:
+            blob_path = BLOBS.path(target_files[item["path"]]["sha256"])
+            if os.path.exists(blob_path):
+                # 已經在 blob store 裡的內容直接 sendfile，不用再解壓
+                with open(blob_path, "rb") as f:
+                    conn.sendfile(f, 0, item["size"])
+                continue
+            with zf.open(item["path"]) as member:
+                while True:
+                    buf = member.read(64 * 1024)
+                    if not buf:
+                        break
+                    conn.send_raw(buf)
+
+
 # ========= P3：create room =========
+@ACTIONS.action("create_room", mutating=True)
 def handle_create_room(req, conn):
     """
     req:
@@ -310,23 +495,24 @@ def handle_create_room(req, conn):
         "action": "create_room",
         "player": "PlayerName",
         "game_key": "...",
-        "version": "..."
+        "version": "...",
+        "max_players": 4      # 選填：人數上限，list_rooms 的 free_slots 依這個篩選
     }
     """
     player   = req["player"]
     game_key = req["game_key"]
     version  = req["version"]
-
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
+    max_players = req.get("max_players")
+    if max_players is not None and (not isinstance(max_players, int) or isinstance(max_players, bool)
+                                    or max_players < 2):
+        conn.sendall(json.dumps({"status":"error","message":"invalid max_players"}).encode())
         return
 
-    db = load_db()
-    if game_key not in db["games"]:
+    game = STORAGE.get_game(game_key)
+    if game is None:
         conn.sendall(json.dumps({"status":"error","message":"game not found"}).encode())
         return
 
-    game = db["games"][game_key]
     version_info = game["versions"].get(version)
     if not version_info:
         conn.sendall(json.dumps({"status":"error","message":"version not exists"}).encode())
@@ -339,53 +525,54 @@ def handle_create_room(req, conn):
         conn.sendall(json.dumps({"status":"error","message":"game zip missing on server"}).encode())
         return
 
-    rooms = load_rooms()
-    rooms, _ = cleanup_player_in_rooms(rooms, player)
-    # 儲存清理後的 rooms，避免殘留
-    save_rooms(rooms)
-    if find_player_room(rooms, player):
-        conn.sendall(json.dumps({"status":"error","message":"leave current room first"}).encode())
+    # 上架時宣告的人數（game.json）：沒指定上限就用遊戲的上限，指定了不能超出遊戲的範圍
+    min_players, cap = player_limits(version_info)
+    if max_players is None:
+        max_players = cap
+    elif cap is not None and max_players > cap:
+        conn.sendall(json.dumps({"status":"error","message":f"max_players exceeds game limit ({cap})"}).encode())
+        return
+    elif max_players < min_players:
+        conn.sendall(json.dumps({"status":"error","message":f"game needs at least {min_players} players"}).encode())
         return
 
-    # 分配最小可用房號（從 1 開始）
-    existing_ids = sorted(r["room_id"] for r in rooms["rooms"]) # for fear that room ids are not continuous
-    new_room_id = 1
-    for rid in existing_ids: # find the hole, then we can reuse the id
-        if rid == new_room_id:
-            new_room_id += 1
-        elif rid > new_room_id:
-            break
-
-    new_room = {
-        "room_id": new_room_id,
-        "game": game_key,
-        "version": version,
-        "creator": player,
-        "players": [player],
-        "server_port": 7000 + new_room_id,  # 先保留埠號，真正啟動在 start_room
-        "started": False
-    }
-
-    rooms["rooms"].append(new_room)
-    save_rooms(rooms)
-
-    # record play_history（for P4 ）
-    ph = load_play_history()
-    ph["records"].append({
-        "player": player,
-        "game_key": game_key
-    })
-    save_play_history(ph)
-
-    conn.sendall(json.dumps({
-        "status":  "ok",
-        "message": "room created",
-        "room":    new_room
-    }).encode())
+    with STATE.lock:
+        # 清理殘留的房間紀錄
+        STATE.remove_player_from_rooms(player)
+        if STATE.find_player_room(player):
+            conn.sendall(json.dumps({"status":"error","message":"leave current room first"}).encode())
+            return
+
+        # 分配最小可用房號（從 1 開始）, find the hole, then we can reuse the id
+        new_room_id = STATE.smallest_free_room_id()
+
+        new_room = {
+            "room_id": new_room_id,
+            "game": game_key,
+            "version": version,
+            "creator": player,
+            "players": [player],
+            "server_port": 7000 + new_room_id,  # 先保留埠號，真正啟動在 start_room
+            "started": False
+        }
+        if max_players is not None:
+            new_room["max_players"] = max_players
+        STATE.put_room(new_room)
+
+        # record play_history（for P4 ）
+        STATE.add_play_record(player, game_key)
+
+        payload = json.dumps({
+            "status":  "ok",
+            "message": "room created",
+            "room":    new_room
+        }).encode()
+    conn.sendall(payload)
 
 
 
 # ========= P4：get the information of game =========
+@ACTIONS.action("get_game_detail", auth=False)
 def handle_get_game_detail(req, conn):
     """
     req 內容：
@@ -395,36 +582,29 @@ def handle_get_game_detail(req, conn):
     }
     """
     game_key = req["game_key"]
-    db = load_db()
-
-    if game_key not in db["games"]:
+    summary = STORAGE.get_game_summary(game_key)
+    if summary is None:
         conn.sendall(json.dumps({"status": "error", "message": "game not found"}).encode())
         return
 
-    info = db["games"][game_key]
-    ratings = info.get("ratings", [])
-    if ratings:
-        avg_score = sum(r["score"] for r in ratings) / len(ratings)
-    else:
-        avg_score = None
-
-    # 只回傳前幾則留言即可（避免太多）
-    preview_comments = ratings[-5:]
-
+    count = summary["rating_count"]
     res = {
         "status": "ok",
         "game_key": game_key,
-        "name": info["name"],
-        "developer": info["developer"],
-        "description": info["description"],
-        "avg_score": avg_score,
-        "rating_count": len(ratings),
-        "comments": preview_comments
+        "name": summary["name"],
+        "developer": summary["developer"],
+        "description": summary["description"],
+        "avg_score": summary["rating_sum"] / count if count else None,
+        "rating_count": count,
+        "score_histogram": summary["histogram"],   # [1★, 2★, 3★, 4★, 5★] 的人數
+        # 只回傳前幾則留言即可（避免太多）
+        "comments": STORAGE.recent_ratings(game_key, 5)
     }
     conn.sendall(json.dumps(res).encode())
 
 
 # ========= P4：submit rating =========
+@ACTIONS.action("submit_rating", mutating=True)
 def handle_submit_rating(req, conn):
     """
     req 內容：
@@ -441,51 +621,69 @@ def handle_submit_rating(req, conn):
     score    = req["score"]
     comment  = req.get("comment", "")
 
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status": "error", "message": "player not logged in"}).encode())
-        return
 
     # check score range
     if not (1 <= score <= 5): # five rating review
         conn.sendall(json.dumps({"status": "error", "message": "score must be 1~5"}).encode())
         return
 
-    db = load_db()
-    if game_key not in db["games"]:
+    if STORAGE.get_game(game_key) is None:
         conn.sendall(json.dumps({"status": "error", "message": "game not found"}).encode())
         return
 
     # check if the player has played this game before（依照 play_history）
-    ph = load_play_history()
-    played = any((r["player"] == player and r["game_key"] == game_key) for r in ph["records"])
-    if not played:
+    if not STATE.has_played(player, game_key):
         conn.sendall(json.dumps({"status": "error", "message": "you have not played this game"}).encode())
         return
 
-    # write rating
-    game = db["games"][game_key]
-    if "ratings" not in game:
-        game["ratings"] = []
-    game["ratings"].append({
+    # write rating（儲存層逐筆新增，不會和 developer server 的寫入互相覆蓋）
+    STORAGE.add_rating(game_key, {
         "player": player,
         "score": score,
         "comment": comment
     })
 
-    save_db(db)
-
     conn.sendall(json.dumps({"status": "ok", "message": "rating submitted"}).encode())
 
 
 # ========= 房間列表 / 加入 / 離開 / 刪除 =========
-def handle_list_rooms(conn):
-    rooms = load_rooms()
-    conn.sendall(json.dumps({
-        "status": "ok",
-        "rooms": rooms["rooms"]
-    }).encode())
+@ACTIONS.action("list_rooms", auth=False)
+def handle_list_rooms(req, conn):
+    """
+    req 可帶：
+    - limit / cursor（分頁，lobby_paging.py）、sort："room_id"（預設）或 "-room_id"
+    - game_key、started（true / false）、free_slots（至少還有幾個空位）、player_in（某玩家所在的房間）
+    game_key / player_in 走 RoomManager 的索引，不用掃全部房間
+    """
+    try:
+        limit = page_limit(req)
+        after = decode_cursor(req)
+        if after is not None and not isinstance(after, int):
+            raise PageError("invalid cursor")
+        sort = req.get("sort") or "room_id"
+        if sort not in ("room_id", "-room_id"):
+            raise PageError(f"unknown sort: {sort}")
+        filters = {
+            "game": str_param(req, "game_key"),
+            "started": bool_param(req, "started"),
+            "free_slots": int_param(req, "free_slots", minimum=1),
+            "player": str_param(req, "player_in"),
+        }
+    except PageError as e:
+        conn.sendall(json.dumps({"status":"error","message":str(e)}).encode())
+        return
+
+    with STATE.lock:
+        rooms, last = STATE.rooms_page(limit, after=after, descending=sort == "-room_id", **filters)
+        payload = json.dumps({
+            "status": "ok",
+            "rooms": rooms,
+            "next_cursor": encode_cursor(last),
+        }).encode()
+    conn.sendall(payload)
 
 
+@ACTIONS.action("join_room", mutating=True)
 def handle_join_room(req, conn):
     """
     req: {action:"join_room", player:"...", room_id":int}
@@ -493,36 +691,30 @@ def handle_join_room(req, conn):
     player = req["player"]
     room_id = int(req["room_id"])
 
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
-        return
 
-    rooms = load_rooms()
-    rooms, _ = cleanup_player_in_rooms(rooms, player)
-    save_rooms(rooms)
-    if find_player_room(rooms, player):
-        conn.sendall(json.dumps({"status": "error", "message": "leave current room first"}).encode())
-        return
+    with STATE.lock:
+        STATE.remove_player_from_rooms(player)
+        if STATE.find_player_room(player):
+            conn.sendall(json.dumps({"status": "error", "message": "leave current room first"}).encode())
+            return
 
-    target = None
-    for r in rooms["rooms"]:
-        if r["room_id"] == room_id:
-            target = r
-            break
-    if not target:
-        conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
-        return
+        target = STATE.get_room(room_id)
+        if not target:
+            conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
+            return
 
-    if player not in target["players"]:
-        target["players"].append(player)
-        save_rooms(rooms)
+        if player not in target["players"]:
+            if not has_free_slots(target):
+                conn.sendall(json.dumps({"status":"error","message":"room is full"}).encode())
+                return
+            target["players"].append(player)
+            STATE.put_room(target)
 
-    # 記錄 play history
-    ph = load_play_history()
-    ph["records"].append({"player": player, "game_key": target["game"]})
-    save_play_history(ph)
+        # 記錄 play history
+        STATE.add_play_record(player, target["game"])
 
-    conn.sendall(json.dumps({"status":"ok","room":target}).encode())
+        payload = json.dumps({"status":"ok","room":target}).encode()
+    conn.sendall(payload)
 
 
 def cleanup_room_after_game(room_id):
@@ -530,57 +722,50 @@ def cleanup_room_after_game(room_id):
     遊戲的 child process 結束後，重置房間狀態（保留房間與玩家），
     讓同一房間可以再次啟動下一局。
     """
-    rooms = load_rooms()
-    updated = False
-    for r in rooms["rooms"]:
-        if r["room_id"] == room_id:
-            r["started"] = False
-            r["server_port"] = None
-            updated = True
-            break
-    if updated:
-        save_rooms(rooms)
-        print(f"[Lobby] Room {room_id} reset after game finished")
+    with STATE.lock:
+        r = STATE.get_room(room_id)
+        if r is None:
+            return
+        r["started"] = False
+        r["server_port"] = None
+        STATE.put_room(r)
+    print(f"[Lobby] Room {room_id} reset after game finished")
 
 
+@ACTIONS.action("start_room", mutating=True, rate="heavy")
 def handle_start_room(req, conn):
     """
     req: {action:"start_room", player:"...", room_id":int}
-    只有 creator 可以啟動，且需要至少 2 位玩家
+    只有 creator 可以啟動，且需要至少 2 位玩家（遊戲的 game.json 有宣告時依宣告的人數）
     """
     player = req["player"]
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
-        return
     room_id = int(req["room_id"])
 
-    rooms = load_rooms()
-    target = None
-    for r in rooms["rooms"]:
-        if r["room_id"] == room_id:
-            target = r
-            break
-    if not target:
-        conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
-        return
-    if target.get("creator") != player:
-        conn.sendall(json.dumps({"status":"error","message":"only creator can start"}).encode())
-        return
-    if target.get("started"):
-        conn.sendall(json.dumps({"status":"ok","message":"already started","room":target}).encode())
-        return
-    if len(target.get("players", [])) < 2:
-        conn.sendall(json.dumps({"status":"error","message":"need at least 2 players"}).encode())
-        return
+    with STATE.lock:
+        target = STATE.get_room(room_id)
+        if not target:
+            conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
+            return
+        if target.get("creator") != player:
+            conn.sendall(json.dumps({"status":"error","message":"only creator can start"}).encode())
+            return
+        if target.get("started"):
+            conn.sendall(json.dumps({"status":"ok","message":"already started","room":target}).encode())
+            return
+        game_key = target["game"]
+        version = target["version"]
+        player_count = len(target.get("players", []))
 
     # 準備啟動 game server
-    db = load_db()
-    game_key = target["game"]
-    version = target["version"]
-    version_info = db["games"][game_key]["versions"].get(version)
+    game = STORAGE.get_game(game_key)
+    version_info = game["versions"].get(version) if game else None
     if not version_info:
         conn.sendall(json.dumps({"status":"error","message":"version not exists"}).encode())
         return
+    min_players, _ = player_limits(version_info)
+    if player_count < min_players:
+        conn.sendall(json.dumps({"status":"error","message":f"need at least {min_players} players"}).encode())
+        return
     zip_path = version_info["file_path"]
     if not os.path.isabs(zip_path):
         zip_path = os.path.join(DEV_DIR, zip_path)
@@ -588,38 +773,49 @@ def handle_start_room(req, conn):
         conn.sendall(json.dumps({"status":"error","message":"game zip missing on server"}).encode())
         return
 
-    result = start_game_server(game_key, version, zip_path, room_id)
+    # 解壓 / 啟動 process 比較慢，不在 lock 內做
+    result = start_game_server(game_key, version, zip_path, room_id, version_manifest(version_info))
     if result is None:
         conn.sendall(json.dumps({"status":"error","message":"failed to start game server"}).encode())
         return
     server_port, proc = result
 
-    target["server_port"] = server_port
-    target["started"] = True
-    save_rooms(rooms)
+    with STATE.lock:
+        target = STATE.get_room(room_id)
+        if not target or target.get("started"):
+            # 啟動期間房間被刪掉，或同時有另一個 start 搶先完成
+            proc.terminate()
+            if target:
+                conn.sendall(json.dumps({"status":"ok","message":"already started","room":target}).encode())
+            else:
+                conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
+            return
+        target["server_port"] = server_port
+        target["started"] = True
+        STATE.put_room(target)
+        payload = json.dumps({"status":"ok","message":"game started","room":target}).encode()
 
     # 背景等待 game server 結束後清理房間，避免卡住
     threading.Thread(target=lambda p, rid: (p.wait(), cleanup_room_after_game(rid)),
                      args=(proc, room_id), daemon=True).start()
 
-    conn.sendall(json.dumps({"status":"ok","message":"game started","room":target}).encode())
+    conn.sendall(payload)
 
 
+@ACTIONS.action("leave_room", mutating=True)
 def handle_leave_room(req, conn):
     """
     req: {action:"leave_room", player:"..."}
     """
     player = req["player"]
-    rooms = load_rooms()
-    rooms, removed = cleanup_player_in_rooms(rooms, player)
-    if not removed:
+    if not STATE.remove_player_from_rooms(player):
         conn.sendall(json.dumps({"status":"error","message":"not in any room"}).encode())
         return
 
-    save_rooms(rooms)
     conn.sendall(json.dumps({"status":"ok","message":"left room"}).encode())
 
 
+@ACTIONS.action("delete_room", mutating=True)
 def handle_delete_room(req, conn):
     """
     req: {action:"delete_room", player:"...", room_id":int}
@@ -627,31 +823,24 @@ def handle_delete_room(req, conn):
     """
     player = req["player"]
     room_id = int(req["room_id"])
-    rooms = load_rooms()
-    # 找出符合房號且是自己建立的房間
-    target = None
-    for r in rooms["rooms"]:
-        if r["room_id"] == room_id and r.get("creator") == player:
-            target = r
-            break
-    if not target:
-        # 若房號存在但不是自己建立，回報錯誤
-        exists = any(r["room_id"] == room_id for r in rooms["rooms"])
-        if exists:
-            conn.sendall(json.dumps({"status":"error","message":"only creator can delete"}).encode())
-        else:
+    with STATE.lock:
+        target = STATE.get_room(room_id)
+        if not target:
             conn.sendall(json.dumps({"status":"error","message":"room not found"}).encode())
-        return
+            return
+        if target.get("creator") != player:
+            # 房號存在但不是自己建立
+            conn.sendall(json.dumps({"status":"error","message":"only creator can delete"}).encode())
+            return
 
-    # 刪除所有同房號的記錄以清理重複
-    rooms["rooms"] = [r for r in rooms["rooms"] if r["room_id"] != room_id]
-    save_rooms(rooms)
-    clear_chat_room(room_id)
+        STATE.remove_room(room_id)
+        clear_chat_room(room_id)
     conn.sendall(json.dumps({"status":"ok","message":"room deleted"}).encode())
 
 
 # PL1：Get Plugin list
-def handle_get_plugins(conn):
+@ACTIONS.action("get_plugins", auth=False)
+def handle_get_plugins(req, conn):
     """
     Plugin 只是由 Lobby Server 提供可用清單；
     安裝/移除放在 Client 端做（每位玩家自己決定）
@@ -664,6 +853,7 @@ def handle_get_plugins(conn):
 
 
 # Chatting in the room (PL1)
+@ACTIONS.action("room_chat_send", mutating=True)
 def handle_room_chat_send(req, conn):
     """
     req:
@@ -678,50 +868,45 @@ def handle_room_chat_send(req, conn):
     player  = req["player"]
     message = req["message"]
 
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
-        return
 
-    rooms = load_rooms()
-    my_room = find_player_room(rooms, player)
-    if not my_room:
-        conn.sendall(json.dumps({"status":"error","message":"not in any room"}).encode())
-        return
-    if str(my_room["room_id"]) != room_id:
-        conn.sendall(json.dumps({"status":"error","message":"room mismatch"}).encode())
-        return
+    with STATE.lock:
+        my_room = STATE.find_player_room(player)
+        if not my_room:
+            conn.sendall(json.dumps({"status":"error","message":"not in any room"}).encode())
+            return
+        if str(my_room["room_id"]) != room_id:
+            conn.sendall(json.dumps({"status":"error","message":"room mismatch"}).encode())
+            return
 
-    chats = load_chats()
-    key = str(my_room["room_id"])
-    if key not in chats["rooms"]:
-        chats["rooms"][key] = []
-    chats["rooms"][key].append({
-        "player": player,
-        "message": message
-    })
-    save_chats(chats)
+        seq = STATE.append_chat(str(my_room["room_id"]), {
+            "player": player,
+            "message": message
+        })
 
-    conn.sendall(json.dumps({"status":"ok","message":"chat sent"}).encode())
+    conn.sendall(json.dumps({"status":"ok","message":"chat sent","seq":seq}).encode())
 
 
 # Get the chatting history
+@ACTIONS.action("room_chat_fetch")
 def handle_room_chat_fetch(req, conn):
     """
     req:
     {
         "action": "room_chat_fetch",
-        "room_id": 1
+        "room_id": 1,
+        "since": 0          # 選填：上次看到的 seq，只回傳之後的訊息
     }
+    回覆多帶 last_seq（下次的 since）；truncated 表示 since 之後有訊息已經擠出記憶體（在封存檔），
+    reset 表示 since 比目前還新（聊天室被清過），回傳的是從頭開始的訊息
     """
     room_id = str(req["room_id"])
     player = req.get("player")
-
-    if not require_player_online(player):
-        conn.sendall(json.dumps({"status":"error","message":"player not logged in"}).encode())
+    since = req.get("since", 0)
+    if not isinstance(since, int) or since < 0:
+        conn.sendall(json.dumps({"status":"error","message":"invalid since"}).encode())
         return
 
-    rooms = load_rooms()
-    my_room = find_player_room(rooms, player)
+    my_room = STATE.find_player_room(player)
     if not my_room:
         conn.sendall(json.dumps({"status":"error","message":"not in any room"}).encode())
         return
@@ -729,75 +914,77 @@ def handle_room_chat_fetch(req, conn):
         conn.sendall(json.dumps({"status":"error","message":"room mismatch"}).encode())
         return
 
-    chats = load_chats()
-    key = str(my_room["room_id"])
-    msgs = chats["rooms"].get(key, [])
+    chat = STATE.chat_since(str(my_room["room_id"]), since)
 
-    conn.sendall(json.dumps({
-        "status": "ok",
-        "messages": msgs
-    }).encode())
+    conn.sendall(json.dumps({"status": "ok", **chat}).encode())
+
+
+# ========================== server push ==========================
+@ACTIONS.action("subscribe")
+def handle_subscribe(req, conn):
+    """
+    req:
+    {
+        "action": "subscribe",
+        "token": "...",
+        "topics": ["rooms", "chat"]
+    }
+    回覆帶目前的房間列表；之後這條連線只收事件（lobby_events.py），client 不要再在上面送 request
+    """
+    if not isinstance(conn, FramedConn):
+        conn.sendall(json.dumps({"status":"error","message":"subscribe needs a framed connection"}).encode())
+        return
+    topics = req.get("topics") or sorted(EVENT_TOPICS)
+    if not isinstance(topics, list) or not set(topics) <= EVENT_TOPICS:
+        conn.sendall(json.dumps({"status":"error","message":f"unknown topics: {topics}"}).encode())
+        return
+
+    # snapshot 和註冊在同一個 lock 內：之後的每個修改都會變成事件，不會漏也不會重複
+    with STATE.lock:
+        snapshot = json.dumps({
+            "status": "ok",
+            "topics": topics,
+            "rooms": STATE.list_rooms(),
+        }).encode()
+        EVENTS.subscribe(conn, req["player"], set(topics), first=snapshot)
 
 
 # Important !!!!! : Main server loop
-def handle_client(conn, addr):
-    print(f"[Lobby] Connected by {addr}")
+# 順序：計時（包含被擋下的 request）-> 登入檢查（token）-> 限流（依驗證過的玩家）-> handler
+ACTIONS.use(ACTION_STATS.middleware)
+ACTIONS.use(auth_middleware(SESSIONS))
+if RATE_LIMIT_ENABLED:
+    ACTIONS.use(RATE_LIMITER.middleware)
 
-    while True:
-        raw = conn.recv(4096)
-        if not raw:
-            break
 
-        try:
-            req = json.loads(raw.decode())
-        except:
-            continue
-
-        action = req.get("action")
-
-        if action == "player_register":
-            handle_player_register(req, conn)
-        elif action == "player_login":
-            handle_player_login(req, conn)
-        elif action == "player_logout":
-            handle_player_logout(req, conn)
-        elif action == "list_players":
-            handle_list_players(conn)
-        elif action == "player_heartbeat":
-            handle_player_heartbeat(req, conn)
-        elif action == "get_games":
-            handle_get_games(conn)
-        elif action == "download_game":
-            handle_download(req, conn)
-        elif action == "create_room":
-            handle_create_room(req, conn)
-        elif action == "list_rooms":
-            handle_list_rooms(conn)
-        elif action == "join_room":
-            handle_join_room(req, conn)
-        elif action == "leave_room":
-            handle_leave_room(req, conn)
-        elif action == "delete_room":
-            handle_delete_room(req, conn)
-        elif action == "start_room":
-            handle_start_room(req, conn)
-        elif action == "get_game_detail":
-            handle_get_game_detail(req, conn)
-        elif action == "submit_rating":
-            handle_submit_rating(req, conn)
-        elif action == "get_plugins":
-            handle_get_plugins(conn)
-        elif action == "room_chat_send":
-            handle_room_chat_send(req, conn)
-        elif action == "room_chat_fetch":
-            handle_room_chat_fetch(req, conn)
-        # 其他 action 可在此擴充
-
-    conn.close()
+def dispatch(req, conn):
+    ACTIONS.dispatch(req, conn)
 
 
-def start_lobby():
+def shutdown_services():
+    """
+    server 結束前：印出統計、寫回還沒 flush 的在線狀態、把 WAL 壓回 snapshot
+    """
+    log_action_stats()
+    PRESENCE.flush()
+    STATE.close()
+
+
+def log_action_stats():
+    for name, e in sorted(ACTION_STATS.snapshot().items()):
+        print(f"[Lobby] {name:18s} count={e['count']:<8d} avg={e['avg_ms']:.2f} ms  max={e['max_ms']:.2f} ms")
+
+
+def handle_client(conn, addr):
+    print(f"[Lobby] Connected by {addr}")
+    # 舊版 client（一次一個 JSON）和 framed client（4-byte 長度、persistent 連線）都在這裡處理
+    serve_connection(conn, addr, dispatch)
+
+
+def bind_lobby_socket():
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # persistent 連線在 server 重啟時會留下 TIME_WAIT，沒有 SO_REUSEADDR 會綁不回原本的 port
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     base_port = int(os.environ.get("LOBBY_PORT", "6060"))
     chosen_port = None
 
@@ -815,66 +1002,90 @@ def start_lobby():
     if chosen_port is None:
         raise RuntimeError("No available port found for lobby server")
 
-    server.listen(5) # can be changed here if a lot of people want to connect in the same time
+    # 同時大量登入時 listen(5) 的 backlog 會滿，改成可設定（預設 1024，實際上限看 somaxconn）
+    server.listen(LISTEN_BACKLOG)
+    return server, chosen_port
+
+
+def start_services():
+    """
+    載入狀態並啟動背景工作（thread / asyncio 兩種 server 核心共用）
+    """
+    init_state()
+    # 背景 compactor 定期把 WAL 壓回 snapshot（SQLite backend 時不需要）
+    if STATE.wal is not None:
+        STATE.start_compactor()
+
+    # 60 秒沒有任何 request（包含心跳）的 session 過期（heap，只處理到期的），在線狀態批次寫回
+    start_presence_loop(SESSIONS, PRESENCE, log_prefix="[Lobby]")
+    # server push 的 sender thread
+    EVENTS.start()
+    # 定期清掉 server 端 stale 的玩家下載 mirror
+    start_gc_loop(STORAGE)
+
+
+def start_lobby():
+    """
+    thread 核心：每條連線一個 OS thread（LOBBY_CORE=async 改用 lobby_async.py 的 event loop）
+    """
+    server, chosen_port = bind_lobby_socket()
+    start_services()
 
     print(f"[Lobby Server] Running on port {chosen_port}...")
 
-    def expire_loop():
+    try:
         while True:
-            time.sleep(30)
-            players = load_players()
-            now = time.time()
-            changed = False
-            for info in players["players"].values():
-                last = info.get("last_seen", 0)
-                if info.get("online") and now - last > 60:
-                    info["online"] = False
-                    changed = True
-            if changed:
-                save_players(players)
-
-    threading.Thread(target=expire_loop, daemon=True).start()
-
-    while True:
-        conn, addr = server.accept()
-        threading.Thread(target=handle_client, args=(conn, addr)).start()
+            conn, addr = server.accept()
+            threading.Thread(target=handle_client, args=(conn, addr)).start()
+    finally:
+        shutdown_services()
 
 GAME_RUNTIME_DIR = os.path.join(BASE_DIR, "game_runtime")
 os.makedirs(GAME_RUNTIME_DIR, exist_ok=True)
 
 
-def ensure_game_extracted(game_key, version, zip_path):
+EXTRACT_LOCK = threading.Lock()
+
+
+def ensure_game_extracted(game_key, version, zip_path, manifest=None):
     """
     確保某個遊戲版本已經被解壓縮到 server 端的 runtime 目錄。
     規則：
     - 解壓縮到 GAME_RUNTIME_DIR/{game_key}/{version}/
-    - 假設裡面會有一個 game_server.py 可以被啟動
+    - 有 manifest（上架時檢查過）就照它的 file index 組，連同預先編好的 .pyc，不用再讀 zip
+    - 舊版本沒有 manifest：讀 zip 的 file index，假設裡面會有一個 game_server.py 可以被啟動
+    - 檔案是 blob store 的 hardlink，不會再複製一份內容
     """
     target_dir = os.path.join(GAME_RUNTIME_DIR, game_key, version)
-    if os.path.exists(target_dir) and os.listdir(target_dir):
-        # 已經解壓過
-        return target_dir
+    with EXTRACT_LOCK:
+        if os.path.exists(target_dir) and os.listdir(target_dir):
+            # 已經解壓過
+            return target_dir
 
-    os.makedirs(target_dir, exist_ok=True)
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        zf.extractall(target_dir)
-    return target_dir
+        files = runtime_files(manifest) if manifest else load_file_index(zip_path)
+        if BLOBS.missing(files):
+            # 舊版上架的 zip 還沒進 blob store，補匯入一次
+            files = BLOBS.ingest_zip(zip_path)
+        return BLOBS.materialize(files, target_dir)
 
 
-def start_game_server(game_key, version, zip_path, room_id):
+def start_game_server(game_key, version, zip_path, room_id, manifest=None):
     """
     啟動對應遊戲的 game server：
     - 解壓縮 zip (若尚未解壓)
-    - 假設裡面有 game_server.py
+    - 啟動 manifest 宣告的 server entry point（沒有 manifest 的舊版本假設是 game_server.py）
     - 分配一個 TCP port（例如 7000 + room_id）
-    - 用 subprocess.Popen 啟動：python game_server.py --port XXX --room_id XXX
+    - 用 subprocess.Popen 啟動：python -m game_server --port XXX --room_id XXX
+      （用 -m 才會讀上架時預先編好的 .pyc；interpreter 用 lobby 自己的 sys.executable，
+      和 runtime_files 檢查 cache_tag 的是同一個；沒有 manifest 的舊版本直接跑 game_server.py）
     """
-    runtime_dir = ensure_game_extracted(game_key, version, zip_path)
-    server_script = os.path.join(runtime_dir, "game_server.py")
+    runtime_dir = ensure_game_extracted(game_key, version, zip_path, manifest)
+    entry = manifest["entry"]["server"] if manifest else "game_server.py"
+    server_script = os.path.join(runtime_dir, entry)
 
     if not os.path.exists(server_script):
         # record log for debug
-        print(f"[WARN] game_server.py not found in {runtime_dir}")
+        print(f"[WARN] {entry} not found in {runtime_dir}")
         return None
 
     # 選一個可用的埠號（避免之前殘留占用）
@@ -883,8 +1094,10 @@ def start_game_server(game_key, version, zip_path, room_id):
         port = tmp.getsockname()[1]
 
     # 實際啟動 game server (non-blocking)
+    module = entry_module(entry) if manifest else None
+    target = ["-m", module] if module else [server_script]
     proc = subprocess.Popen(
-        ["python", server_script, "--port", str(port), "--room_id", str(room_id)],
+        [sys.executable or "python3", *target, "--port", str(port), "--room_id", str(room_id)],
         cwd=runtime_dir
     )
     print(f"[Lobby] Launched game server pid={proc.pid} on port {port} (room {room_id})")
@@ -892,4 +1105,8 @@ def start_game_server(game_key, version, zip_path, room_id):
     return port, proc
 
 if __name__ == "__main__":
-    start_lobby()
+    if LOBBY_CORE == "async":
+        import lobby_async
+        lobby_async.start_lobby_async(sys.modules[__name__])
+    else:
+        start_lobby()
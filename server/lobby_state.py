@@ -0,0 +1,456 @@
+"""
+Lobby Server 常駐記憶體狀態
+
+原本每個 handler 都 load_*() 讀整份 JSON，改完再 save_json() 整份重寫，
+玩家一多，每次 heartbeat / 房間操作都是 O(全部資料) 的磁碟 I/O。
+這裡改成：
+- start_lobby() 時載入一次，之後的讀取都直接走記憶體
+- 所有修改都透過 LobbyState 的方法：先套用到記憶體，再 append 一筆
+  [collection, op, key, value] 到 write-ahead log（lobby_wal.py），每筆 O(1)
+- 背景 compactor 定期把 WAL 壓回 snapshot（players.json / rooms.json /
+  room_chats.json / play_history.json），snapshot 內的 wal_seq 記錄它涵蓋到哪個 segment
+- 啟動時讀 snapshot 再 replay 剩下的 WAL，啟動時間只和 snapshot 大小 + 未壓縮的 WAL 有關
+- 若儲存層是 SQLite（common/storage.py），改成直接把同樣的 record 寫進對應的表，不用 WAL
+- 聊天每則訊息帶房間內遞增的 seq，記憶體每個房間只留最近 chat_buffer 則（ring buffer），
+  擠出去的寫進 chat_archive.py 的封存檔並記一筆 trim record，snapshot / SQLite 的聊天紀錄有上限
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from lobby_rooms import RoomManager
+from lobby_wal import WriteAheadLog
+
+COLLECTIONS = ("players", "rooms", "chats", "play_history")
+COMPACT_INTERVAL = 5.0       # seconds，compactor 檢查間隔
+COMPACT_MIN_RECORDS = 500    # 目前 segment 累積這麼多筆就壓縮
+COMPACT_MAX_AGE = 60.0       # 有修改但筆數不多時，最久隔多少秒也要壓一次
+CHAT_BUFFER = int(os.environ.get("LOBBY_CHAT_BUFFER", "200"))   # 每個房間在記憶體留幾則訊息
+
+
+# ========= 檔案工具 =========
+def load_json(path, default):
+    """
+    安全載入 JSON 檔案，若檔案不存在則回傳 default
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def atomic_write(path, text):
+    """
+    先寫暫存檔再 os.replace，寫到一半掛掉也不會留下被截斷的檔案
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ========= 常駐狀態 =========
+class LobbyState:
+    """
+    paths: {"players": ..., "rooms": ..., "chats": ..., "play_history": ...}
+    wal_dir: write-ahead log segment 的資料夾
+    storage: common.storage 的 backend；stores_lobby_state 為 True 時 paths / wal_dir 不會用到
+    chat_archive: chat_archive.ChatArchive，None 時擠出 ring buffer 的訊息直接丟掉
+
+    所有方法都會自己拿 lock；需要「查詢 + 修改」一次完成的 handler
+    可以在外面再包一層 `with state.lock:`（RLock，可重入）。
+    """
+
+    def __init__(self, paths, wal_dir, fsync=False, storage=None, chat_buffer=CHAT_BUFFER, chat_archive=None):
+        self.paths = paths
+        self.chat_buffer = max(1, chat_buffer)
+        self.chat_archive = chat_archive
+        # SQLite 之類可以逐筆寫入的 backend 就不需要 WAL
+        self.storage = storage if storage is not None and storage.stores_lobby_state else None
+
+        self.lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+
+        self.players = {}       # name -> {"password", "online", "last_seen"}
+        self.rooms = RoomManager()   # room_id -> room，加上 player -> room 和空房號的索引（lobby_rooms.py）
+        self.chats = {}         # room_key(str) -> deque([{"player", "message", "seq"}, ...])，seq 連續遞增
+        self.played = set()     # {(player, game_key)}：玩過哪些遊戲，評分前 O(1) 檢查
+
+        self.wal = None if self.storage else WriteAheadLog(wal_dir, fsync=fsync)
+        self._touched = set()   # 目前 segment 改過哪些 collection
+        self._last_compact = time.time()
+        self._listeners = []    # fn(collection, op, key, value)，每筆修改寫入後呼叫（持有 self.lock）
+
+    # ---------- 載入 / WAL / snapshot ----------
+    def load(self, read_only=False):
+        """
+        載入 snapshot 並 replay WAL，回傳 replay 的筆數。
+        read_only=True（例如匯入 SQLite）：只讀，不切新 segment、不刪舊 segment，磁碟上的資料原封不動
+        """
+        if self.storage:
+            with self.lock:
+                data = self.storage.load_lobby()
+                self.players = data["players"]
+                self.rooms = RoomManager(data["rooms"])
+                self.chats = {k: deque(v) for k, v in data["chats"].items()}
+                self.played = {(r["player"], r["game_key"]) for r in data["play_history"]}
+                return 0
+
+        with self.lock:
+            snaps = {
+                "players": load_json(self.paths["players"], {"players": {}}),
+                "rooms": load_json(self.paths["rooms"], {"rooms": []}),
+                "chats": load_json(self.paths["chats"], {"rooms": {}}),
+                "play_history": load_json(self.paths["play_history"], {"records": []}),
+            }
+            self.players = snaps["players"]["players"]
+            # 舊資料可能有重複房號，以最後一筆為準
+            self.rooms = RoomManager(snaps["rooms"]["rooms"])
+            self.chats = {k: deque(v) for k, v in snaps["chats"]["rooms"].items()}
+            records = snaps["play_history"]["records"]
+            self.played = {(r["player"], r["game_key"]) for r in records}
+            if len(self.played) != len(records):
+                # 舊版 create/join 每次都 append，重複的紀錄在下一次 compaction 收斂成一筆
+                print(f"[Lobby] play_history: collapsed {len(records) - len(self.played)} duplicate records")
+                self._touched.add("play_history")
+
+            # snapshot 已經包含 wal_seq 之前的 segment，只 replay 之後的
+            covered = {c: snaps[c].get("wal_seq", 0) for c in COLLECTIONS}
+            replayed = 0
+            for seq, (collection, op, key, value) in self.wal.replay():
+                if seq >= covered[collection]:
+                    self._apply(collection, op, key, value)
+                    self._touched.add(collection)
+                    replayed += 1
+            if read_only:
+                return replayed
+
+            # 之後的修改寫進新的 segment；replay 過的內容交給下一次 compaction
+            seq = self.wal.roll()
+            if not self._touched:
+                # 舊 segment 全都已經在 snapshot 裡（或是空的），直接清掉
+                self.wal.drop_before(seq)
+            return replayed
+
+    def _apply(self, collection, op, key, value):
+        if collection == "players":
+            if op == "set":
+                self.players[key] = value
+            elif op == "del":
+                self.players.pop(key, None)
+        elif collection == "rooms":
+            if op == "set":
+                self.rooms.set(key, value)
+            elif op == "del":
+                self.rooms.remove(key)
+        elif collection == "chats":
+            if op == "append":
+                self.chats.setdefault(key, deque()).append(value)
+            elif op == "trim":
+                # value = {"upto": seq, "keep": n}：丟掉 seq <= upto 的訊息（已經寫進封存檔）
+                ring = self.chats.get(key)
+                while ring and ring[0].get("seq", 0) <= value["upto"]:
+                    ring.popleft()
+            elif op == "del":
+                self.chats.pop(key, None)
+        elif collection == "play_history":
+            # "append" 是舊版 WAL 的 op，replay 時一樣只留一筆
+            if op in ("add", "append"):
+                self.played.add((value["player"], value["game_key"]))
+
+    def add_listener(self, listener):
+        """
+        訂閱所有修改（例如 lobby_events 的 server push）；listener 在 lock 內呼叫，不能做慢的事
+        載入 / replay 不會觸發
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, records):
+        for listener in self._listeners:
+            for record in records:
+                try:
+                    listener(*record)
+                except Exception as e:
+                    print(f"[Lobby] state listener failed: {e!r}")
+
+    def _mutate(self, collection, op, key=None, value=None):
+        """
+        套用到記憶體並寫一筆 WAL；呼叫端必須持有 self.lock（保證 WAL 順序和記憶體一致）
+        """
+        self._apply(collection, op, key, value)
+        if self.storage:
+            self.storage.apply(collection, op, key, value)
+        else:
+            self.wal.append([collection, op, key, value])
+            self._touched.add(collection)
+        if self._listeners:
+            self._notify([(collection, op, key, value)])
+
+    def _mutate_many(self, records):
+        """
+        多筆修改一次寫入（SQLite 同一個 transaction、WAL 一次 write）；呼叫端必須持有 self.lock
+        """
+        for record in records:
+            self._apply(*record)
+        if not records:
+            return
+        if self.storage:
+            self.storage.apply_many(records)
+        else:
+            self.wal.append_many(records)
+            self._touched.update(r[0] for r in records)
+        if self._listeners:
+            self._notify(records)
+
+    def _snapshot(self, collection):
+        if collection == "players":
+            return {"players": self.players}
+        if collection == "rooms":
+            return {"rooms": list(self.rooms.values())}
+        if collection == "chats":
+            return {"rooms": {k: list(v) for k, v in self.chats.items()}}
+        if collection == "play_history":
+            return {"records": [{"player": p, "game_key": g} for p, g in sorted(self.played)]}
+        raise KeyError(collection)
+
+    def compact(self):
+        """
+        切新的 WAL segment，把舊 segment 改到的 collection 寫成 snapshot，再刪掉舊 segment。
+        序列化在 lock 內做（保證一致），寫檔在 lock 外做，不擋住其他 request。
+        回傳寫了幾份 snapshot。
+        """
+        with self._compact_lock:
+            with self.lock:
+                if not self._touched:
+                    return 0
+                touched = self._touched
+                self._touched = set()
+                seq = self.wal.roll()
+                payloads = {}
+                for c in touched:
+                    snap = dict(self._snapshot(c))
+                    snap["wal_seq"] = seq
+                    payloads[c] = json.dumps(snap, indent=4)
+            try:
+                for collection, text in payloads.items():
+                    atomic_write(self.paths[collection], text)
+            except OSError:
+                # snapshot 沒寫成功，舊 segment 留著，下一輪再試
+                with self.lock:
+                    self._touched |= touched
+                raise
+            self.wal.drop_before(seq)
+            self._last_compact = time.time()
+            return len(payloads)
+
+    def _should_compact(self):
+        with self.lock:
+            if not self._touched:
+                return False
+            return (self.wal.records_in_segment >= COMPACT_MIN_RECORDS
+                    or time.time() - self._last_compact >= COMPACT_MAX_AGE)
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(COMPACT_INTERVAL)
+            try:
+                if self._should_compact():
+                    self.compact()
+            except OSError as e:
+                print(f"[Lobby] WAL compaction failed: {e}")
+
+    def start_compactor(self):
+        threading.Thread(target=self._compact_loop, daemon=True).start()
+
+    def close(self):
+        if self.storage:
+            return
+        self.compact()
+        self.wal.close()
+
+    # ---------- 玩家 ----------
+    def get_player(self, name):
+        with self.lock:
+            return self.players.get(name)
+
+    def set_player(self, name, info):
+        with self.lock:
+            self._mutate("players", "set", name, info)
+
+    def update_player(self, name, **fields):
+        with self.lock:
+            info = self.players.get(name)
+            if info is None:
+                return False
+            info.update(fields)
+            self._mutate("players", "set", name, info)
+            return True
+
+    def online_players(self):
+        with self.lock:
+            return [p for p, info in self.players.items() if info.get("online")]
+
+    def set_presence(self, changes):
+        """
+        changes: {name: (online, last_seen)}，批次寫回在線狀態（common/sessions.PresenceBatcher 定期呼叫）
+        回傳實際有改到的筆數
+        """
+        records = []
+        with self.lock:
+            for name, (online, last_seen) in changes.items():
+                info = self.players.get(name)
+                if not info or (info.get("online") == online and info.get("last_seen") == last_seen):
+                    continue
+                info = dict(info, online=online, last_seen=last_seen)
+                records.append(["players", "set", name, info])
+            self._mutate_many(records)
+        return len(records)
+
+    # ---------- 房間 ----------
+    def list_rooms(self):
+        with self.lock:
+            return list(self.rooms.values())
+
+    def get_room(self, room_id):
+        with self.lock:
+            return self.rooms.get(room_id)
+
+    def rooms_page(self, limit, after=None, **filters):
+        """
+        list_rooms 的一頁（見 RoomManager.page），回傳 (rooms, 下一頁的 after 或 None)
+        """
+        with self.lock:
+            return self.rooms.page(limit, after=after, **filters)
+
+    def find_player_room(self, player):
+        """
+        回傳玩家所在的房間物件，若不在任何房間回傳 None
+        """
+        with self.lock:
+            return self.rooms.room_of(player)
+
+    def put_room(self, room):
+        """
+        新增房間，或在原地修改房間 dict 之後呼叫，讓修改進 journal
+        """
+        with self.lock:
+            self._mutate("rooms", "set", room["room_id"], room)
+
+    def remove_room(self, room_id):
+        with self.lock:
+            if room_id not in self.rooms:
+                return False
+            self._mutate("rooms", "del", room_id)
+            return True
+
+    def remove_player_from_rooms(self, player):
+        """
+        移除玩家在所有房間中的紀錄，若房間變空則刪除。回傳是否有移除
+        """
+        removed = False
+        with self.lock:
+            for r in self.rooms.rooms_of(player):
+                removed = True
+                r["players"] = [p for p in r["players"] if p != player]
+                if r["players"]:
+                    self.put_room(r)
+                else:
+                    # save the room only if not empty, (may be someone else still inside)
+                    self.remove_room(r["room_id"])
+        return removed
+
+    def smallest_free_room_id(self):
+        # 分配最小可用房號（從 1 開始），空房號放在 min-heap，不用排序所有房號
+        with self.lock:
+            return self.rooms.smallest_free_id()
+
+    # ---------- 聊天 ----------
+    def normalize_chats(self):
+        """
+        啟動時呼叫一次：舊資料的訊息沒有 seq 就重新編號寫回，超過 chat_buffer 的舊訊息封存後 trim
+        回傳處理了幾個房間
+        """
+        changed = 0
+        with self.lock:
+            for key in list(self.chats):
+                ring = self.chats[key]
+                renumber = any("seq" not in m for m in ring)
+                if renumber:
+                    msgs = [dict(m, seq=i) for i, m in enumerate(ring, 1)]
+                    self._mutate_many([["chats", "del", key, None]] + [["chats", "append", key, m] for m in msgs])
+                overflow = len(self.chats[key]) > self.chat_buffer
+                if overflow:
+                    self._trim_chat(key, [])
+                changed += renumber or overflow
+        return changed
+
+    def _trim_chat(self, room_key, records, incoming=0):
+        """
+        ring buffer 超過上限時：先把要擠出去的訊息寫進封存檔，再把 records + 一筆 trim 一起寫入
+        incoming：records 裡還要 append 幾則。呼叫端持有 self.lock
+        """
+        ring = self.chats[room_key]
+        overflow = len(ring) + incoming - self.chat_buffer
+        evicted = list(islice(ring, overflow))
+        if self.chat_archive is not None:
+            self.chat_archive.append(room_key, evicted)
+        records.append(["chats", "trim", room_key, {"upto": evicted[-1]["seq"], "keep": self.chat_buffer}])
+        self._mutate_many(records)
+
+    def append_chat(self, room_key, msg):
+        """
+        指定房間內下一個 seq 後寫入，回傳 seq
+        """
+        with self.lock:
+            ring = self.chats.get(room_key)
+            msg = dict(msg, seq=ring[-1]["seq"] + 1 if ring else 1)
+            if ring and len(ring) >= self.chat_buffer:
+                # append 和 trim 同一批寫入（WAL 一次 write / SQLite 同一個 transaction）
+                self._trim_chat(room_key, [["chats", "append", room_key, msg]], incoming=1)
+            else:
+                self._mutate("chats", "append", room_key, msg)
+            return msg["seq"]
+
+    def chat_since(self, room_key, since=0):
+        """
+        回傳 seq > since 的訊息，成本和新訊息數量成正比
+        {"messages", "last_seq", "truncated"（since 之後有訊息已經只在封存檔）, "reset"（since 比目前還新，
+        聊天室被清過，從頭給）}
+        """
+        with self.lock:
+            ring = self.chats.get(room_key) or ()
+            last = ring[-1]["seq"] if ring else 0
+            reset = since > last
+            if reset:
+                since = 0
+            n = min(last - since, len(ring))
+            msgs = list(islice(reversed(ring), n))[::-1]
+            first = ring[0]["seq"] if ring else 1
+            return {"messages": msgs, "last_seq": last, "truncated": since < first - 1, "reset": reset}
+
+    def clear_chat(self, room_key):
+        with self.lock:
+            if room_key in self.chats:
+                self._mutate("chats", "del", room_key)
+                if self.chat_archive is not None:
+                    self.chat_archive.rotate(room_key)
+
+    # ---------- play history ----------
+    def add_play_record(self, player, game_key):
+        """
+        已經有同一組 (player, game_key) 就不再寫入，紀錄數量只和「玩家 x 遊戲」有關
+        """
+        with self.lock:
+            if (player, game_key) in self.played:
+                return False
+            self._mutate("play_history", "add", None, {"player": player, "game_key": game_key})
+            return True
+
+    def has_played(self, player, game_key):
+        with self.lock:
+            return (player, game_key) in self.played
@@ -0,0 +1,96 @@
+"""
+Lobby 的 append-only write-ahead log
+
+- 每筆修改是一行 compact JSON：[collection, op, key, value]，寫入成本 O(1)
+- log 切成多個 segment（000001.log, 000002.log, ...）；compaction 時先切新 segment，
+  把舊 segment 的內容寫進 snapshot（players.json 等）後再刪掉舊 segment
+- 啟動時先讀 snapshot，再依序 replay 還留著的 segment
+- crash 時最後一行可能只寫一半，replay 讀到壞掉的行就停在那個 segment
+"""
+import json
+import os
+
+SEGMENT_SUFFIX = ".log"
+
+
+class WriteAheadLog:
+    def __init__(self, wal_dir, fsync=False):
+        self.wal_dir = wal_dir
+        self.fsync = fsync   # True：每筆都 fsync（防斷電）；False：只 flush（防 process crash）
+        self.seq = 0
+        self.records_in_segment = 0
+        self._f = None      # 資料夾在第一次 roll 時才建立，只讀（replay）時不會動到磁碟
+
+    def _segment_path(self, seq):
+        return os.path.join(self.wal_dir, f"{seq:06d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """
+        回傳 [(seq, path), ...]，依 seq 由小到大
+        """
+        result = []
+        if not os.path.isdir(self.wal_dir):
+            return result
+        for fname in os.listdir(self.wal_dir):
+            stem, ext = os.path.splitext(fname)
+            if ext == SEGMENT_SUFFIX and stem.isdigit():
+                result.append((int(stem), os.path.join(self.wal_dir, fname)))
+        return sorted(result)
+
+    def replay(self):
+        """
+        依序產生 (seq, record)
+        """
+        for seq, path in self.segments():
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 寫到一半的最後一行（crash），這個 segment 後面不會再有完整資料
+                        break
+                    yield seq, record
+
+    def roll(self):
+        """
+        關掉目前的 segment，開一個新的，回傳新 segment 的 seq
+        """
+        if self._f is not None:
+            self._f.close()
+        existing = self.segments()
+        last = existing[-1][0] if existing else 0
+        self.seq = max(self.seq, last) + 1
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._f = open(self._segment_path(self.seq), "ab")
+        self.records_in_segment = 0
+        return self.seq
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        """
+        多筆 record 一次 write / flush（/ fsync）
+        """
+        if not records:
+            return
+        if self._f is None:
+            self.roll()
+        self._f.write(b"".join(json.dumps(r, separators=(",", ":")).encode() + b"\n" for r in records))
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+        self.records_in_segment += len(records)
+
+    def drop_before(self, seq):
+        """
+        刪除 seq 之前的 segment（內容已經寫進 snapshot）
+        """
+        for s, path in self.segments():
+            if s < seq:
+                os.remove(path)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
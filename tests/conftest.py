@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# server / client 的模組都是在自己的目錄下直接 import（和 start_*.sh 一樣）
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, "server"), os.path.join(ROOT_DIR, "player_client"),
+             os.path.join(ROOT_DIR, "developer_client")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,75 @@
+import os
+import stat
+import zipfile
+
+import pytest
+
+from common.blobstore import BlobStore, replace_with_link
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def test_put_file_dedups_and_hardlinks(tmp_path, blobs):
+    a = tmp_path / "a.zip"
+    b = tmp_path / "b.zip"
+    a.write_bytes(b"same content")
+    b.write_bytes(b"same content")
+    digest = blobs.put_file(str(a))
+    assert blobs.put_file(str(b)) == digest
+
+    blob = blobs.path(digest)
+    assert os.path.samefile(a, blob) and os.path.samefile(b, blob)
+    assert os.stat(blob).st_nlink == 3
+    # blob 唯讀，hardlink 出去的檔案不能被原地改寫
+    assert not os.stat(blob).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert os.listdir(blobs.tmp_dir) == []
+
+
+def test_ingest_zip_stores_each_file_once(tmp_path, blobs):
+    v1 = make_zip(tmp_path / "g_1.0.zip", {"game_server.py": "server v1", "assets/logo.txt": "logo"})
+    v2 = make_zip(tmp_path / "g_1.1.zip", {"game_server.py": "server v2", "assets/logo.txt": "logo"})
+    files1 = blobs.ingest_zip(v1)
+    files2 = blobs.ingest_zip(v2)
+    assert files1["assets/logo.txt"] == files2["assets/logo.txt"]
+    assert files1["game_server.py"]["sha256"] != files2["game_server.py"]["sha256"]
+    stored = [name for d in os.listdir(blobs.root) if d != "tmp" for name in os.listdir(os.path.join(blobs.root, d))]
+    assert len(stored) == 3
+    assert os.path.exists(v1 + ".files.json")
+
+
+def test_materialize_links_every_file(tmp_path, blobs):
+    files = blobs.ingest_zip(make_zip(tmp_path / "g.zip", {"game_server.py": "srv", "sub/data.txt": "d"}))
+    target = str(tmp_path / "runtime" / "g" / "1.0")
+    blobs.materialize(files, target)
+    for rel, entry in files.items():
+        assert os.path.samefile(os.path.join(target, rel), blobs.path(entry["sha256"]))
+    assert not os.path.exists(target + ".tmp")
+
+
+def test_materialize_rejects_paths_outside_target(tmp_path, blobs):
+    files = blobs.ingest_zip(make_zip(tmp_path / "g.zip", {"game_server.py": "srv"}))
+    evil = {"../escape.py": files["game_server.py"]}
+    with pytest.raises(ValueError):
+        blobs.materialize(evil, str(tmp_path / "runtime" / "g"))
+    assert not (tmp_path / "runtime" / "escape.py").exists()
+
+
+def test_replace_with_link_is_idempotent(tmp_path, blobs):
+    src = tmp_path / "src.zip"
+    src.write_bytes(b"x")
+    dst = tmp_path / "dst.zip"
+    dst.write_bytes(b"old")
+    replace_with_link(str(src), str(dst))
+    replace_with_link(str(src), str(dst))
+    assert os.path.samefile(src, dst)
+    assert sorted(os.listdir(tmp_path)) == ["blobs", "dst.zip", "src.zip"]
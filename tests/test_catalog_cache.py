@@ -0,0 +1,79 @@
+import json
+
+import lobby_client
+import lobby_server
+from lobby_paging import encode_cursor
+
+
+class FakeStorage:
+    def __init__(self, count):
+        self.summaries = [{
+            "game_key": f"dev_g{i:03d}", "name": f"g{i:03d}", "developer": "dev", "description": "",
+            "latest_version": "1.0", "rating_sum": 0, "rating_count": 0
+        } for i in range(count)]
+
+    def catalog_revision(self):
+        return 7
+
+    def list_game_summaries(self):
+        return list(self.summaries)
+
+
+class RecordingConn:
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+
+def test_default_fetch_games_uses_cached_first_page(monkeypatch):
+    monkeypatch.setattr(lobby_server, "STORAGE", FakeStorage(250))
+    monkeypatch.setitem(lobby_server.CATALOG_CACHE, "revision", None)
+    first_pages = []
+
+    def send_request(req):
+        conn = RecordingConn()
+        lobby_server.handle_get_games(dict(req), conn)
+        if not req.get("cursor"):
+            first_pages.append(conn.sent[0])
+        return json.loads(conn.sent[0].decode())
+
+    monkeypatch.setattr(lobby_client, "send_request", send_request)
+    for _ in range(2):
+        # 新的 client（沒有本地快取）
+        monkeypatch.setattr(lobby_client, "CATALOG_CACHE", {"revision": None, "games": []})
+        games = lobby_client.fetch_games()
+        assert [g["game_key"] for g in games] == [s["game_key"] for s in lobby_server.STORAGE.summaries]
+
+    cached = lobby_server.CATALOG_CACHE["payloads"][("default", lobby_client.GAME_PAGE)]
+    # 第二個 client 拿到的就是快取裡 encode 好的同一份 bytes，沒有重新組
+    assert first_pages[0] == cached
+    assert first_pages[1] is cached
+
+
+def get_games(req):
+    conn = RecordingConn()
+    lobby_server.handle_get_games(req, conn)
+    return json.loads(conn.sent[0].decode())
+
+
+def test_current_revision_does_not_hide_filtered_queries(monkeypatch):
+    monkeypatch.setattr(lobby_server, "STORAGE", FakeStorage(30))
+    monkeypatch.setitem(lobby_server.CATALOG_CACHE, "revision", None)
+    assert get_games({"action": "get_games", "revision": 7})["status"] == "not_modified"
+
+    res = get_games({"action": "get_games", "revision": 7, "q": "g01"})
+    assert res["status"] == "ok"
+    assert [g["game_key"] for g in res["games"]] == [f"dev_g01{i}" for i in range(10)]
+    res = get_games({"action": "get_games", "revision": 7, "developer": "nobody"})
+    assert res["status"] == "ok" and res["games"] == []
+    res = get_games({"action": "get_games", "revision": 7, "sort": "name", "limit": 5})
+    assert res["status"] == "ok" and len(res["games"]) == 5
+
+
+def test_list_players_rejects_non_string_cursor():
+    for after in (5, {"pos": 1}, ["a"]):
+        conn = RecordingConn()
+        lobby_server.handle_list_players({"action": "list_players", "cursor": encode_cursor(after)}, conn)
+        assert json.loads(conn.sent[0].decode()) == {"status": "error", "message": "invalid cursor"}
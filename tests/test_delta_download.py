@@ -0,0 +1,107 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import lobby_client
+import lobby_server
+from common.blobstore import BlobStore
+
+V1 = {"game_server.py": "server v1", "game_client.py": "client", "assets/logo.txt": "logo"}
+V2 = {"game_server.py": "server v2", "game_client.py": "client", "assets/logo.txt": "logo", "rules.txt": "new"}
+
+
+class StreamConn:
+    """
+    把 handler 的串流回覆（header + raw bytes）收在記憶體
+    """
+
+    def __init__(self):
+        self.header = None
+        self.body = b""
+
+    def send_header(self, header):
+        self.header = header
+
+    def send_raw(self, data):
+        self.body += data
+
+    def sendfile(self, f, offset=0, count=None):
+        f.seek(offset)
+        self.body += f.read(count)
+
+
+class FakeStorage:
+    def __init__(self, versions):
+        self.versions = versions
+
+    def get_game(self, game_key):
+        if game_key != "dev_g":
+            return None
+        return {"versions": {v: {"file_path": path} for v, path in self.versions.items()}}
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+@pytest.fixture
+def delta(tmp_path, monkeypatch):
+    blobs = BlobStore(str(tmp_path / "blobs"))
+    versions = {}
+    for version, files in (("1.0", V1), ("1.1", V2)):
+        versions[version] = make_zip(tmp_path / f"dev_g_{version}.zip", files)
+        blobs.ingest_zip(versions[version])
+    monkeypatch.setattr(lobby_server, "STORAGE", FakeStorage(versions))
+    monkeypatch.setattr(lobby_server, "BLOBS", blobs)
+
+    client_dir = tmp_path / "client"
+    (client_dir / "downloads" / "alice").mkdir(parents=True)
+    make_zip(client_dir / "downloads" / "alice" / "dev_g_1.0.zip", V1)
+    monkeypatch.setattr(lobby_client, "BASE_DIR", str(client_dir))
+
+    sent = []
+
+    def send_stream_request(req):
+        conn = StreamConn()
+        lobby_server.handle_download_delta(dict(req), conn)
+        sent.append(conn.header)
+        return io.BytesIO(), io.BytesIO(conn.body), conn.header
+
+    monkeypatch.setattr(lobby_client, "send_stream_request", send_stream_request)
+    return client_dir / "downloads" / "alice", sent
+
+
+def test_delta_sends_only_changed_files_and_assembles_new_version(delta):
+    downloads, sent = delta
+    assert lobby_client.download_delta("alice", "dev_g", "1.0", "1.1")
+
+    assert sorted(item["path"] for item in sent[0]["delta"]) == ["game_server.py", "rules.txt"]
+    target = downloads / "dev_g" / "1.1"
+    for name, data in V2.items():
+        assert (target / name).read_text() == data
+    assert not os.path.exists(f"{target}.tmp")
+
+
+def test_delta_fails_when_local_base_is_corrupt(delta):
+    downloads, _ = delta
+    base = lobby_client.ensure_game_unzipped_for_player("alice", "dev_g", "1.0")
+    with open(os.path.join(base, "assets", "logo.txt"), "w") as f:
+        f.write("tampered")
+
+    # 本地舊版本對不上，交給呼叫端改下載完整 zip，不會組出壞掉的版本
+    assert not lobby_client.download_delta("alice", "dev_g", "1.0", "1.1")
+    assert not (downloads / "dev_g" / "1.1").exists()
+
+
+def test_delta_unknown_base_version_is_an_error(delta):
+    _, sent = delta
+    assert not lobby_client.download_delta("alice", "dev_g", "0.9", "1.1")
+    assert sent == []
+    conn = StreamConn()
+    lobby_server.handle_download_delta({"game_key": "dev_g", "version": "1.1", "from_version": "0.9"}, conn)
+    assert conn.header == {"status": "error", "message": "base version: version not exists"}
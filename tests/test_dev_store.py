@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+import dev_store
+from dev_store import DevStore
+
+
+class FlakyStorage:
+    """
+    write_batch 依 errors 依序丟出例外（None = 成功）；rejects 裡的 game_key 永遠寫不進去
+    """
+
+    def __init__(self, errors=(), rejects=()):
+        self.errors = list(errors)
+        self.rejects = set(rejects)
+        self.written = []
+        self.calls = 0
+
+    def list_developers(self):
+        return {}
+
+    def list_game_summaries(self):
+        return []
+
+    def write_batch(self, ops):
+        self.calls += 1
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        for method, args, _ in ops:
+            if args and args[0] in self.rejects:
+                raise sqlite3.IntegrityError(f"rejected {args[0]}")
+        self.written.extend(ops)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(dev_store, "FLUSH_RETRY", 0)
+
+
+def game(developer="dev"):
+    return {"developer": developer, "name": "g", "description": ""}
+
+
+def test_rejected_change_is_dropped_without_wedging_the_flusher():
+    storage = FlakyStorage(rejects={"dev_bad"})
+    store = DevStore(storage)
+    good = store.put_game("dev_good", game())
+    bad = store.put_game("dev_bad", game())
+    after = store.put_game("dev_after", game())
+    store.flush()
+
+    assert [args[0] for _, args, _ in storage.written] == ["dev_good", "dev_after"]
+    assert store.wait(good, timeout=0)
+    assert not store.wait(bad, timeout=0)
+    assert not store.wait(good, bad, timeout=0)
+    assert store.wait(after, timeout=0)
+
+    # 之後的修改照常寫入
+    later = store.put_game("dev_later", game())
+    store.flush()
+    assert store.wait(later, timeout=0)
+    assert storage.written[-1][1][0] == "dev_later"
+
+
+def test_transient_errors_are_retried():
+    storage = FlakyStorage(errors=[OSError("disk busy"), sqlite3.OperationalError("database is locked")])
+    store = DevStore(storage)
+    ticket = store.put_game("dev_g", game())
+    store.flush()
+    assert storage.calls == 3
+    assert store.wait(ticket, timeout=0)
+
+
+def test_persistent_transient_error_fails_the_batch_after_bounded_attempts():
+    storage = FlakyStorage(errors=[OSError("disk full")] * 100)
+    store = DevStore(storage)
+    tickets = [store.put_game(f"dev_g{i}", game()) for i in range(3)]
+    store.flush()
+    assert storage.calls == dev_store.FLUSH_ATTEMPTS
+    assert not any(store.wait(t, timeout=0) for t in tickets)
+    assert store.flushed_seq == tickets[-1]
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+import download_mirror
+
+
+class FakeStorage:
+    def __init__(self, latest):
+        self.latest = latest
+
+    def list_game_summaries(self):
+        return [{"game_key": "dev_g", "active": True, "latest_version": self.latest}]
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_mirror, "MIRROR_DIR", str(tmp_path / "mirror"))
+    monkeypatch.setattr(download_mirror, "LEDGER_FILE", str(tmp_path / "download_mirror.json"))
+    monkeypatch.setattr(download_mirror, "JOURNAL_FILE", str(tmp_path / "download_mirror.journal"))
+    src = tmp_path / "dev_g_1.0.zip"
+    src.write_bytes(b"v1")
+    return tmp_path, str(src)
+
+
+def test_default_mirror_dir_is_not_the_client_download_dir():
+    client_dir = os.path.join(download_mirror.ROOT_DIR, "player_client", "downloads")
+    assert not os.path.abspath(download_mirror.MIRROR_DIR).startswith(client_dir)
+
+
+def test_gc_removes_stale_mirror_but_not_client_downloads(mirror):
+    tmp_path, src = mirror
+    client_zip = tmp_path / "downloads" / "alice" / "dev_g_1.0.zip"
+    client_zip.parent.mkdir(parents=True)
+    client_zip.write_bytes(b"v1")
+
+    dst = download_mirror.mirror_download("alice", "dev_g", "1.0", src, policy="copy")
+    assert download_mirror.collect_garbage(FakeStorage("1.0")) == []
+    assert os.path.exists(dst)
+
+    removed = download_mirror.collect_garbage(FakeStorage("2.0"))
+    assert removed == [(dst, "outdated version")]
+    assert not os.path.exists(dst)
+    # client 的舊版本 zip（delta 下載的 base）不受影響
+    assert client_zip.read_bytes() == b"v1"
+    assert download_mirror.load_ledger() == {"players": {}}
+
+
+def test_gc_skips_files_the_mirror_did_not_create(mirror, monkeypatch):
+    tmp_path, src = mirror
+    # LOBBY_MIRROR_DIR 指到 client 的目錄：client 之後用自己下載的檔案（新的 inode）蓋掉同一個路徑
+    monkeypatch.setattr(download_mirror, "MIRROR_DIR", str(tmp_path / "downloads"))
+    dst = download_mirror.mirror_download("alice", "dev_g", "1.0", src, policy="copy")
+    part = f"{dst}.part"
+    with open(part, "wb") as f:
+        f.write(b"v1")
+    os.replace(part, dst)
+
+    assert download_mirror.collect_garbage(FakeStorage("2.0")) == []
+    assert os.path.exists(dst)
+    assert download_mirror.load_ledger() == {"players": {}}
+
+
+def test_gc_keeps_files_from_entries_without_identity(mirror):
+    tmp_path, _ = mirror
+    old = tmp_path / "mirror" / "bob" / "dev_g_1.0.zip"
+    old.parent.mkdir(parents=True)
+    old.write_bytes(b"v1")
+    # 舊版紀錄沒有 path / inode，沒辦法確認檔案是 mirror 建立的
+    (tmp_path / "download_mirror.json").write_text(json.dumps({"players": {"bob": {
+        "dev_g_1.0.zip": {"game_key": "dev_g", "version": "1.0", "created_at": 0}}}}))
+
+    assert download_mirror.collect_garbage(FakeStorage("2.0")) == []
+    assert old.exists()
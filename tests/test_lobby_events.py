@@ -0,0 +1,16 @@
+import socket
+import struct
+
+import lobby_events
+from lobby_protocol import FramedConn
+
+
+def test_send_timeout_uses_native_timeval(monkeypatch):
+    monkeypatch.setattr(lobby_events, "SEND_TIMEOUT", 2.5)
+    a, b = socket.socketpair()
+    with a, b:
+        lobby_events.set_send_timeout(FramedConn(a))
+        raw = a.getsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.calcsize("ll"))
+        assert struct.unpack("ll", raw) == (2, 500000)
+        # 讀取仍然是 blocking（沒有被改成 settimeout）
+        assert a.gettimeout() is None
@@ -0,0 +1,90 @@
+import json
+import socket
+import threading
+
+import pytest
+
+import lobby_protocol
+from common.framing import FrameError, encode_frame, read_frame
+from lobby_protocol import LegacyDecoder, serve_connection
+
+
+def serve(dispatch):
+    """
+    回傳 client 端的 socket；server 端在另一個 thread 跑 serve_connection
+    """
+    client, server = socket.socketpair()
+    client.settimeout(5)
+    threading.Thread(target=serve_connection, args=(server, "test", dispatch), daemon=True).start()
+    return client
+
+
+def recv_all(sock):
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def broken_stream(req, conn):
+    if req["action"] == "download":
+        conn.send_header({"status": "ok", "size": 10})
+        conn.send_raw(b"12345")
+        raise RuntimeError("disk went away")
+    raise KeyError(req["action"])
+
+
+def test_failure_before_streaming_gets_json_error():
+    client = serve(broken_stream)
+    client.sendall(encode_frame(json.dumps({"action": "other"}).encode()))
+    assert json.loads(read_frame(client)) == {"status": "error", "message": "internal error"}
+    client.close()
+
+
+def test_failure_mid_stream_closes_instead_of_writing_json():
+    client = serve(broken_stream)
+    client.sendall(encode_frame(json.dumps({"action": "download"}).encode()))
+    assert json.loads(read_frame(client)) == {"status": "ok", "size": 10}
+    # 只有已經送出的 raw bytes，接著 EOF；沒有 JSON 插在檔案內容裡
+    assert recv_all(client) == b"12345"
+    client.close()
+
+
+def test_legacy_failure_mid_stream_closes_instead_of_writing_json():
+    client = serve(broken_stream)
+    client.sendall(json.dumps({"action": "download"}).encode())
+    assert recv_all(client) == b'{"status": "ok", "size": 10}\n12345'
+    client.close()
+
+
+def test_legacy_decoder_caps_incomplete_buffer(monkeypatch):
+    monkeypatch.setattr(lobby_protocol, "MAX_FRAME", 64)
+    decoder = LegacyDecoder()
+    assert decoder.feed(b'{"action": "a", "pad": "') == []
+    with pytest.raises(FrameError):
+        for _ in range(10):
+            decoder.feed(b"x" * 16)
+
+
+def test_legacy_decoder_splits_and_replaces_invalid_utf8():
+    decoder = LegacyDecoder()
+    raw = json.dumps({"action": "chat", "message": "中文"}, ensure_ascii=False).encode()
+    # 多 byte 字元被切在兩段之間
+    assert decoder.feed(raw[:-4]) == []
+    assert decoder.feed(raw[-4:]) == [{"action": "chat", "message": "中文"}]
+    assert decoder.feed(b'{"action": "x", "name": "\xc3\x28"} {"action": "y"}') == [
+        {"action": "x", "name": "�("}, {"action": "y"}]
+
+
+def test_oversized_legacy_request_closes_connection(monkeypatch):
+    monkeypatch.setattr(lobby_protocol, "MAX_FRAME", 1024)
+    client = serve(broken_stream)
+    client.sendall(b'{"action": "a", "pad": "' + b"x" * 4096)
+    # server 斷線時還有沒讀的資料，client 可能收到 EOF 或 RST
+    try:
+        assert recv_all(client) == b""
+    except ConnectionResetError:
+        pass
+    client.close()
@@ -0,0 +1,29 @@
+from lobby_rooms import RoomManager
+
+
+def make_room(room_id, player):
+    return {"room_id": room_id, "game": "dev_g", "players": [player]}
+
+
+def test_free_ids_bounded_across_create_delete_cycles():
+    rooms = RoomManager()
+    rooms.set(rooms.smallest_free_id(), make_room(1, "keeper"))
+    for i in range(1000):
+        rid = rooms.smallest_free_id()
+        assert rid == 2
+        rooms.set(rid, make_room(rid, f"p{i}"))
+        rooms.remove(rid)
+    assert len(rooms.free_ids) <= 1
+    assert rooms.smallest_free_id() == 2
+
+
+def test_smallest_free_id_fills_holes():
+    rooms = RoomManager([make_room(1, "a"), make_room(4, "b")])
+    assert rooms.smallest_free_id() == 2
+    rooms.set(2, make_room(2, "c"))
+    rooms.set(3, make_room(3, "d"))
+    assert rooms.smallest_free_id() == 5
+    rooms.remove(3)
+    rooms.remove(2)
+    assert rooms.smallest_free_id() == 2
+    assert sorted(rooms.free_ids) == [2, 3]
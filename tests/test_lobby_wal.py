@@ -0,0 +1,73 @@
+import json
+import os
+
+from lobby_state import LobbyState
+
+
+def open_state(tmp_path):
+    state = LobbyState(
+        paths={
+            "players": str(tmp_path / "players.json"),
+            "rooms": str(tmp_path / "rooms.json"),
+            "chats": str(tmp_path / "room_chats.json"),
+            "play_history": str(tmp_path / "play_history.json"),
+        },
+        wal_dir=str(tmp_path / "wal"),
+    )
+    replayed = state.load()
+    return state, replayed
+
+
+def segments(tmp_path):
+    return sorted(os.listdir(tmp_path / "wal"))
+
+
+def populate(state):
+    state.set_player("alice", {"password": "a", "online": True, "last_seen": 1})
+    state.set_player("bob", {"password": "b", "online": False, "last_seen": 2})
+    state.put_room({"room_id": 1, "game": "dev_g", "players": ["alice"]})
+    state.add_play_record("alice", "dev_g")
+    state.add_play_record("alice", "dev_g")   # 已經有的紀錄不會再寫一筆
+
+
+def test_restart_replays_wal_without_snapshot(tmp_path):
+    state, _ = open_state(tmp_path)
+    populate(state)
+    state.wal.close()   # crash：沒有 compaction
+
+    state, replayed = open_state(tmp_path)
+    assert replayed == 4
+    assert set(state.players) == {"alice", "bob"}
+    assert state.get_room(1)["players"] == ["alice"]
+    assert state.has_played("alice", "dev_g")
+    assert not os.path.exists(tmp_path / "players.json")
+
+
+def test_compaction_writes_snapshot_and_drops_old_segments(tmp_path):
+    state, _ = open_state(tmp_path)
+    populate(state)
+    assert state.compact() == 3
+    assert segments(tmp_path) == ["000002.log"]
+    with open(tmp_path / "players.json") as f:
+        snapshot = json.load(f)
+    assert set(snapshot["players"]) == {"alice", "bob"} and snapshot["wal_seq"] == 2
+    # compaction 之後的修改只在新的 segment
+    state.remove_room(1)
+    state.wal.close()
+
+    state, replayed = open_state(tmp_path)
+    assert replayed == 1
+    assert state.get_room(1) is None
+    assert set(state.players) == {"alice", "bob"}
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    state, _ = open_state(tmp_path)
+    populate(state)
+    state.wal.close()
+    with open(tmp_path / "wal" / "000001.log", "ab") as f:
+        f.write(b'["players","set","carol",{"passw')
+
+    state, replayed = open_state(tmp_path)
+    assert replayed == 4
+    assert "carol" not in state.players
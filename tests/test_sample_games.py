@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from common.game_package import CONFIG_FILE, parse_config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 範例遊戲的 game_server 接受的人數（固定人數）
+SAMPLES = {
+    "three_game": 3,
+    "gui_game": 2,
+    "cli_game": 2,
+    "snack_game": 2,
+    "game/three_game": 3,
+    "game/gui_game": 2,
+    "game/cli_game": 2,
+}
+
+
+def test_every_sample_game_is_listed():
+    found = set()
+    for dirpath, _, files in os.walk(ROOT_DIR):
+        if "game_server.py" in files and "game_runtime" not in dirpath and "downloads" not in dirpath:
+            found.add(os.path.relpath(dirpath, ROOT_DIR))
+    assert found == set(SAMPLES)
+
+
+@pytest.mark.parametrize("sample, players", sorted(SAMPLES.items()))
+def test_sample_game_declares_player_limits(sample, players):
+    with open(os.path.join(ROOT_DIR, sample, CONFIG_FILE), "rb") as f:
+        _, limits = parse_config(f.read())
+    assert limits == {"min": players, "max": players}
@@ -0,0 +1,91 @@
+import types
+
+import pytest
+
+import common.sessions as sessions_mod
+from common.sessions import PresenceBatcher, SessionTable
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions_mod, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def test_session_expires_after_ttl_without_activity(clock):
+    table = SessionTable(ttl=60)
+    token = table.create("alice")
+    clock.now += 59
+    assert table.expire() == []
+    assert table.validate(token) == "alice"
+
+    # 活動過的 session 在原本的 deadline 不會過期，只是延後再檢查
+    clock.now += 30
+    assert table.expire() == []
+    assert table.is_active("alice")
+
+    clock.now += 61
+    assert table.validate(token) is None
+    assert table.expire() == ["alice"]
+    assert not table.is_active("alice")
+    assert table.expire() == []
+
+
+def test_heartbeats_do_not_grow_the_deadline_heap(clock):
+    table = SessionTable(ttl=60)
+    tokens = [table.create(f"p{i}") for i in range(10)]
+    for _ in range(100):
+        clock.now += 1
+        for token in tokens:
+            table.validate(token)
+        table.expire()
+    assert len(table._deadlines) == len(tokens)
+
+
+def test_relogin_and_logout_are_not_reported_as_expired(clock):
+    table = SessionTable(ttl=60)
+    old = table.create("alice")
+    new = table.create("alice")
+    assert table.validate(old) is None
+    bob = table.create("bob")
+    assert table.revoke(bob) == "bob"
+
+    clock.now += 61
+    # alice 舊 token 的 heap 項目直接丟掉，只回報一次；已經登出的 bob 不回報
+    assert table.expire() == ["alice"]
+    assert table.validate(new) is None
+
+
+def test_presence_batcher_keeps_the_last_change_per_user(clock):
+    writes = []
+    presence = PresenceBatcher(writes.append)
+    presence.mark("alice", True)
+    presence.mark("bob", True)
+    presence.mark("alice", False)
+    assert presence.flush() == 2
+    assert writes == [{"alice": (False, 0), "bob": (True, clock.now)}]
+    assert presence.flush() == 0
+
+
+def test_presence_batcher_retries_failed_writes(clock):
+    def fail(changes):
+        raise OSError("disk full")
+
+    presence = PresenceBatcher(fail)
+    presence.mark("alice", True)
+    with pytest.raises(OSError):
+        presence.flush()
+    presence.mark("bob", True)
+    writes = []
+    presence.write = writes.append
+    presence.flush()
+    assert writes == [{"alice": (True, clock.now), "bob": (True, clock.now)}]
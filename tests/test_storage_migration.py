@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import common.migrate_json_to_sqlite as migrate
+from common.storage import SQLiteStorage, open_storage
+
+
+@pytest.fixture
+def legacy(tmp_path, monkeypatch):
+    """
+    tmp_path 底下一份舊的 JSON 部署：database.json + server/players.json、play_history.json
+    """
+    server_dir = tmp_path / "server"
+    server_dir.mkdir()
+    catalog = {
+        "developers": {"dev": {"password": "pw", "online": False, "last_seen": 0}},
+        "games": {"dev_g": {"developer": "dev", "name": "g", "description": "", "active": True,
+                            "versions": {"1.0": {"file": "g.zip"}},
+                            "ratings": [{"player": "alice", "score": 5, "comment": "nice"}]}},
+    }
+    (tmp_path / "database.json").write_text(json.dumps(catalog))
+    (server_dir / "players.json").write_text(json.dumps(
+        {"players": {"alice": {"password": "a", "online": False, "last_seen": 0}}}))
+    (server_dir / "play_history.json").write_text(json.dumps(
+        {"records": [{"player": "alice", "game_key": "dev_g"}]}))
+    monkeypatch.setattr(migrate, "JSON_FILE", str(tmp_path / "database.json"))
+    monkeypatch.setattr(migrate, "SERVER_DIR", str(server_dir))
+    return tmp_path
+
+
+def test_empty_db_imports_legacy_json_on_open(legacy):
+    db = str(legacy / "store.sqlite3")
+    storage = open_storage("sqlite", db)
+
+    assert storage.get_developer("dev")["password"] == "pw"
+    assert "dev_g" in storage.list_games()
+    lobby = storage.load_lobby()
+    assert lobby["players"]["alice"]["password"] == "a"
+    assert lobby["play_history"] == [{"player": "alice", "game_key": "dev_g"}]
+    # 舊資料原封不動，可以直接 rollback
+    assert (legacy / "database.json").exists()
+    assert not (legacy / "server" / "wal").exists()
+
+
+def test_import_runs_once(legacy):
+    db = str(legacy / "store.sqlite3")
+    open_storage("sqlite", db).close()
+    # 第二次啟動（或另一個 server）DB 已經有資料，不會再匯入一次
+    assert not migrate.import_legacy(SQLiteStorage(db))
+    ratings = SQLiteStorage(db)._conn().execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+    assert ratings == 1
+
+
+def test_unreadable_legacy_data_refuses_to_start(legacy):
+    (legacy / "database.json").write_text("{not json")
+    db = str(legacy / "store.sqlite3")
+    with pytest.raises(ValueError):
+        open_storage("sqlite", db)
+    assert SQLiteStorage(db).is_empty()
+
+
+def test_fresh_deployment_starts_empty(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate, "JSON_FILE", str(tmp_path / "database.json"))
+    monkeypatch.setattr(migrate, "SERVER_DIR", str(tmp_path))
+    assert open_storage("sqlite", str(tmp_path / "store.sqlite3")).is_empty()
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+import upload_sessions
+from upload_sessions import UploadSessions, add_range
+
+DATA = bytes(range(256)) * 40
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+def begin(sessions, size=len(DATA)):
+    return sessions.begin("dev", "g_1.0.zip", size, DIGEST, {"action": "upload_game"}, chunk_size=4096)
+
+
+def write_chunk(sessions, upload_id, start, end):
+    with sessions.writing(upload_id, "dev") as sess:
+        assert sess is not None
+        with open(sessions.data_path(upload_id), "r+b") as f:
+            f.seek(start)
+            f.write(DATA[start:end])
+    return sessions.mark(upload_id, start, end)
+
+
+def test_add_range_merges_overlapping_and_adjacent_ranges():
+    ranges = add_range([], 10, 20)
+    ranges = add_range(ranges, 0, 5)
+    ranges = add_range(ranges, 20, 30)
+    assert ranges == [[0, 5], [10, 30]]
+    assert add_range(ranges, 4, 11) == [[0, 30]]
+
+
+def test_begin_resumes_after_restart(tmp_path):
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = begin(sessions)["upload_id"]
+    assert write_chunk(sessions, upload_id, 0, 4096) == 4096
+
+    # server 重啟：新的 UploadSessions 從 session.json 拿回已收到的區間
+    sessions = UploadSessions(str(tmp_path))
+    sess = begin(sessions)
+    assert sess["upload_id"] == upload_id
+    assert sess["ranges"] == [[0, 4096]]
+
+
+def test_claim_requires_every_byte_and_rejects_later_chunks(tmp_path):
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = begin(sessions)["upload_id"]
+    write_chunk(sessions, upload_id, 0, 4096)
+    assert sessions.claim(upload_id, "dev")[1] == "upload incomplete"
+    write_chunk(sessions, upload_id, 4096, len(DATA))
+    assert sessions.claim(upload_id, "other")[1] == "upload not found"
+
+    sess, error = sessions.claim(upload_id, "dev")
+    assert error is None and sess["ranges"] == [[0, len(DATA)]]
+    with open(sessions.data_path(upload_id), "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == DIGEST
+    # commit 開始之後晚到的 chunk 一律拒絕
+    with sessions.writing(upload_id, "dev") as late:
+        assert late is None
+    assert sessions.mark(upload_id, 0, 10) is None
+    assert sessions.claim(upload_id, "dev")[1] == "upload is already being committed"
+
+    sessions.release(upload_id)
+    assert sessions.claim(upload_id, "dev")[1] is None
+
+
+def test_claim_waits_for_chunks_still_being_written(tmp_path):
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = begin(sessions)["upload_id"]
+    write_chunk(sessions, upload_id, 0, len(DATA))
+    entered, finish = threading.Event(), threading.Event()
+    order = []
+
+    def slow_writer():
+        with sessions.writing(upload_id, "dev"):
+            entered.set()
+            finish.wait(5)
+            order.append("writer done")
+
+    t = threading.Thread(target=slow_writer)
+    t.start()
+    entered.wait(5)
+    threading.Timer(0.1, finish.set).start()
+    assert sessions.claim(upload_id, "dev")[1] is None
+    order.append("claimed")
+    t.join()
+    assert order == ["writer done", "claimed"]
+
+
+def test_claim_gives_up_on_a_stalled_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_sessions, "COMMIT_WAIT", 0.05)
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = begin(sessions)["upload_id"]
+    write_chunk(sessions, upload_id, 0, len(DATA))
+    with sessions.writing(upload_id, "dev"):
+        assert sessions.claim(upload_id, "dev")[1] == "upload still receiving chunks, retry commit"
+        # claim 失敗之後 session 沒有卡在 committing
+        assert not sessions.sessions[upload_id]["committing"]
+    assert sessions.claim(upload_id, "dev")[1] is None
+
+
+@pytest.mark.parametrize("active", [False, True])
+def test_cleanup_removes_expired_sessions_but_not_active_ones(tmp_path, active):
+    sessions = UploadSessions(str(tmp_path), ttl=60)
+    upload_id = begin(sessions)["upload_id"]
+    later = time.time() + 120
+    if active:
+        with sessions.writing(upload_id, "dev"):
+            assert sessions.cleanup(now=later) == 0
+        assert (tmp_path / upload_id).exists()
+    else:
+        assert sessions.cleanup(now=later) == 1
+        assert not (tmp_path / upload_id).exists()